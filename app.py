@@ -1,8 +1,9 @@
 import configparser
 import os
 import logging
+import re
 from functools import wraps
-from flask import Flask, render_template, request, session, g, redirect, url_for, flash, get_flashed_messages, abort, jsonify, make_response
+from flask import Flask, render_template, request, session, g, redirect, url_for, flash, get_flashed_messages, abort, jsonify, make_response, Response, send_file
 from flask_login import LoginManager, UserMixin, login_user, logout_user, login_required, current_user
 from flask_mail import Mail, Message
 from flask_wtf.csrf import CSRFProtect
@@ -10,15 +11,21 @@ from itsdangerous import URLSafeTimedSerializer, SignatureExpired
 from werkzeug.security import generate_password_hash, check_password_hash
 from pymysql.err import IntegrityError
 from datetime import datetime
-from pygal.style import Style
-from weasyprint import HTML
 from dotenv import load_dotenv
 import pymysql
-import pygal
 import json
-
-with open('printer_models.json') as f:
-    printer_models_from_file = json.load(f)
+from db_pool import pool_from_env
+from pagination import fetch_keyset_page
+import instrumentation
+from instrumentation import timed
+import metrics
+from user_cache import UserCache
+from chart_cache import ChartCache
+from pdf_jobs import PdfJobs
+from model_resolver import ModelResolver
+import fleet_import
+from streaming import stream_rows, csv_chunks, ndjson_chunks, json_array_chunks
+import usage_rollup
 
 load_dotenv()
 config = configparser.ConfigParser()
@@ -29,6 +36,7 @@ flask_app = config['flask']['app']
 logging.basicConfig(level=logging.INFO)
 
 app = Flask(__name__)
+instrumentation.init_app(app)
 csrf = CSRFProtect(app)
 app.config['ENV'] = flask_env
 app.secret_key = os.environ.get('SECRET_KEY')
@@ -63,19 +71,39 @@ login_manager = LoginManager()
 login_manager.init_app(app)
 login_manager.login_view = 'login'
 
-printer_models = {}
-for model, prefixes in printer_models_from_file.items():
-    for prefix in prefixes:
-        printer_models[prefix] = model
+db_pool = pool_from_env(cursorclass=instrumentation.TimedDictCursor)
+user_cache = UserCache(ttl=int(os.getenv('USER_CACHE_TTL', 30)))
+chart_cache = ChartCache()
+pdf_jobs = PdfJobs()
+pdf_jobs.start()
+model_resolver = ModelResolver()
+
+# Each gunicorn worker counts its own requests. With METRICS_DIR set they share
+# them through files there and a scrape reports all workers, not just its own.
+if os.getenv('METRICS_DIR'):
+    metrics.REGISTRY.share(os.getenv('METRICS_DIR'))
+http_requests = metrics.REGISTRY.counter('app_http_requests_total', 'Requests handled, by endpoint and status.', ('endpoint', 'method', 'status'))
+http_latency = metrics.REGISTRY.histogram('app_http_request_duration_seconds', 'Request latency by endpoint.', ('endpoint',))
+http_queries = metrics.REGISTRY.histogram('app_http_request_queries', 'SQL queries per request by endpoint.', ('endpoint',),
+                                          buckets=(0, 1, 2, 5, 10, 20, 50, 100))
+metrics.REGISTRY.gauge('app_db_pool_connections', 'Pooled database connections by state.', ('state',),
+                       callback=lambda: {('in_use',): db_pool.stats()['in_use'], ('idle',): db_pool.stats()['idle']})
+metrics.REGISTRY.gauge('app_db_pool_max_size', 'Upper limit of the database pool.', callback=lambda: db_pool.max_size)
+metrics.REGISTRY.counter('app_db_pool_waits_total', 'Checkouts that had to wait for a free connection.', callback=lambda: db_pool.stats()['waits'])
+metrics.REGISTRY.counter('app_db_pool_wait_seconds_total', 'Time spent waiting for a free connection.', callback=lambda: db_pool.stats()['wait_time'])
+metrics.REGISTRY.counter('app_db_pool_timeouts_total', 'Checkouts that gave up waiting.', callback=lambda: db_pool.stats()['timeouts'])
 
 def get_db_connection():
-    return pymysql.connect(
-        host=os.getenv('MYSQL_DB_HOST'),
-        user=os.getenv('MYSQL_DB_USER'),
-        password=os.getenv('MYSQL_ROOT_PASSWORD'),
-        db=os.getenv('MYSQL_DATABASE'),
-        cursorclass=pymysql.cursors.DictCursor
-    )
+    # One pooled connection per request, handed back in close_db_connection.
+    if 'db' not in g:
+        g.db = db_pool.acquire()
+    return g.db
+
+@app.teardown_appcontext
+def close_db_connection(exception):
+    connection = g.pop('db', None)
+    if connection is not None:
+        db_pool.release(connection)
 
 def get_user_by_id(user_id):
     try:
@@ -83,11 +111,17 @@ def get_user_by_id(user_id):
     except ValueError:
         return None
 
+    user_data = user_cache.get(user_id)
+    if user_data is not None:
+        return user_data
+
     connection = get_db_connection()
     with connection.cursor() as cursor:
         sql = "SELECT * FROM users WHERE id = %s"
         cursor.execute(sql, (user_id,))
         user_data = cursor.fetchone()
+    if user_data:
+        user_cache.put(user_id, user_data)
     return user_data
 
 
@@ -101,6 +135,7 @@ def update_user_in_db(user_id, login, password, admin, email, first_login_change
         """
         cursor.execute(sql, (login, password, admin, email, first_login_change_pass, user_id))
     connection.commit()
+    user_cache.invalidate(int(user_id))
 
 def get_company_data():
     connection = get_db_connection()
@@ -138,12 +173,7 @@ def catch_all(path):
 
 @login_manager.user_loader
 def load_user(user_id):
-    user_id = int(user_id)
-    connection = get_db_connection()
-    with connection.cursor() as cursor:
-        sql = "SELECT * FROM users WHERE id = %s"
-        cursor.execute(sql, (user_id,))
-        user_data = cursor.fetchone()
+    user_data = get_user_by_id(user_id)
     if user_data:
         return User(user_data['id'], user_data['login'], user_data['password'], user_data['admin'], user_data['email'], user_data['first_login_change_pass'])
     else:
@@ -233,13 +263,14 @@ def confirm_reset(token):
             sql = "UPDATE users SET password = %s WHERE id = 1"
             cursor.execute(sql, (hashed_password,))
             connection.commit()
+        user_cache.invalidate(1)
 
         return 'Password reset!'
     return render_template('confirmreset.html', token=token)
 
 @app.before_request
 def require_login():
-    allowed_routes = ['register_admin', 'login', 'static', 'home', 'logout', 'reset_password', 'confirm_reset']
+    allowed_routes = ['register_admin', 'login', 'static', 'home', 'logout', 'reset_password', 'confirm_reset', 'metrics_endpoint']
     if not current_user.is_authenticated and request.endpoint not in allowed_routes:
         print("Redirecting to login")
         return redirect(url_for('login'))
@@ -251,16 +282,10 @@ def load_logged_in_user():
     if user_id is None:
         g.user = None
     else:
-        user_id = int(user_id)
-        connection = get_db_connection()
-        with connection.cursor() as cursor:
-            sql = "SELECT * FROM users WHERE id = %s"
-            cursor.execute(sql, (user_id,))
-            g.user = cursor.fetchone()
-            app.logger.info('user_id: %s', user_id)
-            app.logger.info('g.user: %s', g.user)
-            if g.user:
-                app.logger.info('first_login_change_pass: %s', g.user['first_login_change_pass'])
+        g.user = get_user_by_id(user_id)
+        app.logger.debug('user_id: %s', user_id)
+        if g.user:
+            app.logger.debug('first_login_change_pass: %s', g.user['first_login_change_pass'])
 
 @app.route('/login', methods=['GET', 'POST'])
 def login():
@@ -311,10 +336,7 @@ def add_printer():
         counter_color = request.form['counter_color']
         counter_black = int(counter_black) if counter_black else 0
         counter_color = int(counter_color) if counter_color else 0
-        prefix = printer_serial_number[:4] if len(printer_serial_number) >= 4 else printer_serial_number
-        if prefix not in printer_models:
-            prefix = printer_serial_number[:6] if len(printer_serial_number) >= 6 else printer_serial_number
-        printer_model = printer_models.get(prefix)
+        printer_model = model_resolver.resolve(printer_serial_number)
         if not printer_model:
             printer_model = request.form['model'] 
 
@@ -347,6 +369,9 @@ def add_printer():
         if result is not None and result['tax_id'] is not None:
             flash('This printer is already assigned to a client.', 'error')
             return redirect(url_for('add_printer'))
+        if result is not None:
+            flash('A printer with this serial number is already in the database.', 'error')
+            return redirect(url_for('add_printer'))
 
         with connection.cursor() as cursor:
             sql = """
@@ -363,7 +388,9 @@ def add_printer():
             INSERT INTO print_history (printers_id, date, counter_black_history, counter_color_history)
             VALUES (%s, %s, %s, %s)
             """
-            cursor.execute(sql, (printer_id, datetime.now(), counter_black, counter_color))
+            initial_reading = (printer_id, datetime.now(), counter_black, counter_color)
+            cursor.execute(sql, initial_reading)
+            usage_rollup.apply_readings(cursor, [initial_reading])
             connection.commit()
 
         flash('Printer, contract, and initial print history added.', 'success')
@@ -374,15 +401,41 @@ def add_printer():
             cursor.execute(sql)
             clients = cursor.fetchall()
 
-        return render_template('add_printer.html', printer_models=printer_models, clients=clients)
+        return render_template('add_printer.html', printer_models=model_resolver.prefixes(), clients=clients)
+
+@app.route('/import_printers', methods=['GET', 'POST'])
+@admin_required
+def import_printers():
+    report = None
+    if request.method == 'POST':
+        upload = request.files.get('file')
+        if not upload or not upload.filename:
+            flash('Choose a CSV or XLSX file to import.', 'error')
+            return redirect(url_for('import_printers'))
+        dry_run = 'dry_run' in request.form
+        try:
+            report = fleet_import.import_fleet(get_db_connection(), fleet_import.read_rows(upload.stream, upload.filename),
+                                               model_resolver, dry_run)
+        except Exception as e:
+            logging.error(f"Fleet import of {upload.filename} failed: {e}")
+            flash('The file could not be imported, check that it is a CSV or XLSX file with a header row.', 'error')
+            return redirect(url_for('import_printers'))
+        if request.accept_mimetypes.best == 'application/json':
+            return jsonify(report)
+    return render_template('import_printers.html', report=report, columns=fleet_import.COLUMNS)
 
 @app.route('/printers', methods=['GET'])
 @admin_required
 def printers():
-    page = request.args.get('page', 1, type=int)
     filter_query = request.args.get('filter', '')
+    after = request.args.get('after', type=int)
+    before = request.args.get('before', type=int)
     per_page = 10
-    offset = (page - 1) * per_page
+    conditions, params = [], []
+    if filter_query:
+        # Prefix match, so the serial_number and model indexes can be used.
+        conditions.append("printers.serial_number LIKE %s OR printers.model LIKE %s")
+        params.extend([filter_query + '%', filter_query + '%'])
     try: # for debugging purposes
         connection = get_db_connection()
         with connection.cursor() as cursor:
@@ -390,17 +443,13 @@ def printers():
             SELECT printers.id, printers.serial_number, printers.model, printers.black_counter, printers.color_counter, clients.company
             FROM printers
             LEFT JOIN clients ON printers.tax_id = clients.tax_id
-            WHERE printers.serial_number LIKE %s OR printers.model LIKE %s
-            ORDER BY printers.id
-            LIMIT %s OFFSET %s
             """
-            cursor.execute(sql, ('%' + filter_query + '%', '%' + filter_query + '%', per_page, offset))
-            printers = cursor.fetchall()
+            printers, prev_cursor, next_cursor = fetch_keyset_page(cursor, sql, conditions, params, 'printers.id', 'id', per_page, after, before)
 
-        return render_template('printers.html', printers=printers, page=page)
+        return render_template('printers.html', printers=printers, prev_cursor=prev_cursor, next_cursor=next_cursor, filter_query=filter_query)
     except Exception as e: # for debugging purposes
         print(f"An error occurred when executing the SQL query: {e}")
-        return render_template('printers.html', printers=[], page=1)
+        return render_template('printers.html', printers=[], prev_cursor=None, next_cursor=None, filter_query=filter_query)
 
 @app.route('/get_printers/<string:tax_id>', methods=['GET'])
 @login_required
@@ -444,8 +493,12 @@ def edit_printer(printer_id):
             black_counter=%s, color_counter=%s, tax_id=%s
             WHERE id=%s
             """
-            cursor.execute(sql, (printer_serial_number, model, assigned, active, contract_id, counter_black, 
-                                 counter_color, tax_id, printer_id))
+            try:
+                cursor.execute(sql, (printer_serial_number, model, assigned, active, contract_id, counter_black, 
+                                     counter_color, tax_id, printer_id))
+            except IntegrityError:
+                flash('A printer with this serial number is already in the database.', 'error')
+                return redirect(url_for('edit_printer', printer_id=printer_id))
             connection.commit()
 
         return redirect(url_for('printers'))
@@ -495,7 +548,9 @@ def register():
         with connection.cursor() as cursor:
             sql = "INSERT INTO users(login, password, admin, email) VALUES (%s, %s, %s, %s)"
             cursor.execute(sql, (login, password, admin, email))
+            user_id = cursor.lastrowid
         connection.commit()
+        user_cache.invalidate(user_id)
 
         flash('User registered.', 'success')
         return redirect(url_for('index'))
@@ -530,16 +585,19 @@ def register_client():
 @app.route('/clients', methods=['GET'])
 @login_required
 def clients():
-    page = request.args.get('page', 1, type=int)
     filter_query = request.args.get('filter', '')
+    after = request.args.get('after')
+    before = request.args.get('before')
     per_page = 10
-    offset = (page - 1) * per_page
+    conditions, params = [], []
+    if filter_query:
+        conditions.append("tax_id LIKE %s OR company LIKE %s")
+        params.extend([filter_query + '%', filter_query + '%'])
     connection = get_db_connection()
     with connection.cursor() as cursor:
-        sql = "SELECT * FROM clients WHERE tax_id LIKE %s OR company LIKE %s ORDER BY tax_id LIMIT %s OFFSET %s"
-        cursor.execute(sql, ('%' + filter_query + '%', '%' + filter_query + '%', per_page, offset))
-        clients = cursor.fetchall()
-    return render_template('clients.html', clients=clients, page=page)
+        sql = "SELECT * FROM clients"
+        clients, prev_cursor, next_cursor = fetch_keyset_page(cursor, sql, conditions, params, 'tax_id', 'tax_id', per_page, after, before)
+    return render_template('clients.html', clients=clients, prev_cursor=prev_cursor, next_cursor=next_cursor, filter_query=filter_query)
 
 @app.route('/edit_client/<string:tax_id>', methods=['GET', 'POST'])
 @admin_required
@@ -613,6 +671,8 @@ def search_clients():
         clients = cursor.fetchall()
     return render_template('search_results.html', clients=clients)
 
+RECENT_READINGS = 10
+
 @app.route('/printer/<int:printer_id>')
 @login_required
 def printer_info(printer_id):
@@ -634,45 +694,56 @@ def printer_info(printer_id):
         cursor.execute(sql, (printer_id,))
         service_requests = cursor.fetchall()
 
+        # Only the latest readings, the monthly figures below come from the
+        # rollup and the full history is on /print_history.
         sql = """
-        SELECT * FROM print_history 
+        SELECT date, counter_black_history, counter_color_history FROM print_history
         WHERE printers_id = %s
+        ORDER BY date DESC, id DESC
+        LIMIT %s
+        """
+        cursor.execute(sql, (printer_id, RECENT_READINGS))
+        print_history = cursor.fetchall()
+
+        sql = """
+        SELECT month, last_counter_black, last_counter_color, black_pages, color_pages, black_cost, color_cost
+        FROM printer_usage_monthly
+        WHERE printer_id = %s
+        ORDER BY month DESC
         """
         cursor.execute(sql, (printer_id,))
-        rows = cursor.fetchall()
-
-        print_history = []
-        for i in range(len(rows)):
-            row = rows[i]
-            if i > 0 and printer['service_contract'] == 1 and printer['price_black'] is not None and printer['price_color'] is not None:
-                prev_row = rows[i - 1]
-                black_diff = row['counter_black_history'] - prev_row['counter_black_history']
-                color_diff = row['counter_color_history'] - prev_row['counter_color_history']
-                black_cost = black_diff * printer['price_black']
-                color_cost = color_diff * printer['price_color']
-                row['black_cost'] = black_cost
-                row['color_cost'] = color_cost
-            print_history.append(row)
-
-        custom_style = Style(
-            font_family='Segoe UI',
-            colors=('#545454', '#80bdff'),
-        )
-        line_chart = pygal.Line(style=custom_style, height=400, width=600, legend_at_bottom=True, show_legend=True)
-        line_chart.title = 'Print History (X-axis: Date, Y-axis: Count)'
-
-        dates = [history['date'] for history in print_history]
-        black_counters = [history['counter_black_history'] for history in print_history]
-        color_counters = [history['counter_color_history'] for history in print_history]
-        line_chart.x_labels = dates
-        line_chart.add('Black Counter', black_counters)
-        line_chart.add('Color Counter', color_counters)
-
-        graph_svg = line_chart.render()
-
-        graph_svg = graph_svg.decode('utf-8')
-
-        return render_template('printer_info.html', printer=printer, service_requests=service_requests, print_history=print_history, graph_svg=graph_svg)
+        monthly_usage = cursor.fetchall()
+
+        return render_template('printer_info.html', printer=printer, service_requests=service_requests, print_history=print_history,
+                               monthly_usage=monthly_usage)
+
+@app.route('/printer/<int:printer_id>/chart.svg')
+@login_required
+def printer_chart(printer_id):
+    connection = get_db_connection()
+    with connection.cursor() as cursor:
+        # A new reading gets a new id, which invalidates the cached chart and the browser's copy.
+        cursor.execute("SELECT MAX(id) AS last_id FROM print_history WHERE printers_id = %s", (printer_id,))
+        last_id = cursor.fetchone()['last_id']
+        etag = chart_cache.etag(printer_id, last_id)
+        if request.if_none_match.contains(etag):
+            response = make_response('', 304)
+        else:
+            def load_rows():
+                cursor.execute("""
+                SELECT date, counter_black_history, counter_color_history FROM print_history
+                WHERE printers_id = %s AND date IS NOT NULL
+                ORDER BY date, id
+                """, (printer_id,))
+                return cursor.fetchall()
+
+            with timed('chart'):
+                svg = chart_cache.chart(printer_id, last_id, load_rows)
+            response = make_response(svg)
+            response.headers['Content-Type'] = 'image/svg+xml'
+    response.set_etag(etag)
+    response.headers['Cache-Control'] = 'private, no-cache'
+    return response
 
 @app.route('/users')
 @admin_required
@@ -694,6 +765,7 @@ def edit_user(user_id):
         admin = request.form['admin'] == 'true'
         email = request.form['email']
         update_user_in_db(user_id, login, password, admin, email)
+        user_cache.invalidate(user_id)
         flash('User details updated.', 'success')
         return redirect(url_for('edit_user', user_id=user_id))
     else:
@@ -750,11 +822,9 @@ def user_profile():
 @app.route('/get_printers/', methods=['GET'])
 @login_required
 def get_all_printers():
-    connection = get_db_connection()
-    with connection.cursor() as cursor:
-        cursor.execute("SELECT * FROM printers")
-        printers = cursor.fetchall()
-    return jsonify(printers)
+    # Streamed from a server-side cursor, rows are encoded like jsonify does.
+    chunks = stream_rows(db_pool, "SELECT * FROM printers ORDER BY id")
+    return Response(json_array_chunks(chunks, app.json.dumps), mimetype='application/json')
 
 @app.route('/service_requests', methods=['GET'])
 @admin_required
@@ -1058,19 +1128,61 @@ def delete_client(tax_id):
 
     return redirect(url_for('index'))
 
+PRINT_HISTORY_COLUMNS = ['id', 'counter_black_history', 'counter_color_history', 'date', 'printers_id']
+
+def parse_date(value):
+    return datetime.strptime(value, '%Y-%m-%d').date()
+
+def print_history_filters():
+    # Invalid values are dropped by request.args.get, same as a missing filter.
+    filters = {
+        'start': request.args.get('start', type=parse_date),
+        'end': request.args.get('end', type=parse_date),
+        'printer': request.args.get('printer', type=int),
+    }
+    conditions, params = [], []
+    if filters['start'] is not None:
+        conditions.append("date >= %s")
+        params.append(filters['start'])
+    if filters['end'] is not None:
+        conditions.append("date <= %s")
+        params.append(filters['end'])
+    if filters['printer'] is not None:
+        conditions.append("printers_id = %s")
+        params.append(filters['printer'])
+    return filters, conditions, params
+
 @app.route('/print_history', methods=['GET'])
 def print_history():
+    after = request.args.get('after', type=int)
+    before = request.args.get('before', type=int)
+    per_page = 50
+    filters, conditions, params = print_history_filters()
     connection = get_db_connection()
     with connection.cursor() as cursor:
-        sql = "SELECT * FROM print_history"
-        cursor.execute(sql)
-        history = cursor.fetchall()
+        sql = f"SELECT {', '.join(PRINT_HISTORY_COLUMNS)} FROM print_history"
+        history, prev_cursor, next_cursor = fetch_keyset_page(cursor, sql, conditions, params, 'id', 'id', per_page, after, before)
 
-    return render_template('print_history.html', history=history)
+    return render_template('print_history.html', history=history, prev_cursor=prev_cursor, next_cursor=next_cursor, filters=filters)
 
-@app.route('/generate_pdf/<int:request_id>', methods=['GET', 'POST'])
-@login_required
-def generate_pdf(request_id):
+@app.route('/print_history/export/<string:fmt>', methods=['GET'])
+def export_print_history(fmt):
+    if fmt not in ('csv', 'ndjson'):
+        abort(404)
+    filters, conditions, params = print_history_filters()
+    sql = f"SELECT {', '.join(PRINT_HISTORY_COLUMNS)} FROM print_history"
+    if conditions:
+        sql += " WHERE " + " AND ".join(conditions)
+    sql += " ORDER BY id"
+    chunks = stream_rows(db_pool, sql, params)
+    if fmt == 'csv':
+        response = Response(csv_chunks(chunks, PRINT_HISTORY_COLUMNS), mimetype='text/csv')
+    else:
+        response = Response(ndjson_chunks(chunks), mimetype='application/x-ndjson')
+    response.headers['Content-Disposition'] = f'attachment; filename=print_history.{fmt}'
+    return response
+
+def service_report_html(request_id):
     connection = get_db_connection()
     with connection.cursor() as cursor:
         sql_company = """
@@ -1085,8 +1197,8 @@ def generate_pdf(request_id):
         SELECT 
             clients.company, clients.address, clients.postal_code, clients.city, clients.tax_id, clients.phone, clients.email,
             printers.serial_number, printers.model, printers.additional_info,
-            (SELECT counter_black_history FROM print_history WHERE printers_id = printers.id ORDER BY date DESC LIMIT 1) as black_print_history,
-            (SELECT counter_color_history FROM print_history WHERE printers_id = printers.id ORDER BY date DESC LIMIT 1) as color_print_history,
+            latest_usage.last_counter_black as black_print_history,
+            latest_usage.last_counter_color as color_print_history,
             service_requests.request_date, service_requests.service_request,
             users.login
         FROM 
@@ -1097,21 +1209,91 @@ def generate_pdf(request_id):
             printers ON service_requests.printer_id = printers.id
         INNER JOIN 
             users ON service_requests.assigned_to = users.id
+        LEFT JOIN
+            printer_usage_monthly latest_usage ON latest_usage.printer_id = printers.id
+            AND latest_usage.month = (SELECT MAX(month) FROM printer_usage_monthly WHERE printer_id = printers.id)
         WHERE 
             service_requests.id = %s
         """
         cursor.execute(sql_request, (request_id,))
         request = cursor.fetchone()
 
-        html = render_template('report.html', company=company, request=request)
+    return render_template('report.html', company=company, request=request)
 
-        pdf = HTML(string=html).write_pdf()
+def pdf_job_info(job_id):
+    return {
+        'job_id': job_id,
+        'status': pdf_jobs.status(job_id),
+        'status_url': url_for('pdf_job_status', job_id=job_id),
+        'download_url': url_for('download_pdf_job', job_id=job_id),
+    }
 
-        response = make_response(pdf)
-        response.headers['Content-Type'] = 'application/pdf'
-        response.headers['Content-Disposition'] = 'inline; filename=output.pdf'
+def valid_job_id(job_id):
+    # Job ids are content hashes and name files in the PDF cache.
+    return re.fullmatch(r'[0-9a-f]{64}', job_id) is not None
+
+@app.route('/generate_pdf/<int:request_id>', methods=['GET', 'POST'])
+@login_required
+def generate_pdf(request_id):
+    # A report that was opened before comes straight from the cache. Anything
+    # else is handed to the PDF workers and answered with 202 and a page that
+    # polls the job and then downloads it, so no app worker waits on a render.
+    html = service_report_html(request_id)
+    with timed('pdf'):
+        job_id = pdf_jobs.submit(html)
+    status = pdf_jobs.status(job_id)
+    if status == 'done':
+        return send_file(pdf_jobs.path(job_id), mimetype='application/pdf', download_name='output.pdf')
+    if status == 'failed':
+        abort(503)
+    response = make_response(render_template('pdf_pending.html', job=pdf_job_info(job_id),
+                                             retry_url=url_for('generate_pdf', request_id=request_id)), 202)
+    response.headers['Retry-After'] = '1'
+    return response
+
+@app.route('/generate_pdf/<int:request_id>/job', methods=['POST'])
+@login_required
+def submit_pdf_job(request_id):
+    job_id = pdf_jobs.submit(service_report_html(request_id))
+    return jsonify(pdf_job_info(job_id)), 202
+
+@app.route('/pdf_jobs/<string:job_id>', methods=['GET'])
+@login_required
+def pdf_job_status(job_id):
+    if not valid_job_id(job_id) or pdf_jobs.status(job_id) is None:
+        abort(404)
+    return jsonify(pdf_job_info(job_id))
+
+@app.route('/pdf_jobs/<string:job_id>/pdf', methods=['GET'])
+@login_required
+def download_pdf_job(job_id):
+    if not valid_job_id(job_id) or pdf_jobs.status(job_id) != 'done':
+        abort(404)
+    return send_file(pdf_jobs.path(job_id), mimetype='application/pdf', download_name='output.pdf')
+
+@app.route('/stats', methods=['GET'])
+@admin_required
+def stats():
+    return jsonify({'db_pool': db_pool.stats(), 'user_cache': user_cache.stats(), 'chart_cache': chart_cache.stats(), 'pdf_jobs': pdf_jobs.stats()})
+
+@app.after_request
+def record_request_metrics(response):
+    timings = instrumentation.current()
+    if timings is not None:
+        endpoint = request.endpoint or 'unknown'
+        http_requests.inc(labels=(endpoint, request.method, str(response.status_code)))
+        http_latency.observe(timings.total(), labels=(endpoint,))
+        http_queries.observe(timings.queries, labels=(endpoint,))
+    return response
 
-        return response
+@app.route('/metrics', methods=['GET'])
+def metrics_endpoint():
+    # Scrapers don't log in, they send METRICS_TOKEN as a bearer token.
+    # Without a token configured the endpoint stays closed.
+    token = os.getenv('METRICS_TOKEN')
+    if not token or request.headers.get('Authorization') != f"Bearer {token}":
+        abort(403)
+    return Response(metrics.REGISTRY.render(), content_type=metrics.CONTENT_TYPE)
 
 @app.route('/knowledge_base')
 def knowledge_base():
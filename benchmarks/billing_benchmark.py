@@ -0,0 +1,71 @@
+# Fleet billing throughput of billing.bill_printers against the per-printer
+# Python loop printer_info uses. Run from the repository root:
+#   python -m benchmarks.billing_benchmark --printers 20000 --readings 30
+import time
+import random
+import argparse
+from decimal import Decimal
+from billing import bill_printers, client_totals
+
+
+def synthetic_fleet(printers, readings, clients=2000, seed=0):
+    rng = random.Random(seed)
+    fleet = []
+    history = []
+    for printer_id in range(1, printers + 1):
+        fleet.append((printer_id, f"SN{printer_id:08d}", f"{rng.randrange(clients):010d}", "Client",
+                      Decimal('0.05'), Decimal('0.25'), Decimal('120.00')))
+        black = rng.randint(0, 2000000)
+        color = rng.randint(0, 500000)
+        for _ in range(readings):
+            black += rng.randint(0, 400)
+            color += rng.randint(0, 100)
+            if rng.random() < 0.001:
+                black = color = rng.randint(0, 100)
+            missing = rng.random() < 0.01
+            history.append((printer_id, None if missing else black, None if missing else color))
+    return fleet, history
+
+
+def bill_per_printer(printers, readings):
+    # The printer_info approach, repeated for every printer: one pass over
+    # its rows with a Python subtraction per reading pair.
+    by_printer = {}
+    for printer_id, black, color in readings:
+        by_printer.setdefault(printer_id, []).append((black, color))
+    bills = []
+    for printer_id, serial_number, tax_id, company, price_black, price_color, lease_rent in printers:
+        rows = by_printer.get(printer_id, [])
+        black_pages = color_pages = 0
+        for i in range(1, len(rows)):
+            if None in rows[i] or None in rows[i - 1]:
+                continue
+            black_pages += rows[i][0] - rows[i - 1][0]
+            color_pages += rows[i][1] - rows[i - 1][1]
+        bills.append((printer_id, tax_id, black_pages * price_black + color_pages * price_color + lease_rent))
+    return bills
+
+
+def measure(bill, printers, readings, rounds):
+    best = None
+    for _ in range(rounds):
+        started = time.perf_counter()
+        bill(printers, readings)
+        elapsed = time.perf_counter() - started
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Fleet billing benchmark.")
+    parser.add_argument('--printers', type=int, default=20000)
+    parser.add_argument('--readings', type=int, default=30, help="readings per printer in the period")
+    parser.add_argument('--rounds', type=int, default=3)
+    args = parser.parse_args()
+
+    printers, readings = synthetic_fleet(args.printers, args.readings)
+    per_printer = measure(bill_per_printer, printers, readings, args.rounds)
+    vectorized = measure(lambda p, r: client_totals(bill_printers(p, r)), printers, readings, args.rounds)
+    print(f"{args.printers} printers, {len(readings)} readings")
+    print(f"per-printer loop:     {per_printer:6.3f}s ({args.printers / per_printer:10,.0f} printers/s)")
+    print(f"billing.bill_printers: {vectorized:6.3f}s ({args.printers / vectorized:10,.0f} printers/s, {per_printer / vectorized:.1f}x)")
@@ -0,0 +1,271 @@
+# End-to-end benchmark against a database filled by benchmarks.fleet_generator:
+# latency of the busiest routes through the Flask app, in process (no gunicorn
+# or network), and the databroker's ingestion rate for generated report files.
+# Results are written as JSON, --compare checks them against an older run.
+# Needs the MySQL settings from .env and WeasyPrint for /generate_pdf. Run
+# from the repository root:
+#   python -m benchmarks.e2e_benchmark --output results.json --compare baseline.json
+import os
+import sys
+import json
+import time
+import random
+import argparse
+import datetime
+import platform
+import tempfile
+import subprocess
+import logging
+from dotenv import load_dotenv
+import migrate
+import usage_rollup
+from benchmarks.fleet_generator import BENCHMARK_USER, write_reports, database_fleet
+
+# Latency figures that may grow by this share before --compare reports them.
+TOLERANCE = 0.2
+
+
+def percentile(values, share):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(share * len(ordered)))]
+
+
+def query_count(server_timing):
+    # From the db entry of the Server-Timing header: db;dur=4.1;desc="3 queries"
+    for part in (server_timing or '').split(', '):
+        if part.startswith('db;') and 'desc="' in part:
+            return int(part.split('desc="')[1].split()[0])
+    return 0
+
+
+def summarize(latencies, queries, elapsed):
+    return {
+        'requests': len(latencies),
+        'requests_per_second': round(len(latencies) / elapsed, 1) if elapsed else None,
+        'mean_ms': round(sum(latencies) / len(latencies) * 1000, 2),
+        'p50_ms': round(percentile(latencies, 0.5) * 1000, 2),
+        'p95_ms': round(percentile(latencies, 0.95) * 1000, 2),
+        'p99_ms': round(percentile(latencies, 0.99) * 1000, 2),
+        'max_ms': round(max(latencies) * 1000, 2),
+        'queries_per_request': round(sum(queries) / len(queries), 1),
+    }
+
+
+def get(client, path):
+    response = client.get(path)
+    while response.status_code == 202:
+        # A PDF still rendering, asked again the way the waiting page does.
+        response.close()
+        time.sleep(0.05)
+        response = client.get(path)
+    return response
+
+
+def benchmark_route(client, paths, warmup=3):
+    for path in paths[:warmup]:
+        get(client, path).close()
+    latencies, queries = [], []
+    started = time.perf_counter()
+    for path in paths:
+        request_started = time.perf_counter()
+        response = get(client, path)
+        latencies.append(time.perf_counter() - request_started)
+        if response.status_code != 200:
+            raise RuntimeError(f"GET {path} answered {response.status_code}")
+        queries.append(query_count(response.headers.get('Server-Timing')))
+        response.close()
+    return summarize(latencies, queries, time.perf_counter() - started)
+
+
+def sample_ids(cursor, sql, count, rng):
+    cursor.execute(sql)
+    ids = [row['id'] for row in cursor.fetchall()]
+    if not ids:
+        raise RuntimeError(f"No rows for {sql}, fill the database with benchmarks.fleet_generator first.")
+    return [rng.choice(ids) for _ in range(count)]
+
+
+def route_paths(connection, requests, rng):
+    with connection.cursor() as cursor:
+        printer_ids = sample_ids(cursor, "SELECT id FROM printers", requests, rng)
+        # generate_pdf needs an assigned request, the report names the technician.
+        report_ids = sample_ids(cursor, "SELECT id FROM service_requests WHERE assigned_to IS NOT NULL", requests, rng)
+        cursor.execute("SELECT COUNT(*) AS count FROM service_requests WHERE active = TRUE")
+        pages = max(1, cursor.fetchone()['count'] // 10)
+        cursor.execute("SELECT DISTINCT LEFT(serial_number, 4) AS prefix FROM printers")
+        prefixes = [row['prefix'] for row in cursor.fetchall()]
+    return {
+        '/printers': ['/printers'] * requests,
+        '/printers?filter=<prefix>': [f"/printers?filter={rng.choice(prefixes)}" for _ in range(requests)],
+        '/printer/<id>': [f"/printer/{printer_id}" for printer_id in printer_ids],
+        '/service_requests': [f"/service_requests?page={rng.randint(1, pages)}" for _ in range(requests)],
+        '/generate_pdf/<id>': [f"/generate_pdf/{report_id}" for report_id in report_ids],
+    }
+
+
+def benchmark_routes(connection, requests, rng, skip=()):
+    import app as webapp
+    with connection.cursor() as cursor:
+        cursor.execute("SELECT id FROM users WHERE login = %s", (BENCHMARK_USER,))
+        user = cursor.fetchone()
+    if user is None:
+        raise RuntimeError(f"No '{BENCHMARK_USER}' user, fill the database with benchmarks.fleet_generator first.")
+    client = webapp.app.test_client()
+    with client.session_transaction() as session:
+        # What login_user stores, without a CSRF token and password hash per run.
+        session['_user_id'] = str(user['id'])
+        session['_fresh'] = True
+        session['user_id'] = user['id']
+
+    results = {}
+    for route, paths in route_paths(connection, requests, rng).items():
+        if route in skip:
+            continue
+        results[route] = benchmark_route(client, paths)
+        logging.info(f"{route}: {results[route]}")
+    return results
+
+
+def ingest_marks(connection, since):
+    # What an ingestion run can change: rows above the highest ids are new,
+    # and service requests from since on may get their times_happend raised.
+    with connection.cursor() as cursor:
+        cursor.execute("SELECT COALESCE(MAX(id), 0) AS id FROM print_history")
+        history = cursor.fetchone()['id']
+        cursor.execute("SELECT COALESCE(MAX(id), 0) AS id FROM service_requests")
+        requests = cursor.fetchone()['id']
+        cursor.execute("SELECT id, times_happend FROM service_requests WHERE request_day >= %s", (since,))
+        times = {row['id']: row['times_happend'] for row in cursor.fetchall()}
+    connection.commit()
+    return history, requests, times
+
+
+def undo_ingest(connection, marks):
+    # Puts the database back the way the ingestion run found it, so the next
+    # run benchmarks the same fleet.
+    history, requests, times = marks
+    with connection.cursor() as cursor:
+        cursor.execute("SELECT DISTINCT printers_id FROM print_history WHERE id > %s", (history,))
+        printer_ids = [row['printers_id'] for row in cursor.fetchall()]
+        cursor.execute("DELETE FROM print_history WHERE id > %s", (history,))
+        cursor.execute("DELETE FROM service_requests WHERE id > %s", (requests,))
+        if times:
+            placeholders = ', '.join(['%s'] * len(times))
+            cursor.execute(f"SELECT id, times_happend FROM service_requests WHERE id IN ({placeholders})", tuple(times))
+            # A day's worth of requests at most, one UPDATE each is fine.
+            changed = [(times[row['id']], row['id']) for row in cursor.fetchall() if row['times_happend'] != times[row['id']]]
+            if changed:
+                cursor.executemany("UPDATE service_requests SET times_happend = %s WHERE id = %s", changed)
+        if printer_ids:
+            usage_rollup.rebuild(cursor, printer_ids)
+    connection.commit()
+    return len(printer_ids)
+
+
+def benchmark_ingest(connection, reports, workers, seed):
+    import databroker
+    from file_ledger import FileLedger
+    fleet = database_fleet(connection)
+    sent_at = datetime.datetime.now().replace(microsecond=0)
+    marks = ingest_marks(connection, sent_at.date())
+    try:
+        with tempfile.TemporaryDirectory() as directory:
+            paths = write_reports(directory, fleet, reports, sent_at=sent_at, seed=seed)
+            ledger = FileLedger(':memory:')
+            pool = databroker.IngestWorkerPool(workers=workers, ledger=ledger)
+            pool.start()
+            try:
+                started = time.perf_counter()
+                for path in paths:
+                    pool.submit(path)
+                pool.drain()
+                elapsed = time.perf_counter() - started
+                records = sum(batcher.records_written for batcher in pool.batchers)
+            finally:
+                pool.shutdown()
+            ingested = len(ledger.processed_paths())
+            ledger.close()
+    finally:
+        undo_ingest(connection, marks)
+    if ingested != len(paths):
+        raise RuntimeError(f"Ingested {ingested} of {len(paths)} report files")
+    return {'files': len(paths), 'records': records, 'workers': workers, 'seconds': round(elapsed, 3),
+            'files_per_second': round(len(paths) / elapsed, 1), 'records_per_second': round(records / elapsed, 1)}
+
+
+def fleet_size(connection):
+    counts = {}
+    with connection.cursor() as cursor:
+        for table in ('clients', 'printers', 'print_history', 'service_requests'):
+            cursor.execute(f"SELECT COUNT(*) AS count FROM {table}")
+            counts[table] = cursor.fetchone()['count']
+    return counts
+
+
+def git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(baseline, results, tolerance=TOLERANCE):
+    # Returns the lines for figures that got worse by more than tolerance:
+    # latencies and queries per request up, ingestion rate down.
+    regressions = []
+    for route, current in results.get('routes', {}).items():
+        previous = baseline.get('routes', {}).get(route)
+        if not previous:
+            continue
+        for figure in ('p50_ms', 'p95_ms', 'queries_per_request'):
+            if previous[figure] and current[figure] > previous[figure] * (1 + tolerance):
+                regressions.append(f"{route} {figure}: {previous[figure]} -> {current[figure]}")
+    current, previous = results.get('ingest'), baseline.get('ingest')
+    if current and previous and current['records_per_second'] < previous['records_per_second'] * (1 - tolerance):
+        regressions.append(f"ingest records_per_second: {previous['records_per_second']} -> {current['records_per_second']}")
+    return regressions
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="End-to-end route and ingestion benchmark.")
+    parser.add_argument('--requests', type=int, default=200, help="requests per route")
+    parser.add_argument('--reports', type=int, default=5000, help="report files for the ingestion run, 0 skips it")
+    parser.add_argument('--ingest-workers', type=int, default=int(os.getenv('DATABROKER_WORKERS', 4)))
+    parser.add_argument('--skip-route', action='append', default=[], metavar='ROUTE', help="e.g. /generate_pdf/<id>, can be repeated")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', default='benchmark_results.json')
+    parser.add_argument('--compare', metavar='BASELINE', help="results of an earlier run, exits with 1 on regressions")
+    parser.add_argument('--tolerance', type=float, default=TOLERANCE)
+    args = parser.parse_args()
+    load_dotenv()
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+    rng = random.Random(args.seed)
+    connection = migrate.connect()
+    try:
+        results = {
+            'created': datetime.datetime.now().isoformat(timespec='seconds'),
+            'commit': git_commit(),
+            'python': platform.python_version(),
+            'fleet': fleet_size(connection),
+            'routes': benchmark_routes(connection, args.requests, rng, args.skip_route),
+        }
+        if args.reports:
+            # Last, the readings and service requests it adds are removed again afterwards.
+            results['ingest'] = benchmark_ingest(connection, args.reports, args.ingest_workers, args.seed)
+            logging.info(f"ingest: {results['ingest']}")
+    finally:
+        connection.close()
+
+    with open(args.output, 'w') as f:
+        json.dump(results, f, indent=2)
+    logging.info(f"Results written to {args.output}.")
+
+    if args.compare:
+        with open(args.compare) as f:
+            regressions = compare(json.load(f), results, args.tolerance)
+        for line in regressions:
+            print(f"REGRESSION {line}")
+        if regressions:
+            sys.exit(1)
+        print(f"No regressions against {args.compare} beyond {args.tolerance:.0%}.")
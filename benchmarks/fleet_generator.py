@@ -0,0 +1,280 @@
+# Synthetic fleet for the end-to-end benchmarks: clients, printers with years
+# of readings, service requests, and report files in the formats the printers
+# e-mail. Fills an empty database migrated by migrate.py, run from the
+# repository root:
+#   python -m benchmarks.fleet_generator --printers 20000 --years 5 --reports temp/bench_reports
+import os
+import json
+import time
+import random
+import datetime
+import argparse
+import logging
+from decimal import Decimal
+from dotenv import load_dotenv
+from werkzeug.security import generate_password_hash
+import migrate
+import usage_rollup
+
+CHUNK_ROWS = 5000
+BENCHMARK_USER = 'benchmark'
+
+COLOR_REPORT = """[Model Name],{model}
+[Serial Number], {serial}
+[Send Date],{send_date}
+[Total Counter],{total:08d}
+[Total Color Counter],{color:08d}
+[Total Black Counter],{black:08d}
+[Total Scan/Fax Counter],00058674
+[Operating Accumulation Time], 0.0, 5.9, 6.0, 14.4, 9.3, 11.7, 8.8,
+9.6, 8.9, 8.9, 8.5, 8.3
+"""
+MONO_REPORT = """[Model Name],{model}
+[Serial Number], {serial}
+[Send Date],{send_date}
+[Total Counter],{total:08d}
+[Total Scan/Fax Counter],00041513
+"""
+ERROR_REPORT = """Occurred Time :{occurred}
+Installed Place :{serial}
+IP Address :192.168.1.245
+Error : {error}
+"""
+ERRORS = ['Misfeed detected. 66-33', 'Toner low (K).', 'Waste toner box full.', 'Paper jam in tray 2. 12-01',
+          'Fuser unit replacement required. C2557', 'Drum unit near end of life (Y).', 'Scanner lamp error. C1004']
+CITIES = [('Warsaw', '00-001'), ('Cracow', '30-001'), ('Gdansk', '80-001'), ('Poznan', '60-001'), ('Wroclaw', '50-001')]
+
+
+def load_models(path='printer_models.json'):
+    with open(path) as f:
+        return [(model, prefix) for model, prefixes in json.load(f).items() for prefix in prefixes]
+
+
+def make_clients(count, rng):
+    clients = []
+    for number in range(1, count + 1):
+        city, postal_code = rng.choice(CITIES)
+        clients.append((f"{number:010d}", f"Client {number:05d}", city, postal_code, f"Street {number}",
+                        f"{rng.randrange(100000000, 999999999)}", f"client{number}@example.com"))
+    return clients
+
+
+def make_printers(count, tax_ids, models, start, rng):
+    # The serial numbers start with a known prefix, so the model resolver and
+    # the databroker treat them like real devices. Colour is decided by the
+    # model name, C models print colour.
+    printers = []
+    for number in range(1, count + 1):
+        model, prefix = rng.choice(models)
+        contract_start = start + datetime.timedelta(days=rng.randrange(365))
+        printers.append({
+            'serial_number': f"{prefix}{number:09d}",
+            'model': model,
+            'color': model.startswith('C'),
+            'tax_id': rng.choice(tax_ids),
+            'service_contract': rng.random() < 0.9,
+            'lease_rent': Decimal(rng.choice(['0.00', '99.00', '120.00', '250.00'])),
+            'price_black': Decimal(rng.choice(['0.02', '0.03', '0.05'])),
+            'price_color': Decimal(rng.choice(['0.15', '0.20', '0.25'])),
+            'contract_start_date': contract_start,
+            'black_counter': rng.randint(0, 2000000),
+            'color_counter': rng.randint(0, 500000),
+        })
+    return printers
+
+
+def readings(printer, start, end, interval, rng):
+    # Monotonic counters with a daily volume per device, the odd missed report
+    # and, rarely, a counter reset after a mainboard swap.
+    black, color = printer['black_counter'], printer['color_counter']
+    black_per_day = rng.randint(5, 400)
+    color_per_day = rng.randint(1, 100) if printer['color'] else 0
+    day = start
+    while day <= end:
+        black += rng.randint(0, black_per_day * 2 * interval)
+        color += rng.randint(0, color_per_day * 2 * interval)
+        if rng.random() < 0.0005:
+            black, color = rng.randint(0, 1000), (rng.randint(0, 100) if printer['color'] else 0)
+        if rng.random() >= 0.01:
+            yield day, black, color
+        day += datetime.timedelta(days=interval)
+    printer['black_counter'], printer['color_counter'] = black, color
+
+
+def make_service_requests(count, printers, user_id, start, end, rng):
+    span = int((end - start).total_seconds())
+    requests = []
+    for _ in range(count):
+        printer_id, printer = rng.choice(printers)
+        requested = start + datetime.timedelta(seconds=rng.randrange(span))
+        active = rng.random() < 0.2
+        assigned = user_id if rng.random() < 0.7 else None
+        requests.append((printer['tax_id'], printer_id, rng.choice(ERRORS), rng.randint(1, 5), assigned, requested, active,
+                         'Not done yet.' if active else 'Part replaced, printer tested.'))
+    return requests
+
+
+def insert_chunks(connection, sql, rows, chunk_rows=CHUNK_ROWS):
+    # One executemany per chunk. pymysql folds an INSERT ... VALUES into one
+    # multi-row statement per chunk, anything else (an UPDATE) would still go
+    # out as one statement per row, so only pass INSERTs.
+    total = 0
+    chunk = []
+    with connection.cursor() as cursor:
+        for row in rows:
+            chunk.append(row)
+            if len(chunk) >= chunk_rows:
+                cursor.executemany(sql, chunk)
+                total += len(chunk)
+                chunk = []
+        if chunk:
+            cursor.executemany(sql, chunk)
+            total += len(chunk)
+    connection.commit()
+    return total
+
+
+def benchmark_user(connection, password):
+    # An admin the benchmark logs in as, created once and reused.
+    with connection.cursor() as cursor:
+        cursor.execute("SELECT id FROM users WHERE login = %s", (BENCHMARK_USER,))
+        row = cursor.fetchone()
+        if row:
+            return row['id']
+        cursor.execute("INSERT INTO users (login, password, admin, first_login_change_pass, email) VALUES (%s, %s, TRUE, FALSE, %s)",
+                       (BENCHMARK_USER, generate_password_hash(password), 'benchmark@example.com'))
+        user_id = cursor.lastrowid
+        cursor.execute("""INSERT IGNORE INTO my_company (id, company_name, tax_id, address, postal_code, city, phone, email)
+                          VALUES (1, 'EngiLab', '0000000000', 'Street 1', '00-001', 'Warsaw', '123456789', 'office@example.com')""")
+    connection.commit()
+    return user_id
+
+
+def populate(connection, clients=2000, printers=20000, years=5, interval=7, service_requests=40000, seed=0,
+             password=BENCHMARK_USER, today=None):
+    rng = random.Random(seed)
+    today = today or datetime.date.today()
+    start = today - datetime.timedelta(days=365 * years)
+    with connection.cursor() as cursor:
+        cursor.execute("SELECT COUNT(*) AS count FROM printers")
+        if cursor.fetchone()['count']:
+            raise RuntimeError("The printers table is not empty, generate the fleet into an empty database.")
+
+    counts = {}
+    started = time.perf_counter()
+    user_id = benchmark_user(connection, password)
+    client_rows = make_clients(clients, rng)
+    counts['clients'] = insert_chunks(connection, "INSERT INTO clients (tax_id, company, city, postal_code, address, phone, email) "
+                                                  "VALUES (%s, %s, %s, %s, %s, %s, %s)", client_rows)
+
+    fleet = make_printers(printers, [client[0] for client in client_rows], load_models(), start, rng)
+    counts['printers'] = insert_chunks(connection, """INSERT INTO printers (serial_number, black_counter, color_counter, model, assigned,
+        tax_id, service_contract, lease_rent, price_black, price_color, contract_start_date, contract_duration)
+        VALUES (%s, %s, %s, %s, TRUE, %s, %s, %s, %s, %s, %s, 36)""",
+        ((p['serial_number'], p['black_counter'], p['color_counter'], p['model'], p['tax_id'], p['service_contract'],
+          p['lease_rent'], p['price_black'], p['price_color'], p['contract_start_date']) for p in fleet))
+    with connection.cursor() as cursor:
+        cursor.execute("SELECT id, serial_number FROM printers")
+        ids = {row['serial_number']: row['id'] for row in cursor.fetchall()}
+    by_id = [(ids[printer['serial_number']], printer) for printer in fleet]
+    logging.info(f"Inserted {clients} clients and {printers} printers in {time.perf_counter() - started:.1f}s.")
+
+    history = ((printer_id, day, black, color) for printer_id, printer in by_id
+               for day, black, color in readings(printer, start, today, interval, rng))
+    counts['print_history'] = insert_chunks(connection, "INSERT INTO print_history (printers_id, date, counter_black_history, counter_color_history) "
+                                                        "VALUES (%s, %s, %s, %s)", history)
+    logging.info(f"Inserted {counts['print_history']} readings in {time.perf_counter() - started:.1f}s.")
+
+    # The printers' counters are their last readings: bulk loaded into a
+    # temporary table and applied with one joined UPDATE.
+    with connection.cursor() as cursor:
+        cursor.execute("CREATE TEMPORARY TABLE printer_counters (id INT PRIMARY KEY, black_counter INT, color_counter INT)")
+    insert_chunks(connection, "INSERT INTO printer_counters (id, black_counter, color_counter) VALUES (%s, %s, %s)",
+                  ((printer_id, printer['black_counter'], printer['color_counter']) for printer_id, printer in by_id))
+    with connection.cursor() as cursor:
+        cursor.execute("""UPDATE printers JOIN printer_counters ON printer_counters.id = printers.id
+                          SET printers.black_counter = printer_counters.black_counter,
+                          printers.color_counter = printer_counters.color_counter""")
+        cursor.execute("DROP TEMPORARY TABLE printer_counters")
+    connection.commit()
+    counts['service_requests'] = insert_chunks(connection, """INSERT INTO service_requests (tax_id, printer_id, service_request, times_happend,
+        assigned_to, request_date, active, done_description) VALUES (%s, %s, %s, %s, %s, %s, %s, %s)""",
+        make_service_requests(service_requests, by_id, user_id, datetime.datetime.combine(start, datetime.time()),
+                              datetime.datetime.combine(today, datetime.time()), rng))
+
+    with connection.cursor() as cursor:
+        counts['usage_months'] = usage_rollup.rebuild(cursor)
+    connection.commit()
+    logging.info(f"Fleet generated in {time.perf_counter() - started:.1f}s: {counts}")
+    return counts
+
+
+def report_texts(fleet, count, sent_at, rng, error_share=0.2):
+    # (file name, content) pairs named the way mailparser spools them. Every
+    # report is a second apart, so no two names clash.
+    for number in range(count):
+        printer = rng.choice(fleet)
+        timestamp = sent_at + datetime.timedelta(seconds=number)
+        if rng.random() < error_share:
+            text = ERROR_REPORT.format(occurred=timestamp.strftime('%d/%m/%Y %H:%M:%S'), serial=printer['serial_number'],
+                                       error=rng.choice(ERRORS))
+        else:
+            printer['black_counter'] += rng.randint(0, 500)
+            black = printer['black_counter']
+            if printer['color']:
+                printer['color_counter'] += rng.randint(0, 100)
+                color = printer['color_counter']
+                text = COLOR_REPORT.format(model=printer['model'], serial=printer['serial_number'], send_date=timestamp.strftime('%d/%m/%y'),
+                                           total=black + color, black=black, color=color)
+            else:
+                text = MONO_REPORT.format(model=printer['model'], serial=printer['serial_number'], send_date=timestamp.strftime('%d/%m/%y'),
+                                          total=black)
+        yield f"{timestamp.strftime('%Y-%m-%d-%H-%M-%S')}-{printer['serial_number']}.txt", text
+
+
+def write_reports(directory, fleet, count, sent_at=None, seed=0):
+    rng = random.Random(seed)
+    sent_at = sent_at or datetime.datetime.now().replace(microsecond=0)
+    os.makedirs(directory, exist_ok=True)
+    paths = []
+    for name, text in report_texts(fleet, count, sent_at, rng):
+        path = os.path.join(directory, name)
+        with open(path, 'w') as f:
+            f.write(text)
+        paths.append(path)
+    return paths
+
+
+def database_fleet(connection):
+    # The printers as write_reports needs them, read back from the database.
+    with connection.cursor() as cursor:
+        cursor.execute("SELECT serial_number, model, black_counter, color_counter FROM printers")
+        return [dict(row, color=bool(row['model'] and row['model'].startswith('C'))) for row in cursor.fetchall()]
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Generate a synthetic printer fleet and report files.")
+    parser.add_argument('--clients', type=int, default=2000)
+    parser.add_argument('--printers', type=int, default=20000)
+    parser.add_argument('--years', type=int, default=5, help="years of readings per printer")
+    parser.add_argument('--interval', type=int, default=7, help="days between readings")
+    parser.add_argument('--service-requests', type=int, default=40000)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--password', default=BENCHMARK_USER, help=f"password of the '{BENCHMARK_USER}' admin user")
+    parser.add_argument('--reports', metavar='DIR', help="also write report files for the generated printers here")
+    parser.add_argument('--report-count', type=int, default=10000)
+    parser.add_argument('--skip-database', action='store_true', help="only write report files, for printers already in the database")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    load_dotenv()
+
+    migrate.migrate()
+    connection = migrate.connect()
+    try:
+        if not args.skip_database:
+            populate(connection, args.clients, args.printers, args.years, args.interval, args.service_requests, args.seed, args.password)
+        if args.reports:
+            paths = write_reports(args.reports, database_fleet(connection), args.report_count, seed=args.seed)
+            logging.info(f"Wrote {len(paths)} report files to {args.reports}.")
+    finally:
+        connection.close()
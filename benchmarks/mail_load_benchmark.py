@@ -0,0 +1,61 @@
+# Offline load test of the mail parser against fake POP3 mailboxes, fetched
+# one after another and then concurrently. Run from the repository root:
+#   python -m benchmarks.mail_load_benchmark --mailboxes 8 --messages 200 --latency 0.005
+import os
+import time
+import datetime
+import tempfile
+import argparse
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from fake_mail_server import FakePOP3Server, make_report_message
+from message_ledger import MessageLedger
+import mailparser
+
+
+def fetch_all(ports, messages, workers):
+    with tempfile.TemporaryDirectory() as temp_dir:
+        cwd = os.getcwd()
+        os.chdir(temp_dir)
+        os.mkdir('temp')
+        try:
+            ledger = MessageLedger(':memory:')
+            mailboxes = [mailparser.Mailbox(f'region{index}', '127.0.0.1', 'user', 'secret', port=port, ssl=False)
+                         for index, port in enumerate(ports)]
+            started = time.perf_counter()
+            with ThreadPoolExecutor(max_workers=workers) as executor:
+                results = list(executor.map(lambda mailbox: mailparser.run_mailbox(mailbox, ledger), mailboxes))
+            elapsed = time.perf_counter() - started
+        finally:
+            os.chdir(cwd)
+    fetched = sum(stats.fetched for stats in results if stats)
+    assert fetched == messages, f"fetched {fetched} of {messages} messages"
+    return elapsed
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Multi-mailbox fetch load test against fake POP3 servers.")
+    parser.add_argument('--mailboxes', type=int, default=8)
+    parser.add_argument('--messages', type=int, default=200, help="messages per mailbox")
+    parser.add_argument('--latency', type=float, default=0.005, help="seconds added to every server reply")
+    args = parser.parse_args()
+    logging.getLogger().setLevel(logging.WARNING)
+
+    sent_at = datetime.datetime(2023, 10, 3, 19, 58, 16, tzinfo=datetime.timezone.utc)
+    servers = [FakePOP3Server([make_report_message(number, f"R{index:02d}N{number:06d}", sent_at)
+                               for number in range(1, args.messages + 1)], latency=args.latency)
+               for index in range(args.mailboxes)]
+    for server in servers:
+        server.__enter__()
+    try:
+        ports = [server.port for server in servers]
+        total = args.mailboxes * args.messages
+        sequential = fetch_all(ports, total, 1)
+        concurrent = fetch_all(ports, total, args.mailboxes)
+    finally:
+        for server in servers:
+            server.__exit__(None, None, None)
+
+    print(f"{args.mailboxes} mailboxes x {args.messages} messages, {args.latency * 1000:.0f}ms per reply")
+    print(f"sequential: {sequential:6.2f}s ({total / sequential:8,.0f} messages/s)")
+    print(f"concurrent: {concurrent:6.2f}s ({total / concurrent:8,.0f} messages/s, {sequential / concurrent:.1f}x)")
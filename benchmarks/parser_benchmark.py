@@ -0,0 +1,94 @@
+# Parse throughput of report_parser against the per-field re.search calls it
+# replaced in mailparser and databroker. Run from the repository root:
+#   python -m benchmarks.parser_benchmark --reports 50000
+import re
+import time
+import datetime
+import random
+import argparse
+import report_parser
+
+COLOR_REPORT = """[Model Name],Envilab
+[Serial Number], {serial}
+[Send Date],01/06/23
+[Total Counter],{total:08d}
+[Total Color Counter],{color:08d}
+[Total Black Counter],{black:08d}
+[Total Scan/Fax Counter],00058674
+[Operating Accumulation Time], 0.0, 5.9, 6.0, 14.4, 9.3, 11.7, 8.8,
+9.6, 8.9, 8.9, 8.5, 8.3
+"""
+MONO_REPORT = """[Model Name],EngiLab
+[Serial Number], {serial}
+[Send Date],03/10/23
+[Total Counter],{total:08d}
+[Total Scan/Fax Counter],00041513
+"""
+ERROR_REPORT = """Occurred Time :02/12/2023 01:46:21
+Installed Place :{serial}
+IP Address :192.168.1.245
+Error : Misfeed detected. 66-33
+"""
+
+
+def synthetic_reports(count, seed=0):
+    rng = random.Random(seed)
+    templates = [COLOR_REPORT, MONO_REPORT, ERROR_REPORT]
+    reports = []
+    for _ in range(count):
+        black = rng.randint(0, 5000000)
+        color = rng.randint(0, 5000000)
+        serial = f"A{rng.randint(0, 0xFFFFFF):06X}{rng.randint(0, 999999):06d}"
+        reports.append(rng.choice(templates).format(serial=serial, black=black, color=color, total=black + color))
+    return reports
+
+
+FILE_NAME = "temp/2023-10-03-19-58-16-A1UG021109838.txt"
+
+
+def parse_per_field(content):
+    # The previous approach: mailparser searched the report twice to name the
+    # spool file, then databroker searched it once per field.
+    for pattern in (r'\[Serial Number\], (.*)', r'Installed Place :(.*)'):
+        re.search(pattern, content)
+    match = re.search(r'\d{4}-\d{2}-\d{2}', FILE_NAME)
+    values = {'date': datetime.datetime.strptime(match.group(), '%Y-%m-%d').date()}
+    for name, pattern in (('serial', r'\[Serial Number\],(.{0,25})'),
+                          ('black', r'\[Total Black Counter\],(\d{0,25})'),
+                          ('color', r'\[Total Color Counter\],(\d{0,25})'),
+                          ('total', r'\[Total Counter\],(\d{0,25})'),
+                          ('place', r'Installed Place :(.{0,25})'),
+                          ('error', r'Error :(.+)')):
+        match = re.search(pattern, content)
+        if match:
+            values[name] = match.group(1).strip()
+    return values
+
+
+def parse_single_pass(content):
+    report = report_parser.parse(content)
+    return report, report_parser.file_date(FILE_NAME)
+
+
+def measure(parse, reports, rounds):
+    best = None
+    for _ in range(rounds):
+        started = time.perf_counter()
+        for content in reports:
+            parse(content)
+        elapsed = time.perf_counter() - started
+        best = elapsed if best is None else min(best, elapsed)
+    return len(reports) / best
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Report parser micro-benchmark.")
+    parser.add_argument('--reports', type=int, default=20000)
+    parser.add_argument('--rounds', type=int, default=5)
+    args = parser.parse_args()
+
+    reports = synthetic_reports(args.reports)
+    per_field = measure(parse_per_field, reports, args.rounds)
+    single_pass = measure(parse_single_pass, reports, args.rounds)
+    print(f"per-field re.search: {per_field:12,.0f} reports/s")
+    print(f"report_parser.parse: {single_pass:12,.0f} reports/s ({single_pass / per_field:.2f}x)")
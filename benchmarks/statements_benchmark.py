@@ -0,0 +1,55 @@
+# Statement rendering throughput: statements.generate against rendering one
+# statement after another in a single process the way generate_pdf does,
+# stylesheet and fonts parsed again for every PDF. Needs WeasyPrint. Run from
+# the repository root:
+#   python -m benchmarks.statements_benchmark --clients 200 --workers 4
+import os
+import time
+import datetime
+import argparse
+import tempfile
+from billing import bill_printers, client_totals
+from statements import build_statements, generate, template_environment, TEMPLATE, STYLESHEET
+from benchmarks.billing_benchmark import synthetic_fleet
+
+START, END = datetime.date(2023, 10, 1), datetime.date(2023, 10, 31)
+COMPANY = {'company_name': 'EngiLab', 'tax_id': '0000000000', 'address': 'Street 1', 'postal_code': '00-001',
+           'city': 'Warsaw', 'email': 'office@example.com', 'phone': '123456789'}
+
+
+def synthetic_statements(clients, printers_per_client):
+    printers, readings = synthetic_fleet(clients * printers_per_client, 30, clients=clients)
+    bills = bill_printers(printers, readings)
+    totals = client_totals(bills)
+    client_rows = {total.tax_id: {'tax_id': total.tax_id, 'company': f"Client {total.tax_id}", 'address': 'Road 2',
+                                  'postal_code': '00-002', 'city': 'Cracow', 'phone': '987654321', 'email': 'client@example.com'}
+                   for total in totals}
+    counters = {bill.printer_id: {'model': 'bizhub C300i', 'last_counter_black': 100000, 'last_counter_color': 20000} for bill in bills}
+    return build_statements(COMPANY, client_rows, counters, bills, totals, START, END)
+
+
+def render_one_by_one(statements):
+    from weasyprint import HTML, CSS
+    template = template_environment().get_template(TEMPLATE)
+    with open(STYLESHEET) as f:
+        stylesheet = f.read()
+    for statement in statements:
+        HTML(string=template.render(**statement)).write_pdf(stylesheets=[CSS(string=stylesheet)])
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Monthly statement rendering benchmark.")
+    parser.add_argument('--clients', type=int, default=200)
+    parser.add_argument('--printers', type=int, default=3, help="printers per client")
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 1)
+    args = parser.parse_args()
+
+    statements = synthetic_statements(args.clients, args.printers)
+    started = time.perf_counter()
+    render_one_by_one(statements)
+    one_by_one = len(statements) / (time.perf_counter() - started)
+    with tempfile.TemporaryDirectory() as temp_dir:
+        parallel = generate(statements, os.path.join(temp_dir, 'statements.zip'), args.workers)
+    print(f"{len(statements)} statements")
+    print(f"one by one:          {one_by_one:8.1f} statements/s")
+    print(f"statements.generate: {parallel:8.1f} statements/s ({args.workers} workers, {parallel / one_by_one:.1f}x)")
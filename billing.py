@@ -0,0 +1,173 @@
+import csv
+import sys
+import calendar
+import datetime
+import argparse
+import logging
+from collections import namedtuple
+import numpy as np
+import pymysql.cursors
+from dotenv import load_dotenv
+from migrate import connect
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+# Every reading in the period plus each printer's last reading before it, the
+# anchor the first delta is taken from. Rows come back grouped by printer and
+# in date order, which is what compute_usage() expects. The anchors are one
+# grouped pass over idx_print_history_printer_date, joined, instead of a
+# MAX(date) subquery per candidate row.
+READINGS_SQL = """
+SELECT h.printers_id, h.counter_black_history, h.counter_color_history
+FROM print_history h
+JOIN printers p ON p.id = h.printers_id
+LEFT JOIN (
+    SELECT printers_id, MAX(date) AS anchor
+    FROM print_history
+    WHERE date < %(start)s
+    GROUP BY printers_id
+) a ON a.printers_id = h.printers_id
+WHERE p.service_contract = 1
+AND h.date <= %(end)s
+AND h.date >= COALESCE(a.anchor, %(start)s)
+ORDER BY h.printers_id, h.date, h.id
+"""
+
+PRINTERS_SQL = """
+SELECT printers.id, printers.serial_number, printers.tax_id, clients.company,
+printers.price_black, printers.price_color, printers.lease_rent
+FROM printers
+LEFT JOIN clients ON printers.tax_id = clients.tax_id
+WHERE printers.service_contract = 1
+ORDER BY printers.id
+"""
+
+PrinterBill = namedtuple('PrinterBill', ['printer_id', 'serial_number', 'tax_id', 'company', 'black_pages', 'color_pages',
+                                         'black_cost', 'color_cost', 'lease_rent', 'total'])
+ClientBill = namedtuple('ClientBill', ['tax_id', 'company', 'printers', 'black_pages', 'color_pages', 'total'])
+
+
+def forward_fill(values, group_starts):
+    # A missing reading (NULL counter) takes the last known reading of the
+    # same printer, so it adds nothing instead of breaking the sequence.
+    index = np.where(np.isnan(values), -1, np.arange(len(values)))
+    np.maximum.accumulate(index, out=index)
+    filled = values[np.maximum(index, 0)]
+    filled[index < group_starts] = np.nan
+    return filled
+
+
+def counter_deltas(values, same_printer):
+    deltas = np.diff(values)
+    # A counter that went down was reset (mainboard swap, firmware update),
+    # so everything it shows now was printed since the previous reading.
+    deltas = np.where(deltas < 0, values[1:], deltas)
+    return np.where(same_printer & ~np.isnan(deltas), deltas, 0)
+
+
+def compute_usage(printer_ids, black, color):
+    # printer_ids, black and color are parallel sequences, grouped by printer
+    # and in date order. Returns (printer ids, black pages, color pages).
+    printer_ids = np.asarray(printer_ids, dtype=np.int64)
+    if not len(printer_ids):
+        return printer_ids, np.zeros(0), np.zeros(0)
+    black = np.asarray(black, dtype=np.float64)
+    color = np.asarray(color, dtype=np.float64)
+
+    same_printer = printer_ids[1:] == printer_ids[:-1]
+    group_starts = np.concatenate(([0], np.flatnonzero(~same_printer) + 1))
+    group = np.cumsum(np.concatenate(([0], ~same_printer)))
+    row_starts = group_starts[group]
+
+    groups = len(group_starts)
+    black_pages = np.bincount(group[1:], weights=counter_deltas(forward_fill(black, row_starts), same_printer), minlength=groups)
+    color_pages = np.bincount(group[1:], weights=counter_deltas(forward_fill(color, row_starts), same_printer), minlength=groups)
+    return printer_ids[group_starts], black_pages, color_pages
+
+
+def price_array(values):
+    return np.array([0 if value is None else float(value) for value in values], dtype=np.float64)
+
+
+def bill_printers(printers, readings):
+    # printers are PRINTERS_SQL rows, readings READINGS_SQL rows, as tuples.
+    if not printers:
+        return []
+    printer_ids, serial_numbers, tax_ids, companies, price_black, price_color, lease_rent = zip(*printers)
+    all_ids = np.asarray(printer_ids, dtype=np.int64)
+
+    black_pages = np.zeros(len(all_ids))
+    color_pages = np.zeros(len(all_ids))
+    if readings:
+        # Column lists convert to arrays far faster than zip(*readings).
+        usage_ids, black, color = compute_usage(*([row[column] for row in readings] for column in range(3)))
+        positions = np.searchsorted(all_ids, usage_ids)
+        black_pages[positions] = black
+        color_pages[positions] = color
+
+    black_cost = np.round(black_pages * price_array(price_black), 2)
+    color_cost = np.round(color_pages * price_array(price_color), 2)
+    rent = price_array(lease_rent)
+    total = np.round(black_cost + color_cost + rent, 2)
+
+    return [PrinterBill(*row) for row in zip(
+        printer_ids, serial_numbers, tax_ids, companies, black_pages.astype(np.int64).tolist(),
+        color_pages.astype(np.int64).tolist(), black_cost.tolist(), color_cost.tolist(), rent.tolist(), total.tolist())]
+
+
+def client_totals(bills):
+    if not bills:
+        return []
+    tax_ids = np.array([bill.tax_id or '' for bill in bills], dtype=object)
+    clients, inverse = np.unique(tax_ids, return_inverse=True)
+    printers = np.bincount(inverse, minlength=len(clients))
+    black_pages = np.bincount(inverse, weights=[bill.black_pages for bill in bills], minlength=len(clients))
+    color_pages = np.bincount(inverse, weights=[bill.color_pages for bill in bills], minlength=len(clients))
+    totals = np.round(np.bincount(inverse, weights=[bill.total for bill in bills], minlength=len(clients)), 2)
+    companies = {bill.tax_id or '': bill.company for bill in bills}
+    return [ClientBill(tax_id or None, companies[tax_id], int(count), int(black), int(color), float(total))
+            for tax_id, count, black, color, total in zip(clients, printers, black_pages, color_pages, totals)]
+
+
+def bill_fleet(connection, start, end):
+    # lease_rent is charged once per billed period, so bill whole months.
+    with connection.cursor(pymysql.cursors.Cursor) as cursor:
+        cursor.execute(PRINTERS_SQL)
+        printers = cursor.fetchall()
+        cursor.execute(READINGS_SQL, {'start': start, 'end': end})
+        readings = cursor.fetchall()
+    bills = bill_printers(printers, readings)
+    logging.info(f"Billed {len(bills)} printers from {len(readings)} readings for {start} - {end}.")
+    return bills, client_totals(bills)
+
+
+def month_range(month):
+    year, month = (int(part) for part in month.split('-'))
+    return datetime.date(year, month, 1), datetime.date(year, month, calendar.monthrange(year, month)[1])
+
+
+def write_csv(bills, output):
+    writer = csv.writer(output)
+    writer.writerow(PrinterBill._fields)
+    writer.writerows(bills)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Bill every printer on a service contract for one month.")
+    parser.add_argument('month', help="billing month, YYYY-MM")
+    parser.add_argument('--output', help="write per-printer bills to this CSV file")
+    args = parser.parse_args()
+
+    load_dotenv()
+    connection = connect(retries=1)
+    try:
+        bills, clients = bill_fleet(connection, *month_range(args.month))
+    finally:
+        connection.close()
+
+    if args.output:
+        with open(args.output, 'w', newline='') as f:
+            write_csv(bills, f)
+    writer = csv.writer(sys.stdout)
+    writer.writerow(ClientBill._fields)
+    writer.writerows(clients)
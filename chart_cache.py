@@ -0,0 +1,108 @@
+import os
+import threading
+from collections import OrderedDict
+import pygal
+from pygal.style import Style
+
+MAX_POINTS = int(os.getenv('CHART_MAX_POINTS', 200))
+CACHE_SIZE = int(os.getenv('CHART_CACHE_SIZE', 256))
+
+
+def lttb(xs, ys, threshold):
+    # Largest-Triangle-Three-Buckets: returns the indices of the points to
+    # keep so that the line keeps its visual shape with `threshold` points.
+    n = len(xs)
+    if threshold >= n or threshold < 3:
+        return list(range(n))
+    every = (n - 2) / (threshold - 2)
+    selected = [0]
+    a = 0
+    for i in range(threshold - 2):
+        start = int(i * every) + 1
+        end = int((i + 1) * every) + 1
+        next_end = min(int((i + 2) * every) + 1, n)
+        if next_end <= end:
+            avg_x, avg_y = xs[n - 1], ys[n - 1]
+        else:
+            avg_x = sum(xs[end:next_end]) / (next_end - end)
+            avg_y = sum(ys[end:next_end]) / (next_end - end)
+        best, best_area = start, -1
+        for j in range(start, end):
+            area = abs((xs[a] - avg_x) * (ys[j] - ys[a]) - (xs[a] - xs[j]) * (avg_y - ys[a]))
+            if area > best_area:
+                best, best_area = j, area
+        selected.append(best)
+        a = best
+    selected.append(n - 1)
+    return selected
+
+
+def downsample(rows, max_points):
+    # Both counters share the x axis, so each keeps the points that shape its
+    # own line and the chart shows the union.
+    if len(rows) <= max_points:
+        return rows
+    xs = [row['date'].toordinal() + index * 1e-6 for index, row in enumerate(rows)]
+    black = [row['counter_black_history'] or 0 for row in rows]
+    color = [row['counter_color_history'] or 0 for row in rows]
+    keep = set(lttb(xs, black, max_points // 2)) | set(lttb(xs, color, max_points // 2))
+    return [rows[index] for index in sorted(keep)]
+
+
+def render_history_chart(rows, max_points=MAX_POINTS):
+    # rows are print_history rows in date order.
+    rows = downsample(rows, max_points)
+    custom_style = Style(
+        font_family='Segoe UI',
+        colors=('#545454', '#80bdff'),
+    )
+    line_chart = pygal.Line(style=custom_style, height=400, width=600, legend_at_bottom=True, show_legend=True,
+                            show_minor_x_labels=False, x_labels_major_count=8, x_label_rotation=20)
+    line_chart.title = 'Print History (X-axis: Date, Y-axis: Count)'
+    line_chart.x_labels = [row['date'] for row in rows]
+    line_chart.add('Black Counter', [row['counter_black_history'] for row in rows])
+    line_chart.add('Color Counter', [row['counter_color_history'] for row in rows])
+    return line_chart.render()
+
+
+class ChartCache:
+    # One rendered chart per printer, valid while the printer's newest
+    # print_history id is the one it was rendered for.
+    def __init__(self, max_entries=CACHE_SIZE, max_points=MAX_POINTS):
+        self.max_entries = max_entries
+        self.max_points = max_points
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def etag(self, printer_id, last_history_id):
+        return f"{printer_id}-{last_history_id}-{self.max_points}"
+
+    def get(self, printer_id, last_history_id):
+        with self._lock:
+            entry = self._entries.get(printer_id)
+            if entry is not None and entry[0] == last_history_id:
+                self._entries.move_to_end(printer_id)
+                self.hits += 1
+                return entry[1]
+            self.misses += 1
+            return None
+
+    def put(self, printer_id, last_history_id, svg):
+        with self._lock:
+            self._entries[printer_id] = (last_history_id, svg)
+            self._entries.move_to_end(printer_id)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def chart(self, printer_id, last_history_id, load_rows):
+        svg = self.get(printer_id, last_history_id)
+        if svg is None:
+            svg = render_history_chart(load_rows(), self.max_points)
+            self.put(printer_id, last_history_id, svg)
+        return svg
+
+    def stats(self):
+        with self._lock:
+            return {'hits': self.hits, 'misses': self.misses, 'size': len(self._entries), 'max_entries': self.max_entries}
@@ -1,92 +1,661 @@
 import os
-import re
+import argparse
 import datetime
+import json
+import socket
+import functools
 import time
+import queue
+import signal
+import threading
+import heapq
+from bisect import bisect_left
+from collections import Counter
 from dotenv import load_dotenv
 import pymysql.cursors
 import logging
 from watchdog.observers import Observer
 from watchdog.events import FileSystemEventHandler
+from migrate import migrate
+from file_ledger import FileLedger, fingerprint
+import usage_rollup
+import report_parser
+from model_resolver import ModelResolver
+import metrics
+from ingest_pipeline import INGEST_PIPELINE, SOCKET_PATH, decode_report, is_replay
 
 load_dotenv()
 
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 
+BATCH_SIZE = int(os.getenv('DATABROKER_BATCH_SIZE', 200))
+FLUSH_INTERVAL = float(os.getenv('DATABROKER_FLUSH_INTERVAL', 5))
+WORKERS = int(os.getenv('DATABROKER_WORKERS', 4))
+QUEUE_SIZE = int(os.getenv('DATABROKER_QUEUE_SIZE', 1000))
+DEBOUNCE_WINDOW = float(os.getenv('DATABROKER_DEBOUNCE', 2))
+LEDGER_PATH = os.getenv('DATABROKER_LEDGER', '/app/temp/processed_files.db')
+WATCH_DIR = os.getenv('DATABROKER_WATCH_DIR', '/app/temp')
+RETRY_DELAY = float(os.getenv('DATABROKER_RETRY_DELAY', 5))
+MAX_RETRY_DELAY = float(os.getenv('DATABROKER_MAX_RETRY_DELAY', 300))
+LATENCY_LOG_INTERVAL = 60
+# Deadlock and lock wait timeout: InnoDB rolled the batch back, the
+# connection is fine and the batch can simply run again.
+LOCK_CONFLICTS = (1213, 1205)
+LOCK_RETRIES = 3
+# From the mail parser picking a report up to its rows being committed.
+END_TO_END_BUCKETS = (0.1, 0.5, 1, 5, 30, 60, 300, 900, 3600)
+
+model_resolver = ModelResolver()
+
+FILES_INGESTED = metrics.REGISTRY.counter('databroker_files_ingested_total', 'Report files whose rows were committed.')
+RECORDS_WRITTEN = metrics.REGISTRY.counter('databroker_records_written_total', 'Counter and error records committed.')
+PARSE_FAILURES = metrics.REGISTRY.counter('databroker_parse_failures_total', 'Reports that could not be parsed.', ('source',))
+BATCH_FAILURES = metrics.REGISTRY.counter('databroker_batch_failures_total', 'Batches that could not be written.')
+BATCH_SECONDS = metrics.REGISTRY.histogram('databroker_batch_write_seconds', 'Time to write and commit one batch.')
+INGEST_LATENCY = metrics.REGISTRY.histogram('databroker_ingest_latency_seconds', 'Queue wait and processing time per report file.', ('phase',))
+END_TO_END_LATENCY = metrics.REGISTRY.histogram('databroker_end_to_end_latency_seconds', 'From the mail parser picking a report up to its rows being committed.',
+                                                ('phase',), buckets=END_TO_END_BUCKETS)
+
 class FileHandler(FileSystemEventHandler):
+    def __init__(self, debouncer):
+        super().__init__()
+        self.debouncer = debouncer
+
     def on_modified(self, event):
         if event.src_path.endswith('.txt'):
-            logging.info(f"File {event.src_path} has been modified.")
-            process_file(event.src_path)
+            logging.debug(f"File {event.src_path} has been modified.")
+            self.debouncer.touch(event.src_path)
 
-def process_file(file_path):
-    db = pymysql.connect(
+    def on_closed(self, event):
+        self.on_modified(event)
+
+class Debouncer:
+    # mailparser's open() + write() fires several events for one file, so a
+    # path is only passed on once it has been quiet for the whole window.
+    def __init__(self, callback, window=DEBOUNCE_WINDOW):
+        self.callback = callback
+        self.window = window
+        self.pending = {}
+        self.lock = threading.Lock()
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(target=self._run, name="debouncer", daemon=True)
+
+    def start(self):
+        self.thread.start()
+
+    def touch(self, file_path):
+        with self.lock:
+            self.pending[file_path] = time.monotonic()
+
+    def _due(self, everything=False):
+        now = time.monotonic()
+        with self.lock:
+            due = [path for path, last_event in self.pending.items() if everything or now - last_event >= self.window]
+            for path in due:
+                del self.pending[path]
+        return due
+
+    def _run(self):
+        while not self.stopped.wait(self.window / 4):
+            for file_path in self._due():
+                self.callback(file_path)
+
+    def stop(self):
+        self.stopped.set()
+        self.thread.join()
+        for file_path in self._due(everything=True):
+            self.callback(file_path)
+
+def get_db_connection():
+    return pymysql.connect(
         host=os.getenv('MYSQL_DB_HOST'),
         user=os.getenv('MYSQL_DB_USER'),
         password=os.getenv('MYSQL_ROOT_PASSWORD'),
         database=os.getenv('MYSQL_DATABASE'),
         cursorclass=pymysql.cursors.DictCursor
     )
-    cursor = db.cursor()
 
+def parse_file(file_path):
     with open(file_path, 'r') as file:
-        content = file.read()
-
-        match = re.search(r'\d{4}-\d{2}-\d{2}', file_path)
-        if match:
-            date = datetime.datetime.strptime(match.group(), '%Y-%m-%d').date()
-
-        match = re.search(r'\[Serial Number\],(.{0,25})', content)
-        if match:
-            serial_number = match.group(1).strip()
-
-            cursor.execute("SELECT id, service_contract, tax_id FROM printers WHERE serial_number = %s", (serial_number,))
-            printer = cursor.fetchone()
-            if printer and printer['service_contract']: 
-                match_black = re.search(r'\[Total Black Counter\],(\d{0,25})', content)
-                match_color = re.search(r'\[Total Color Counter\],(\d{0,25})', content)
-                match_total = re.search(r'\[Total Counter\],(\d{0,25})', content)
-                if match_black or match_color or match_total:
-                    if match_color:
-                        counter_color = match_color.group(1).strip()
-                        counter_black = match_black.group(1).strip() if match_black else None
-                    else:
-                        counter_color = "0"
-                        counter_black = match_total.group(1).strip() if match_total else None
-                    cursor.execute("INSERT INTO print_history (printers_id, date, counter_black_history, counter_color_history) VALUES (%s, %s, %s, %s)",
-                                (printer['id'], date, counter_black, counter_color))
-                    db.commit()
-
-        match = re.search(r'Installed Place :(.{0,25})', content)
-        if match:
-            serial_number = match.group(1).strip()
-            cursor.execute("SELECT id, tax_id FROM printers WHERE serial_number = %s", (serial_number,))
-            printer = cursor.fetchone()
-            if printer: 
-                match = re.search(r'Error :(.+)', content)
-                if match:
-                    error = match.group(1).strip()
-                    cursor.execute("SELECT id, times_happend FROM service_requests WHERE printer_id = %s AND service_request = %s AND DATE(request_date) = %s",
-                                (printer['id'], error, date))
-                    service_request = cursor.fetchone()
-
-                    if service_request:  
-                        cursor.execute("UPDATE service_requests SET times_happend = times_happend + 1 WHERE id = %s",
-                                    (service_request['id'],))
-                    else:
-                        cursor.execute("INSERT INTO service_requests (printer_id, tax_id, service_request) VALUES (%s, %s, %s)",
-                                    (printer['id'], printer['tax_id'], error))
-                    db.commit()
-    db.close()
+        return report_records(file_path, file.read())
+
+def report_records(file_path, content):
+    return records_from_report(report_parser.parse(content), report_parser.file_date(file_path))
+
+def records_from_report(report, date):
+    records = []
+    if report.has_counters:
+        counter_black, counter_color = report.billing_counters()
+        records.append({'type': 'counter', 'serial_number': report.serial_number, 'date': date,
+                        'counter_black': counter_black, 'counter_color': counter_color})
+    if report.installed_place and report.error:
+        records.append({'type': 'error', 'serial_number': report.installed_place, 'date': date,
+                        'error': report.error})
+    return records
+
+# Locking reads: they see what another worker committed while this one
+# waited for the printer locks, not the transaction's older snapshot.
+REQUEST_LOOKUP_SQL = "SELECT id, times_happend FROM service_requests WHERE printer_id = %s AND service_request = %s AND request_day = %s FOR UPDATE"
+
+def counter_value(value):
+    return None if value is None else int(value)
+
+def existing_readings(cursor, readings):
+    # The (printers_id, date, black, color) rows print_history already has
+    # among these readings' printers and dates.
+    printer_ids = sorted({reading[0] for reading in readings})
+    placeholders = ', '.join(['%s'] * len(printer_ids))
+    cursor.execute(f"SELECT printers_id, date, counter_black_history, counter_color_history FROM print_history "
+                   f"WHERE printers_id IN ({placeholders}) AND date >= %s FOR SHARE",
+                   (*printer_ids, min(reading[1] for reading in readings)))
+    return {(row['printers_id'], row['date'], row['counter_black_history'], row['counter_color_history']) for row in cursor.fetchall()}
+
+def write_records(cursor, records):
+    serial_numbers = sorted({record['serial_number'] for record in records})
+    if not serial_numbers:
+        return
+    placeholders = ', '.join(['%s'] * len(serial_numbers))
+    cursor.execute(f"SELECT id, serial_number, service_contract, tax_id, model FROM printers WHERE serial_number IN ({placeholders})",
+                   tuple(serial_numbers))
+    printers = {printer['serial_number']: printer for printer in cursor.fetchall()}
+    # Workers writing the same printer take turns from here to the commit:
+    # readings and rollup (see usage_rollup.LOCK_SQL) as well as the lookup
+    # and insert of its service requests, which would otherwise race into
+    # duplicate rows. Sorted, before the first write, so they can't deadlock.
+    usage_rollup.lock_printers(cursor, [printer['id'] for printer in printers.values()])
+
+    # Printers added without a model get it from their serial number once they report.
+    unknown = [printer for printer in printers.values() if not printer['model']]
+    if unknown:
+        models = model_resolver.resolve_many([printer['serial_number'] for printer in unknown])
+        updates = [(models[printer['serial_number']], printer['id']) for printer in unknown if models[printer['serial_number']]]
+        if updates:
+            cursor.executemany("UPDATE printers SET model = %s WHERE id = %s", updates)
+
+    history = []
+    replayed = []
+    errors = Counter()
+    replayed_errors = Counter()
+    for record in records:
+        printer = printers.get(record['serial_number'])
+        if not printer:
+            continue
+        if record['type'] == 'counter' and printer['service_contract']:
+            reading = (printer['id'], record['date'], record['counter_black'], record['counter_color'])
+            (replayed if record.get('replay') else history).append(reading)
+        elif record['type'] == 'error':
+            key = (printer['id'], printer['tax_id'], record['error'], record['date'])
+            (replayed_errors if record.get('replay') else errors)[key] += 1
+
+    # Replayed reports (--replay-since) only add what the database is missing,
+    # so replaying a period twice changes nothing.
+    if replayed:
+        existing = existing_readings(cursor, replayed)
+        history += [reading for reading in replayed
+                    if (reading[0], reading[1], counter_value(reading[2]), counter_value(reading[3])) not in existing]
+
+    if history:
+        cursor.executemany("INSERT INTO print_history (printers_id, date, counter_black_history, counter_color_history) VALUES (%s, %s, %s, %s)",
+                           history)
+        usage_rollup.apply_readings(cursor, history)
+
+    # The same error reported several times in one batch is folded into one row.
+    for (printer_id, tax_id, error, date), times in errors.items():
+        cursor.execute(REQUEST_LOOKUP_SQL, (printer_id, error, date))
+        service_request = cursor.fetchone()
+
+        if service_request:
+            cursor.execute("UPDATE service_requests SET times_happend = times_happend + %s WHERE id = %s",
+                           (times, service_request['id']))
+        elif times == 1:
+            cursor.execute("INSERT INTO service_requests (printer_id, tax_id, service_request) VALUES (%s, %s, %s)",
+                           (printer_id, tax_id, error))
+        else:
+            cursor.execute("INSERT INTO service_requests (printer_id, tax_id, service_request, times_happend) VALUES (%s, %s, %s, %s)",
+                           (printer_id, tax_id, error, times))
+
+    # A replayed error was counted when its report first came in. Only a
+    # missing request is restored, dated on the report's day so the next
+    # replay finds it.
+    for (printer_id, tax_id, error, date), times in replayed_errors.items():
+        cursor.execute(REQUEST_LOOKUP_SQL, (printer_id, error, date))
+        if cursor.fetchone() is None:
+            cursor.execute("INSERT INTO service_requests (printer_id, tax_id, service_request, times_happend, request_date) VALUES (%s, %s, %s, %s, %s)",
+                           (printer_id, tax_id, error, times, date))
+
+class IngestBatcher:
+    def __init__(self, db, batch_size=BATCH_SIZE, flush_interval=FLUSH_INTERVAL, ledger=None):
+        self.db = db
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.ledger = ledger
+        self.pending = []
+        self.pending_sources = []
+        self.pending_callbacks = []
+        self.last_flush = time.monotonic()
+        self.lock = threading.Lock()
+        self.records_written = 0
+        self.write_time = 0.0
+
+    def add(self, records, source=None, on_commit=None):
+        # on_commit(committed) is called once the batch holding these records
+        # has been written, or has failed.
+        with self.lock:
+            self.pending.extend(records)
+            if source is not None:
+                self.pending_sources.append(source)
+            if on_commit is not None:
+                self.pending_callbacks.append(on_commit)
+            if len(self.pending) >= self.batch_size:
+                self._flush()
+
+    def flush_if_due(self):
+        with self.lock:
+            if self._has_pending() and time.monotonic() - self.last_flush >= self.flush_interval:
+                self._flush()
+
+    def flush(self):
+        with self.lock:
+            if self._has_pending():
+                self._flush()
+
+    def _has_pending(self):
+        return self.pending or self.pending_sources or self.pending_callbacks
+
+    def _flush(self):
+        records, self.pending = self.pending, []
+        sources, self.pending_sources = self.pending_sources, []
+        callbacks, self.pending_callbacks = self.pending_callbacks, []
+        self.last_flush = time.monotonic()
+        started = time.perf_counter()
+        try:
+            self._write_retrying(records)
+        except Exception as e:
+            logging.error(f"Failed to write a batch of {len(records)} records: {e}")
+            BATCH_FAILURES.inc()
+            if self.ledger is not None:
+                self.ledger.release([file_path for file_path, _ in sources])
+            self._notify(callbacks, False)
+            return
+        # Files only count as ingested once their rows are committed.
+        if self.ledger is not None and sources:
+            self.ledger.mark_processed(sources)
+        self._notify(callbacks, True)
+        elapsed = time.perf_counter() - started
+        FILES_INGESTED.inc(len(sources))
+        RECORDS_WRITTEN.inc(len(records))
+        BATCH_SECONDS.observe(elapsed)
+        self.records_written += len(records)
+        self.write_time += elapsed
+        logging.info(f"Ingested {len(records)} records in {elapsed:.3f}s ({self.throughput(len(records), elapsed):.0f} records/s).")
+
+    def _write_retrying(self, records):
+        conflicts = 0
+        reconnected = False
+        while True:
+            try:
+                return self._write(records)
+            except pymysql.err.OperationalError as e:
+                code = e.args[0] if e.args else None
+                if code in LOCK_CONFLICTS:
+                    if conflicts >= LOCK_RETRIES:
+                        raise
+                    conflicts += 1
+                    logging.warning(f"Batch rolled back by a lock conflict ({e}), retrying ({conflicts}/{LOCK_RETRIES}).")
+                    time.sleep(0.05 * 2 ** conflicts)
+                elif not reconnected:
+                    reconnected = True
+                    logging.warning(f"Database connection lost ({e}), reconnecting and retrying the batch.")
+                    self.db.ping(reconnect=True)
+                else:
+                    raise
+
+    def _write(self, records):
+        cursor = self.db.cursor()
+        try:
+            write_records(cursor, records)
+            self.db.commit()
+        except Exception:
+            try:
+                self.db.rollback()
+            except pymysql.err.MySQLError:
+                pass
+            raise
+        finally:
+            cursor.close()
+
+    @staticmethod
+    def _notify(callbacks, committed):
+        for callback in callbacks:
+            try:
+                callback(committed)
+            except Exception as e:
+                logging.warning(f"Commit callback failed: {e}")
+
+    @staticmethod
+    def throughput(records, seconds):
+        return records / seconds if seconds > 0 else 0.0
+
+    def stats(self):
+        with self.lock:
+            return {'records_written': self.records_written, 'pending': len(self.pending),
+                    'records_per_second': self.throughput(self.records_written, self.write_time)}
+
+class LatencyHistogram:
+    BUCKETS = (0.005, 0.01, 0.05, 0.1, 0.5, 1, 5, 10, 30)
+
+    def __init__(self, phases=('queue_wait', 'processing'), buckets=BUCKETS, metric=None):
+        self.lock = threading.Lock()
+        self.buckets = buckets
+        # A metrics histogram with a phase label that gets the same observations.
+        self.metric = metric
+        self.counts = {phase: [0] * (len(buckets) + 1) for phase in phases}
+        self.totals = {phase: 0.0 for phase in phases}
+
+    def observe(self, phase, seconds):
+        with self.lock:
+            self.counts[phase][bisect_left(self.buckets, seconds)] += 1
+            self.totals[phase] += seconds
+        if self.metric is not None:
+            self.metric.observe(seconds, (phase,))
+
+    def summary(self):
+        lines = []
+        with self.lock:
+            for phase, counts in self.counts.items():
+                observed = sum(counts)
+                if not observed:
+                    continue
+                buckets = ', '.join(f"<={bound}s: {count}" for bound, count in zip(self.buckets, counts) if count)
+                if counts[-1]:
+                    buckets += f", >{self.buckets[-1]}s: {counts[-1]}"
+                lines.append(f"{phase}: n={observed}, avg={self.totals[phase] / observed * 1000:.1f}ms [{buckets}]")
+        return '; '.join(lines) or 'nothing observed yet'
+
+class IngestWorkerPool:
+    def __init__(self, workers=WORKERS, queue_size=QUEUE_SIZE, connect=get_db_connection, ledger=None):
+        self.workers = workers
+        self.connect = connect
+        self.ledger = ledger
+        self.queue = queue.Queue(maxsize=queue_size)
+        self.histogram = LatencyHistogram(metric=INGEST_LATENCY)
+        self.end_to_end = LatencyHistogram(phases=('file_spool', 'pipeline', 'mail_sent'), buckets=END_TO_END_BUCKETS, metric=END_TO_END_LATENCY)
+        self.threads = []
+        self.batchers = []
+        # Files of failed batches, as (due, file_path, force), and how often
+        # each one has failed in a row.
+        self.retries = []
+        self.attempts = {}
+        self.retry_lock = threading.Lock()
+        self.stopped = threading.Event()
+        self.retry_thread = threading.Thread(target=self._retry, name="ingest-retry", daemon=True)
+
+    def start(self):
+        for i in range(self.workers):
+            batcher = IngestBatcher(self.connect(), ledger=self.ledger)
+            self.batchers.append(batcher)
+            thread = threading.Thread(target=self._run, args=(batcher,), name=f"ingest-{i}", daemon=True)
+            thread.start()
+            self.threads.append(thread)
+        self.retry_thread.start()
+        logging.info(f"Started {self.workers} ingest workers, queue size {self.queue.maxsize}.")
+
+    def submit(self, file_path, force=False):
+        # Blocks the caller while the queue is full, which holds back the
+        # debouncer and retry threads instead of buffering files without limit.
+        # The observer keeps running, the debouncer only collects paths.
+        if self.queue.full():
+            logging.warning(f"Ingest queue full ({self.queue.maxsize} files), waiting for workers.")
+        self.queue.put((file_path, time.monotonic(), force))
+
+    def retry_later(self, file_path, force=False):
+        # The failed batch released the file in the ledger, so it can be
+        # claimed again. Back off so a database outage isn't hammered.
+        with self.retry_lock:
+            attempt = self.attempts[file_path] = self.attempts.get(file_path, 0) + 1
+            delay = min(RETRY_DELAY * 2 ** (attempt - 1), MAX_RETRY_DELAY)
+            heapq.heappush(self.retries, (time.monotonic() + delay, file_path, force))
+        logging.warning(f"Retrying {file_path} in {delay:.0f}s (attempt {attempt}).")
+
+    def _due_retries(self):
+        now = time.monotonic()
+        due = []
+        with self.retry_lock:
+            while self.retries and self.retries[0][0] <= now:
+                _, file_path, force = heapq.heappop(self.retries)
+                due.append((file_path, force))
+        return due
+
+    def _retry(self):
+        while not self.stopped.wait(1):
+            for file_path, force in self._due_retries():
+                self.submit(file_path, force)
+
+    def _committed(self, file_path, force, written_at, committed):
+        if committed:
+            with self.retry_lock:
+                self.attempts.pop(file_path, None)
+            self.end_to_end.observe('file_spool', time.time() - written_at)
+        else:
+            self.retry_later(file_path, force)
+
+    def drain(self):
+        self.queue.join()
+        for batcher in self.batchers:
+            batcher.flush()
+
+    def _run(self, batcher):
+        while True:
+            try:
+                item = self.queue.get(timeout=1)
+            except queue.Empty:
+                batcher.flush_if_due()
+                continue
+            if item is None:
+                self.queue.task_done()
+                break
+
+            file_path, enqueued_at, force = item
+            started = time.monotonic()
+            self.histogram.observe('queue_wait', started - enqueued_at)
+            try:
+                self.ingest(batcher, file_path, force)
+            except Exception as e:
+                logging.error(f"Failed to process {file_path}: {e}")
+            self.histogram.observe('processing', time.monotonic() - started)
+            batcher.flush_if_due()
+            self.queue.task_done()
+
+        batcher.flush()
+        batcher.db.close()
+
+    def ingest(self, batcher, file_path, force=False):
+        with open(file_path, 'rb') as file:
+            data = file.read()
+        source = (file_path, fingerprint(file_path, data))
+        if self.ledger is not None and not self.ledger.claim(*source, force=force):
+            logging.info(f"File {file_path} was already ingested, skipping.")
+            return
+        try:
+            records = report_records(file_path, data.decode())
+            if force or is_replay(file_path):
+                records = [dict(record, replay=True) for record in records]
+        except Exception:
+            PARSE_FAILURES.inc(labels=('file',))
+            if self.ledger is not None:
+                self.ledger.release([file_path])
+            raise
+        # The file's mtime is when the mail parser wrote it.
+        written_at = source[1][1]
+        batcher.add(records, source=source, on_commit=functools.partial(self._committed, file_path, force, written_at))
+
+    def shutdown(self):
+        # Retries still waiting are released in the ledger, the next start's
+        # backlog replay picks them up.
+        self.stopped.set()
+        if self.retry_thread.is_alive():
+            self.retry_thread.join()
+        # Sentinels queue up behind the pending files, so workers drain first.
+        for _ in self.threads:
+            self.queue.put(None)
+        for thread in self.threads:
+            thread.join()
+        logging.info(f"Ingest workers stopped. Latency: {self.histogram.summary()}")
+
+class PipelineServer:
+    # Reports handed over directly by mailparser in pipeline mode, see
+    # ingest_pipeline.py. Each one is acknowledged after its batch commits.
+    def __init__(self, batcher, histogram, path=SOCKET_PATH):
+        self.batcher = batcher
+        self.histogram = histogram
+        self.path = path
+        self.sock = None
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(target=self._accept, name="pipeline", daemon=True)
+
+    def start(self):
+        if os.path.exists(self.path):
+            os.unlink(self.path)
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.sock.bind(self.path)
+        self.sock.listen()
+        self.sock.settimeout(1)
+        self.thread.start()
+        logging.info(f"Listening for pipelined reports on {self.path}.")
+
+    def _accept(self):
+        while not self.stopped.is_set():
+            try:
+                conn, _ = self.sock.accept()
+            except socket.timeout:
+                continue
+            conn.settimeout(None)
+            threading.Thread(target=self._handle, args=(conn,), daemon=True).start()
+
+    def _acknowledge(self, conn, send_lock, message, committed):
+        if committed:
+            now = time.time()
+            self.histogram.observe('pipeline', now - message['fetched_at'])
+            if message.get('sent_at') is not None:
+                self.histogram.observe('mail_sent', now - message['sent_at'])
+        with send_lock:
+            conn.sendall(json.dumps({'seq': message.get('seq'), 'ok': committed}).encode() + b'\n')
+
+    def _handle(self, conn):
+        send_lock = threading.Lock()
+        with conn, conn.makefile('rb') as reader:
+            for line in reader:
+                if not line.strip():
+                    # End of a mail cycle, commit now instead of waiting for the flush interval.
+                    self.batcher.flush()
+                    continue
+                try:
+                    message, report = decode_report(line)
+                    records = records_from_report(report, report_parser.file_date(message['file']))
+                except (ValueError, KeyError, TypeError) as e:
+                    logging.error(f"Malformed pipelined report: {e}")
+                    PARSE_FAILURES.inc(labels=('pipeline',))
+                    self._acknowledge(conn, send_lock, {'seq': None}, False)
+                    continue
+                self.batcher.add(records, on_commit=functools.partial(self._acknowledge, conn, send_lock, message))
+
+    def stop(self):
+        self.stopped.set()
+        self.thread.join()
+        self.sock.close()
+        os.unlink(self.path)
+        self.batcher.flush()
+        self.batcher.db.close()
+
+def report_date(file_path):
+    return report_parser.file_date(os.path.basename(file_path)) or datetime.date.fromtimestamp(os.path.getmtime(file_path))
+
+def find_backlog(directory, ledger, since=None):
+    # Returns (path, force) pairs, oldest first: files missing from the ledger,
+    # plus every file dated on or after `since` when re-ingesting a period.
+    processed = ledger.processed_paths()
+    backlog = []
+    for name in os.listdir(directory):
+        if not name.endswith('.txt'):
+            continue
+        file_path = os.path.join(directory, name)
+        force = since is not None and report_date(file_path) >= since
+        if force or file_path not in processed:
+            backlog.append((os.path.getmtime(file_path), file_path, force))
+    backlog.sort()
+    return [(file_path, force) for _, file_path, force in backlog]
+
+def replay_backlog(pool, directory, ledger, since=None):
+    backlog = find_backlog(directory, ledger, since)
+    if not backlog:
+        return 0
+    forced = sum(1 for _, force in backlog if force)
+    logging.info(f"Replaying {len(backlog)} backlog files from {directory} ({forced} re-ingested since {since}).")
+    started = time.monotonic()
+    for file_path, force in backlog:
+        pool.submit(file_path, force)
+    pool.drain()
+    elapsed = time.monotonic() - started
+    logging.info(f"Backlog replay finished: {len(backlog)} files in {elapsed:.1f}s ({IngestBatcher.throughput(len(backlog), elapsed):.0f} files/s).")
+    return len(backlog)
+
+def process_file(file_path):
+    db = get_db_connection()
+    try:
+        batcher = IngestBatcher(db)
+        batcher.add(parse_file(file_path))
+        batcher.flush()
+    finally:
+        db.close()
 
 if __name__ == "__main__":
-    event_handler = FileHandler()
+    parser = argparse.ArgumentParser(description="Ingest printer report files into the database.")
+    parser.add_argument('--replay-since', type=datetime.date.fromisoformat, metavar='DATE',
+                        help="re-ingest every report dated on or after DATE (YYYY-MM-DD), even if already processed")
+    args = parser.parse_args()
+
+    migrate()
+    connection = get_db_connection()
+    try:
+        usage_rollup.rebuild_if_empty(connection)
+    finally:
+        connection.close()
+
+    stop = threading.Event()
+    signal.signal(signal.SIGTERM, lambda signum, frame: stop.set())
+
+    ledger = FileLedger(LEDGER_PATH)
+    pool = IngestWorkerPool(ledger=ledger)
+    pool.start()
+    metrics.REGISTRY.gauge('databroker_queue_files', 'Report files waiting for an ingest worker.', callback=pool.queue.qsize)
+    metrics.serve_from_env('DATABROKER_METRICS_PORT', 9101)
+    replay_backlog(pool, WATCH_DIR, ledger, args.replay_since)
+
+    debouncer = Debouncer(pool.submit)
+    debouncer.start()
+    event_handler = FileHandler(debouncer)
     observer = Observer()
-    observer.schedule(event_handler, path='/app/temp', recursive=False)
+    observer.schedule(event_handler, path=WATCH_DIR, recursive=False)
     observer.start()
+    # Catch files that landed while the replay was running.
+    replay_backlog(pool, WATCH_DIR, ledger)
+
+    pipeline = None
+    if INGEST_PIPELINE:
+        pipeline = PipelineServer(IngestBatcher(get_db_connection()), pool.end_to_end)
+        pipeline.start()
 
     try:
-        while True:
-            time.sleep(1)
+        while not stop.wait(LATENCY_LOG_INTERVAL):
+            logging.info(f"Ingest queue: {pool.queue.qsize()} files waiting. Latency: {pool.histogram.summary()}")
+            logging.info(f"End-to-end latency: {pool.end_to_end.summary()}")
     except KeyboardInterrupt:
-        observer.stop()
-    observer.join()
\ No newline at end of file
+        pass
+    logging.info("Stopping databroker, draining the ingest queue.")
+    if pipeline is not None:
+        pipeline.stop()
+    observer.stop()
+    observer.join()
+    debouncer.stop()
+    pool.shutdown()
+    ledger.close()
@@ -0,0 +1,162 @@
+import os
+import time
+import threading
+import logging
+from collections import deque
+from contextlib import contextmanager
+import pymysql
+import pymysql.cursors
+
+
+class PoolTimeout(Exception):
+    pass
+
+
+class ConnectionPool:
+    def __init__(self, max_size=5, timeout=10, recycle=300, **connect_kwargs):
+        self.max_size = max_size
+        self.timeout = timeout
+        self.recycle = recycle
+        self.connect_kwargs = connect_kwargs
+        self._idle = deque()
+        self._in_use = 0
+        self._created = 0
+        self._lock = threading.Lock()
+        self._available = threading.Condition(self._lock)
+        self._stats = {
+            'checkouts': 0,
+            'waits': 0,
+            'wait_time': 0.0,
+            'timeouts': 0,
+            'connects': 0,
+            'recycled': 0,
+            'failed_health_checks': 0,
+        }
+
+    def _connect(self):
+        connection = pymysql.connect(**self.connect_kwargs)
+        self._stats['connects'] += 1
+        return connection
+
+    def _is_healthy(self, connection):
+        try:
+            connection.ping(reconnect=False)
+            return True
+        except Exception:
+            return False
+
+    def _discard(self, connection):
+        try:
+            connection.close()
+        except Exception:
+            pass
+
+    def acquire(self):
+        started = time.monotonic()
+        waited = False
+        with self._available:
+            while True:
+                now = time.monotonic()
+                # Idle connections are kept newest-last, so expired ones
+                # collect at the left end.
+                while self._idle and now - self._idle[0][1] > self.recycle:
+                    stale, _ = self._idle.popleft()
+                    self._stats['recycled'] += 1
+                    self._created -= 1
+                    self._discard(stale)
+
+                connection = None
+                if self._idle:
+                    connection, _ = self._idle.pop()
+                    self._in_use += 1
+                    break
+                if self._created < self.max_size:
+                    self._created += 1
+                    self._in_use += 1
+                    break
+
+                remaining = self.timeout - (now - started)
+                if remaining <= 0:
+                    self._stats['timeouts'] += 1
+                    raise PoolTimeout(f"No database connection available after {self.timeout}s")
+                waited = True
+                self._available.wait(remaining)
+
+            self._stats['checkouts'] += 1
+            if waited:
+                self._stats['waits'] += 1
+                self._stats['wait_time'] += time.monotonic() - started
+
+        # Connecting and health checks happen outside the lock so a slow
+        # MySQL handshake does not block other workers returning connections.
+        try:
+            if connection is not None and not self._is_healthy(connection):
+                with self._lock:
+                    self._stats['failed_health_checks'] += 1
+                self._discard(connection)
+                connection = None
+            if connection is None:
+                connection = self._connect()
+        except Exception:
+            with self._available:
+                self._in_use -= 1
+                self._created -= 1
+                self._available.notify()
+            raise
+        return connection
+
+    def release(self, connection):
+        broken = False
+        try:
+            connection.rollback()
+        except Exception:
+            broken = True
+
+        with self._available:
+            self._in_use -= 1
+            if broken or not connection.open:
+                self._created -= 1
+                self._discard(connection)
+            else:
+                self._idle.append((connection, time.monotonic()))
+            self._available.notify()
+
+    @contextmanager
+    def connection(self):
+        connection = self.acquire()
+        try:
+            yield connection
+        finally:
+            self.release(connection)
+
+    def close_idle(self):
+        with self._lock:
+            while self._idle:
+                connection, _ = self._idle.popleft()
+                self._created -= 1
+                self._discard(connection)
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+            stats['size'] = self._created
+            stats['max_size'] = self.max_size
+            stats['in_use'] = self._in_use
+            stats['idle'] = len(self._idle)
+            stats['avg_wait_ms'] = (stats['wait_time'] / stats['waits'] * 1000) if stats['waits'] else 0.0
+        return stats
+
+
+def pool_from_env(cursorclass=pymysql.cursors.DictCursor):
+    pool = ConnectionPool(
+        max_size=int(os.getenv('DB_POOL_SIZE', 5)),
+        timeout=float(os.getenv('DB_POOL_TIMEOUT', 10)),
+        recycle=float(os.getenv('DB_POOL_RECYCLE', 300)),
+        host=os.getenv('MYSQL_DB_HOST'),
+        user=os.getenv('MYSQL_DB_USER'),
+        password=os.getenv('MYSQL_ROOT_PASSWORD'),
+        db=os.getenv('MYSQL_DATABASE'),
+        cursorclass=cursorclass
+    )
+    logging.info(f"Database pool created, max size {pool.max_size}, recycle after {pool.recycle}s idle.")
+    return pool
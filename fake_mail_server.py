@@ -0,0 +1,111 @@
+# A minimal in-process POP3 server for tests and offline load tests of the
+# mail parser. It speaks plain POP3 (no TLS), so point a mailbox at it with
+# "ssl": false. latency is added to every reply to mimic a remote server.
+import time
+import threading
+import socketserver
+from email.utils import format_datetime
+
+REPORT_MESSAGE = """Message-ID: <{number}.{serial}@fake-printer>
+Date: {date}
+From: printer@example.com
+Content-Type: text/plain
+
+[Model Name],EngiLab
+[Serial Number], {serial}
+[Send Date],{send_date}
+[Total Counter],{total:08d}
+[Total Scan/Fax Counter],00041513
+"""
+
+
+def make_report_message(number, serial_number, sent_at, total=185186):
+    text = REPORT_MESSAGE.format(number=number, serial=serial_number, date=format_datetime(sent_at),
+                                 send_date=sent_at.strftime('%d/%m/%y'), total=total)
+    return text.replace('\n', '\r\n').encode()
+
+
+class POP3Handler(socketserver.StreamRequestHandler):
+    def reply(self, line, lines=None):
+        if self.server.latency:
+            time.sleep(self.server.latency)
+        out = [line]
+        if lines is not None:
+            # Multi-line replies are dot-stuffed and end with a lone ".".
+            out += [b'.' + part if part.startswith(b'.') else part for part in lines] + [b'.']
+        self.wfile.write(b''.join(part + b'\r\n' for part in out))
+
+    def message(self, argument):
+        number = int(argument)
+        if not 1 <= number <= len(self.server.messages):
+            raise IndexError(number)
+        return number, self.server.messages[number - 1]
+
+    def handle(self):
+        self.reply(b'+OK fake POP3 server ready')
+        messages = self.server.messages
+        while True:
+            line = self.rfile.readline()
+            if not line:
+                break
+            command, *arguments = line.decode().split()
+            command = command.upper()
+            with self.server.lock:
+                self.server.commands[command] = self.server.commands.get(command, 0) + 1
+            try:
+                if command == 'USER':
+                    self.reply(b'+OK')
+                elif command == 'PASS':
+                    if self.server.password is not None and arguments != [self.server.password]:
+                        self.reply(b'-ERR authentication failed')
+                    else:
+                        self.reply(b'+OK logged in')
+                elif command == 'STAT':
+                    self.reply(f'+OK {len(messages)} {sum(len(message) for message in messages)}'.encode())
+                elif command == 'LIST':
+                    self.reply(b'+OK', [f'{number} {len(message)}'.encode() for number, message in enumerate(messages, 1)])
+                elif command == 'UIDL':
+                    self.reply(b'+OK', [f'{number} uid-{number}'.encode() for number in range(1, len(messages) + 1)])
+                elif command == 'TOP':
+                    number, message = self.message(arguments[0])
+                    header, _, body = message.partition(b'\r\n\r\n')
+                    body_lines = body.split(b'\r\n')[:int(arguments[1])]
+                    self.reply(b'+OK', header.split(b'\r\n') + [b''] + body_lines)
+                elif command == 'RETR':
+                    number, message = self.message(arguments[0])
+                    self.reply(f'+OK {len(message)} octets'.encode(), message.rstrip(b'\r\n').split(b'\r\n'))
+                elif command == 'NOOP':
+                    self.reply(b'+OK')
+                elif command == 'QUIT':
+                    self.reply(b'+OK bye')
+                    break
+                else:
+                    self.reply(b'-ERR unknown command')
+            except (IndexError, ValueError):
+                self.reply(b'-ERR no such message')
+
+
+class FakePOP3Server(socketserver.ThreadingTCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, messages, password=None, latency=0.0, host='127.0.0.1', port=0):
+        super().__init__((host, port), POP3Handler)
+        self.messages = list(messages)
+        self.password = password
+        self.latency = latency
+        self.lock = threading.Lock()
+        self.commands = {}
+        self.thread = threading.Thread(target=self.serve_forever, name="fake-pop3", daemon=True)
+
+    @property
+    def port(self):
+        return self.server_address[1]
+
+    def __enter__(self):
+        self.thread.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.shutdown()
+        self.server_close()
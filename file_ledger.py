@@ -0,0 +1,70 @@
+import os
+import time
+import hashlib
+import sqlite3
+import threading
+
+
+def fingerprint(file_path, data):
+    stat = os.stat(file_path)
+    return (stat.st_size, stat.st_mtime, hashlib.sha256(data).hexdigest())
+
+
+class FileLedger:
+    def __init__(self, path):
+        self.lock = threading.Lock()
+        self.in_flight = set()
+        self.db = sqlite3.connect(path, check_same_thread=False)
+        self.db.execute("""
+        CREATE TABLE IF NOT EXISTS processed_files (
+            path TEXT PRIMARY KEY,
+            size INTEGER NOT NULL,
+            mtime REAL NOT NULL,
+            sha256 TEXT NOT NULL,
+            processed_at REAL NOT NULL
+        )
+        """)
+        self.db.commit()
+
+    def _lookup(self, file_path):
+        return self.db.execute("SELECT size, mtime, sha256 FROM processed_files WHERE path = ?", (file_path,)).fetchone()
+
+    def is_processed(self, file_path, file_fingerprint):
+        with self.lock:
+            row = self._lookup(file_path)
+        return row is not None and row[2] == file_fingerprint[2]
+
+    def claim(self, file_path, file_fingerprint, force=False):
+        # A path is handed out once until it is either committed with
+        # mark_processed() or given back with release(). force skips the
+        # already-processed check, for deliberate re-ingestion.
+        with self.lock:
+            if file_path in self.in_flight:
+                return False
+            row = self._lookup(file_path)
+            if not force and row is not None and row[2] == file_fingerprint[2]:
+                return False
+            self.in_flight.add(file_path)
+            return True
+
+    def mark_processed(self, entries):
+        now = time.time()
+        with self.lock:
+            self.db.executemany("INSERT OR REPLACE INTO processed_files (path, size, mtime, sha256, processed_at) VALUES (?, ?, ?, ?, ?)",
+                                [(file_path, size, mtime, sha256, now) for file_path, (size, mtime, sha256) in entries])
+            self.db.commit()
+            for file_path, _ in entries:
+                self.in_flight.discard(file_path)
+
+    def release(self, file_paths):
+        with self.lock:
+            for file_path in file_paths:
+                self.in_flight.discard(file_path)
+
+    def processed_paths(self):
+        with self.lock:
+            return {row[0] for row in self.db.execute("SELECT path FROM processed_files")}
+
+    def close(self):
+        with self.lock:
+            self.db.close()
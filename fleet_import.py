@@ -0,0 +1,222 @@
+import io
+import csv
+import sys
+import time
+import argparse
+import datetime
+import logging
+from decimal import Decimal, InvalidOperation
+from dotenv import load_dotenv
+import usage_rollup
+from migrate import connect
+from model_resolver import ModelResolver
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+COLUMNS = ['serial_number', 'model', 'counter_black', 'counter_color', 'price_black', 'price_color', 'lease_rent',
+           'contract_start_date', 'company', 'tax_id', 'service_contract']
+# Values per IN (...) lookup.
+LOOKUP_CHUNK = 1000
+TRUE_VALUES = {'1', 'true', 'yes', 'y', 'x'}
+
+INSERT_PRINTER_SQL = """INSERT INTO printers (serial_number, black_counter, color_counter, model, price_black, price_color, lease_rent,
+contract_start_date, tax_id, assigned, service_contract) VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)"""
+
+INSERT_HISTORY_SQL = "INSERT INTO print_history (printers_id, date, counter_black_history, counter_color_history) VALUES (%s, %s, %s, %s)"
+
+
+class RowError(ValueError):
+    pass
+
+
+def header_name(value):
+    return str(value or '').strip().lower().replace(' ', '_')
+
+
+def read_csv(stream):
+    # stream is a binary file, rows are read as they are parsed.
+    reader = csv.reader(io.TextIOWrapper(stream, encoding='utf-8-sig', newline=''))
+    header = [header_name(name) for name in next(reader, [])]
+    for line, values in enumerate(reader, 2):
+        if any(value.strip() for value in values):
+            yield line, dict(zip(header, values))
+
+
+def read_xlsx(stream):
+    # openpyxl is only needed for spreadsheets, the read-only workbook streams rows.
+    from openpyxl import load_workbook
+    workbook = load_workbook(stream, read_only=True, data_only=True)
+    try:
+        rows = workbook.worksheets[0].iter_rows(values_only=True)
+        header = [header_name(name) for name in next(rows, [])]
+        for line, values in enumerate(rows, 2):
+            if any(value not in (None, '') for value in values):
+                yield line, dict(zip(header, values))
+    finally:
+        workbook.close()
+
+
+def read_rows(stream, file_name):
+    return read_xlsx(stream) if file_name.lower().endswith('.xlsx') else read_csv(stream)
+
+
+def text(value):
+    return str(value).strip() if value is not None else ''
+
+
+def to_counter(value, column):
+    value = text(value)
+    if not value:
+        return 0
+    try:
+        counter = int(Decimal(value))
+    except InvalidOperation:
+        raise RowError(f"{column} is not a number")
+    if counter < 0:
+        raise RowError(f"{column} is negative")
+    return counter
+
+
+def to_price(value, column):
+    value = text(value)
+    if not value:
+        return None
+    try:
+        return Decimal(value.replace(',', '.'))
+    except InvalidOperation:
+        raise RowError(f"{column} is not a number")
+
+
+def to_date(value):
+    if isinstance(value, datetime.datetime):
+        return value.date()
+    if isinstance(value, datetime.date):
+        return value
+    value = text(value)
+    if not value:
+        return None
+    try:
+        return datetime.date.fromisoformat(value)
+    except ValueError:
+        raise RowError("contract_start_date is not a YYYY-MM-DD date")
+
+
+def validate(row):
+    serial_number = text(row.get('serial_number')).upper()
+    if len(serial_number) < 9:
+        raise RowError("serial_number is missing or shorter than 9 characters")
+    return {
+        'serial_number': serial_number,
+        'model': text(row.get('model')) or None,
+        'counter_black': to_counter(row.get('counter_black'), 'counter_black'),
+        'counter_color': to_counter(row.get('counter_color'), 'counter_color'),
+        'price_black': to_price(row.get('price_black'), 'price_black'),
+        'price_color': to_price(row.get('price_color'), 'price_color'),
+        'lease_rent': to_price(row.get('lease_rent'), 'lease_rent'),
+        'contract_start_date': to_date(row.get('contract_start_date')),
+        'company': text(row.get('company')) or None,
+        'tax_id': text(row.get('tax_id')) or None,
+        'service_contract': text(row.get('service_contract')).lower() in TRUE_VALUES,
+    }
+
+
+def lookup(cursor, sql, values):
+    # sql has one {placeholders} IN list, run once per LOOKUP_CHUNK values.
+    values = sorted(values)
+    rows = []
+    for start in range(0, len(values), LOOKUP_CHUNK):
+        chunk = values[start:start + LOOKUP_CHUNK]
+        cursor.execute(sql.format(placeholders=', '.join(['%s'] * len(chunk))), chunk)
+        rows.extend(cursor.fetchall())
+    return rows
+
+
+def import_fleet(connection, rows, resolver, dry_run=False):
+    # rows are (line, {column: value}). Valid rows are inserted in a single
+    # transaction, the others are reported as (line, serial_number, error).
+    started = time.monotonic()
+    errors = []
+    printers = []
+    seen = {}
+    total = 0
+    for line, row in rows:
+        total += 1
+        try:
+            printer = validate(row)
+        except RowError as e:
+            errors.append((line, text(row.get('serial_number')), str(e)))
+            continue
+        if printer['serial_number'] in seen:
+            errors.append((line, printer['serial_number'], f"serial_number repeats line {seen[printer['serial_number']]}"))
+            continue
+        seen[printer['serial_number']] = line
+        printers.append((line, printer))
+
+    with connection.cursor() as cursor:
+        existing = {row['serial_number'] for row in lookup(cursor, "SELECT serial_number FROM printers WHERE serial_number IN ({placeholders})", seen)}
+        companies = {row['company']: row['tax_id'] for row in lookup(
+            cursor, "SELECT tax_id, company FROM clients WHERE company IN ({placeholders})", {p['company'] for _, p in printers if p['company']})}
+        tax_ids = {row['tax_id'] for row in lookup(
+            cursor, "SELECT tax_id FROM clients WHERE tax_id IN ({placeholders})", {p['tax_id'] for _, p in printers if p['tax_id']})}
+
+        models = resolver.resolve_many(seen)
+        valid = []
+        for line, printer in printers:
+            if printer['serial_number'] in existing:
+                errors.append((line, printer['serial_number'], "a printer with this serial number is already in the database"))
+                continue
+            tax_id = printer['tax_id']
+            if tax_id is not None and tax_id not in tax_ids:
+                errors.append((line, printer['serial_number'], f"no client with tax_id {tax_id}"))
+                continue
+            if tax_id is None and printer['company'] is not None:
+                tax_id = companies.get(printer['company'])
+                if tax_id is None:
+                    errors.append((line, printer['serial_number'], f"no client with company name {printer['company']}"))
+                    continue
+            # Same order as add_printer: the serial number decides, the column is the fallback.
+            printer['model'] = models[printer['serial_number']] or printer['model']
+            printer['tax_id'] = tax_id
+            valid.append(printer)
+
+        if valid and not dry_run:
+            try:
+                cursor.executemany(INSERT_PRINTER_SQL, [
+                    (p['serial_number'], p['counter_black'], p['counter_color'], p['model'], p['price_black'], p['price_color'],
+                     p['lease_rent'], p['contract_start_date'], p['tax_id'], int(p['tax_id'] is not None), int(p['service_contract']))
+                    for p in valid])
+                ids = {row['serial_number']: row['id'] for row in lookup(
+                    cursor, "SELECT id, serial_number FROM printers WHERE serial_number IN ({placeholders})", [p['serial_number'] for p in valid])}
+                today = datetime.date.today()
+                history = [(ids[p['serial_number']], today, p['counter_black'], p['counter_color']) for p in valid]
+                cursor.executemany(INSERT_HISTORY_SQL, history)
+                usage_rollup.apply_readings(cursor, history)
+                connection.commit()
+            except Exception:
+                connection.rollback()
+                raise
+
+    errors.sort()
+    elapsed = time.monotonic() - started
+    logging.info(f"Fleet import: {total} rows, {len(valid)} {'valid' if dry_run else 'imported'}, {len(errors)} rejected in {elapsed:.2f}s.")
+    return {'rows': total, 'imported': 0 if dry_run else len(valid), 'valid': len(valid), 'errors': errors}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Add many printers at once from a CSV or XLSX file.")
+    parser.add_argument('file', help=f"CSV or XLSX file with a header row, columns: {', '.join(COLUMNS)}")
+    parser.add_argument('--dry-run', action='store_true', help="only validate, don't insert anything")
+    args = parser.parse_args()
+
+    load_dotenv()
+    connection = connect(retries=1)
+    try:
+        with open(args.file, 'rb') as f:
+            report = import_fleet(connection, read_rows(f, args.file), ModelResolver(), args.dry_run)
+    finally:
+        connection.close()
+
+    writer = csv.writer(sys.stdout)
+    writer.writerow(['line', 'serial_number', 'error'])
+    writer.writerows(report['errors'])
+    sys.exit(1 if report['errors'] else 0)
@@ -0,0 +1,13 @@
+import os
+from dotenv import load_dotenv
+import metrics
+
+
+def on_starting(server):
+    # Runs once in the master, before any worker: metrics files of the last
+    # run's workers would otherwise be added to this run's totals.
+    load_dotenv()
+    metrics_dir = os.getenv('METRICS_DIR')
+    if metrics_dir:
+        removed = metrics.clear_shards(metrics_dir)
+        server.log.info(f"Removed {removed} metrics files from {metrics_dir}.")
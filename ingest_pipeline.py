@@ -0,0 +1,89 @@
+import os
+import json
+import time
+import socket
+import datetime
+import logging
+import report_parser
+
+INGEST_PIPELINE = os.getenv('INGEST_PIPELINE') == 'True'
+SOCKET_PATH = os.getenv('INGEST_SOCKET', '/app/temp/ingest.sock')
+ACK_TIMEOUT = float(os.getenv('INGEST_ACK_TIMEOUT', 30))
+
+# One JSON object per line. The mail parser sends a line per report and an
+# empty line at the end of each cycle. The databroker answers with
+# {"seq": n, "ok": true|false} per report once its batch has been committed.
+
+# A report sent but never answered may still be committed by the databroker
+# after the client gave up. Its spooled file gets this suffix, and the
+# databroker ingests such files as replays, which skip what is already there.
+REPLAY_SUFFIX = '.replay.txt'
+
+def replay_name(file_name):
+    return file_name[:-len('.txt')] + REPLAY_SUFFIX if file_name.endswith('.txt') else file_name + REPLAY_SUFFIX
+
+def is_replay(file_path):
+    return file_path.endswith(REPLAY_SUFFIX)
+
+def encode_report(seq, file_name, report, sent_at, fetched_at):
+    fields = report._asdict()
+    if report.timestamp is not None:
+        fields['timestamp'] = report.timestamp.isoformat()
+    return (json.dumps({'seq': seq, 'file': file_name, 'report': fields,
+                        'sent_at': sent_at, 'fetched_at': fetched_at}) + '\n').encode()
+
+def decode_report(line):
+    message = json.loads(line)
+    fields = message['report']
+    if fields['timestamp'] is not None:
+        fields['timestamp'] = datetime.datetime.fromisoformat(fields['timestamp'])
+    return message, report_parser.Report(**fields)
+
+class PipelineClient:
+    def __init__(self, spool, path=SOCKET_PATH, timeout=ACK_TIMEOUT):
+        # spool(file_name, content) writes the report the old way, as a file
+        # for the databroker's watcher. It is used for anything not acked.
+        # A report's done callback runs once it is acked or spooled.
+        self.spool = spool
+        self.path = path
+        self.timeout = timeout
+        self.pending = []
+
+    def send(self, file_name, content, report, sent_at, done=None):
+        self.pending.append((file_name, content, report, sent_at, time.time(), done))
+
+    def flush(self):
+        if not self.pending:
+            return 0, 0
+        pending, self.pending = self.pending, []
+        acked = set()
+        answered = set()
+        sent = False
+        try:
+            with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+                sock.settimeout(self.timeout)
+                sock.connect(self.path)
+                sent = True
+                sock.sendall(b''.join(encode_report(seq, file_name, report, sent_at, fetched_at)
+                                      for seq, (file_name, _, report, sent_at, fetched_at, _) in enumerate(pending)) + b'\n')
+                with sock.makefile('rb') as reader:
+                    for _ in pending:
+                        line = reader.readline()
+                        if not line:
+                            break
+                        ack = json.loads(line)
+                        answered.add(ack['seq'])
+                        if ack['ok']:
+                            acked.add(ack['seq'])
+        except (OSError, ValueError) as e:
+            logging.warning(f"Ingest pipeline unavailable ({e}), spooling unacknowledged reports to files.")
+
+        spooled = 0
+        for seq, (file_name, content, _, _, _, done) in enumerate(pending):
+            if seq not in acked:
+                self.spool(replay_name(file_name) if sent and seq not in answered else file_name, content)
+                spooled += 1
+            if done is not None:
+                done()
+        logging.info(f"Ingest pipeline: {len(acked)} reports committed directly, {spooled} spooled to files.")
+        return len(acked), spooled
@@ -0,0 +1,135 @@
+import os
+import re
+import time
+import logging
+import contextvars
+from contextlib import contextmanager
+import pymysql.cursors
+from flask import request, before_render_template, template_rendered
+
+# Queries taking at least this long are logged, 0 turns the slow query log off.
+SLOW_QUERY_MS = float(os.getenv('SLOW_QUERY_MS', 0))
+
+_current = contextvars.ContextVar('request_timings', default=None)
+
+
+class RequestTimings:
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.queries = 0
+        # Seconds per phase: db, render, and whatever timed() is used for.
+        self.phases = {}
+        self._renders = []
+
+    def add(self, phase, seconds):
+        self.phases[phase] = self.phases.get(phase, 0.0) + seconds
+
+    def total(self):
+        return time.perf_counter() - self.started
+
+    def server_timing(self):
+        parts = []
+        for phase, seconds in self.phases.items():
+            description = f';desc="{self.queries} queries"' if phase == 'db' else ''
+            parts.append(f"{phase};dur={seconds * 1000:.1f}{description}")
+        parts.append(f"total;dur={self.total() * 1000:.1f}")
+        return ', '.join(parts)
+
+    def log_fields(self):
+        fields = {'total_ms': f"{self.total() * 1000:.1f}", 'db_queries': self.queries}
+        for phase, seconds in self.phases.items():
+            fields[f"{phase}_ms"] = f"{seconds * 1000:.1f}"
+        return ' '.join(f"{name}={value}" for name, value in fields.items())
+
+
+def current():
+    return _current.get()
+
+
+def begin():
+    timings = RequestTimings()
+    _current.set(timings)
+    return timings
+
+
+def end():
+    _current.set(None)
+
+
+@contextmanager
+def timed(phase):
+    timings = _current.get()
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        if timings is not None:
+            timings.add(phase, time.perf_counter() - started)
+
+
+def normalize_sql(sql):
+    # One line, literals and parameters as ?, IN lists of any length alike,
+    # so the same statement always logs the same text.
+    sql = re.sub(r"'(?:[^'\\]|\\.)*'", '?', sql)
+    sql = re.sub(r'\b\d+(?:\.\d+)?\b', '?', sql)
+    sql = sql.replace('%s', '?')
+    sql = re.sub(r'\(\s*\?(?:\s*,\s*\?)*\s*\)', '(...)', sql)
+    return ' '.join(sql.split())
+
+
+class TimedCursorMixin:
+    # executemany and the fetches of a buffered cursor go through execute, so
+    # every round trip is counted.
+    def execute(self, query, args=None):
+        timings = _current.get()
+        started = time.perf_counter()
+        try:
+            return super().execute(query, args)
+        finally:
+            elapsed = time.perf_counter() - started
+            if timings is not None:
+                timings.queries += 1
+                timings.add('db', elapsed)
+            if SLOW_QUERY_MS and elapsed * 1000 >= SLOW_QUERY_MS:
+                endpoint = request.endpoint if timings is not None else None
+                logging.warning(f"Slow query {elapsed * 1000:.1f}ms endpoint={endpoint}: {normalize_sql(query)}")
+
+
+class TimedDictCursor(TimedCursorMixin, pymysql.cursors.DictCursor):
+    pass
+
+
+def _render_started(sender, template, context, **extra):
+    timings = _current.get()
+    if timings is not None:
+        timings._renders.append(time.perf_counter())
+
+
+def _render_finished(sender, template, context, **extra):
+    timings = _current.get()
+    if timings is not None and timings._renders:
+        timings.add('render', time.perf_counter() - timings._renders.pop())
+
+
+def init_app(app):
+    # Call right after creating the app, so timing starts before the other
+    # before_request hooks run their queries.
+    @app.before_request
+    def start_request_timing():
+        begin()
+
+    @app.after_request
+    def add_server_timing(response):
+        timings = current()
+        if timings is not None:
+            response.headers['Server-Timing'] = timings.server_timing()
+            logging.info(f"request method={request.method} path={request.path} endpoint={request.endpoint} "
+                         f"status={response.status_code} {timings.log_fields()}")
+        return response
+
+    @app.teardown_request
+    def end_request_timing(exception):
+        end()
+
+    before_render_template.connect(_render_started, app)
+    template_rendered.connect(_render_finished, app)
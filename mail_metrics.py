@@ -0,0 +1,9 @@
+import metrics
+
+# Shared by the POP and IMAP mail parser scripts, whichever one runs.
+MAILS_FETCHED = metrics.REGISTRY.counter('mailparser_mails_fetched_total', 'Messages downloaded, by mailbox.', ('mailbox',))
+MAILS_SKIPPED = metrics.REGISTRY.counter('mailparser_mails_skipped_total', 'New messages skipped by size or headers, by mailbox.', ('mailbox',))
+BYTES_DOWNLOADED = metrics.REGISTRY.counter('mailparser_bytes_downloaded_total', 'Bytes downloaded, by mailbox.', ('mailbox',))
+POLL_FAILURES = metrics.REGISTRY.counter('mailparser_poll_failures_total', 'Mail cycles that failed, by mailbox.', ('mailbox',))
+POLL_SECONDS = metrics.REGISTRY.histogram('mailparser_poll_seconds', 'Duration of one mail cycle, by mailbox.', ('mailbox',),
+                                          buckets=(0.1, 0.5, 1, 2.5, 5, 10, 30, 60, 300))
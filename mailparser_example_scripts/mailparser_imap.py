@@ -2,97 +2,276 @@ import os
 import imaplib
 import email
 import datetime
-import json
+import re
+import ssl
+import select
 import time
+import functools
 import threading
 from email.header import decode_header
+from email.parser import BytesHeaderParser
 from dotenv import load_dotenv
-import re
+import report_parser
+import metrics
+from mail_metrics import MAILS_FETCHED, MAILS_SKIPPED, BYTES_DOWNLOADED, POLL_FAILURES, POLL_SECONDS
+from message_ledger import open_ledger
+from ingest_pipeline import INGEST_PIPELINE, PipelineClient
 from email.utils import parsedate_to_datetime
 import logging
 
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 
-def run_script():
-    while True:
-        try:
-            load_dotenv()
-            MAIL_SERVER = os.getenv("MAIL_SERVER")
-            MAIL_USERNAME = os.getenv("MAIL_USERNAME")
-            MAIL_PASSWORD = os.getenv("MAIL_PASSWORD")
+HIGH_WATER_FILE = 'temp/imap_last_uid.txt'
+MAX_MESSAGE_SIZE = int(os.getenv('MAIL_MAX_MESSAGE_SIZE', 20000))
+FETCH_BATCH = int(os.getenv('IMAP_FETCH_BATCH', 100))
+# RFC 2177 asks clients to re-issue IDLE at least every 29 minutes.
+IDLE_TIMEOUT = int(os.getenv('IMAP_IDLE_TIMEOUT', 1500))
+POLL_INTERVAL = 900
+MESSAGE_LEDGER = os.getenv('MAIL_LEDGER', 'temp/message_ids.db')
+LEGACY_MESSAGE_IDS = 'temp/saved_message_ids.txt'
+LEDGER_RETENTION_DAYS = int(os.getenv('MAIL_LEDGER_RETENTION_DAYS', 365))
+FETCH_META = re.compile(rb'UID (\d+)|RFC822\.SIZE (\d+)')
+# The one MAIL_SERVER mailbox, labelled like the POP script's default mailbox.
+MAILBOX = ('default',)
 
-            with open('printer_models.json') as f:
-                printer_models = json.load(f)
+def load_high_water():
+    if not os.path.exists(HIGH_WATER_FILE):
+        return None, 0
+    with open(HIGH_WATER_FILE, 'r') as f:
+        uid_validity, last_uid = f.read().split()
+    return uid_validity, int(last_uid)
 
-            prefixes = [prefix for sublist in printer_models.values() for prefix in sublist]
+def save_high_water(uid_validity, last_uid):
+    with open(HIGH_WATER_FILE + '.tmp', 'w') as f:
+        f.write(f"{uid_validity} {last_uid}\n")
+    os.replace(HIGH_WATER_FILE + '.tmp', HIGH_WATER_FILE)
 
-            mail = imaplib.IMAP4_SSL(MAIL_SERVER)
+def uid_set(uids):
+    # Compresses [1, 2, 3, 7, 9, 10] into "1:3,7,9:10" for UID FETCH.
+    ranges = []
+    for uid in sorted(uids):
+        if ranges and uid == ranges[-1][1] + 1:
+            ranges[-1][1] = uid
+        else:
+            ranges.append([uid, uid])
+    return ','.join(str(start) if start == end else f"{start}:{end}" for start, end in ranges)
 
-            mail.login(MAIL_USERNAME, MAIL_PASSWORD)
+def fetch_items(mail, uids, items):
+    result, data = mail.uid('fetch', uid_set(uids), items)
+    if result != 'OK':
+        raise imaplib.IMAP4.error(f"UID FETCH failed: {data}")
+    fetched = {}
+    for part in data:
+        if not isinstance(part, tuple):
+            continue
+        meta = {}
+        for uid, size in FETCH_META.findall(part[0]):
+            if uid:
+                meta['uid'] = int(uid)
+            if size:
+                meta['size'] = int(size)
+        if 'uid' in meta:
+            fetched[meta['uid']] = (meta.get('size', 0), part[1])
+    return fetched
 
-            mail.select('inbox')
+def search_new_uids(mail, last_uid):
+    result, data = mail.uid('search', None, f"UID {last_uid + 1}:*")
+    # "n:*" always matches the newest message, even when it is below n.
+    return sorted(uid for uid in (int(uid) for uid in data[0].split()) if uid > last_uid)
+
+def buffered(mail):
+    # Lines that arrived together with the previous one sit in imaplib's read
+    # buffer, where select can't see them. A peek on the non-blocking socket
+    # returns them, or nothing, without waiting; it never raises a timeout,
+    # so the file object stays usable.
+    mail.sock.setblocking(False)
+    try:
+        return bool(mail.file.peek(1))
+    except (BlockingIOError, ssl.SSLWantReadError):
+        return False
+    finally:
+        mail.sock.setblocking(True)
+
+def wait_readable(mail, timeout):
+    # Bytes already decrypted by the SSL layer don't show up in select either.
+    if buffered(mail) or (isinstance(mail.sock, ssl.SSLSocket) and mail.sock.pending()):
+        return True
+    readable, _, _ = select.select([mail.sock], [], [], timeout)
+    return bool(readable)
+
+def read_line(mail):
+    line = mail.readline()
+    if not line:
+        raise imaplib.IMAP4.abort("Connection closed during IDLE.")
+    return line
+
+def idle(mail, timeout):
+    # imaplib has no IDLE command before Python 3.14, so speak it directly.
+    # The wait is a select on the socket: a socket timeout firing inside
+    # readline would leave imaplib's file object unreadable for good.
+    tag = mail._new_tag()
+    mail.send(tag + b' IDLE\r\n')
+    if not read_line(mail).startswith(b'+'):
+        raise imaplib.IMAP4.error("Server refused IDLE.")
+    deadline = time.monotonic() + timeout
+    while True:
+        remaining = deadline - time.monotonic()
+        if remaining <= 0 or not wait_readable(mail, remaining):
+            break
+        line = read_line(mail)
+        if b'EXISTS' in line or b'RECENT' in line:
+            break
+    mail.send(b'DONE\r\n')
+    while not read_line(mail).startswith(tag + b' '):
+        pass
+
+def write_report_file(file_name, mail_text):
+    with open(f'temp/{file_name}', 'w') as f:
+        f.write(mail_text)
 
-            result, data = mail.uid('search', None, "ALL") 
-            email_ids = data[0].split()
-            num_messages = len(email_ids)
+def record_message(ledger, message_id, date_sent_str):
+    if message_id:
+        ledger.add(message_id, date_sent_str)
 
-            if num_messages == 0:
-                logging.info("Mailbox empty, skipping the process.")
-                mail.logout()
-                time.sleep(900)
+def save_report(email_message, message_id, saved, pipeline=None):
+    # saved(date_sent_str) runs once the report is safe: written to a file, or
+    # acked or spooled by the pipeline when it flushes. Only then may the
+    # Message-ID go into the ledger, or a lost report is never fetched again.
+    for part in email_message.walk():
+        if part.get_content_type() == "text/plain":
+            mail_text = part.get_payload(decode=True)
+            mail_text = mail_text.decode()
+
+            if len(mail_text) > 1000:
+                logging.info(f"Email {message_id} is too long, skipping.")
                 continue
 
-            saved_message_ids = set()
-            if os.path.exists('temp/saved_message_ids.txt'):
-                with open('temp/saved_message_ids.txt', 'r') as f:
-                    saved_message_ids = set(line.strip() for line in f)
-
-            with open('temp/saved_message_ids.txt', 'a') as id_file:
-                for i in email_ids:
-                    result, data = mail.uid('fetch', i, '(BODY.PEEK[])') 
-                    raw_mail = data[0][1]
-                    email_message = email.message_from_bytes(raw_mail)
-                    message_id = email_message['Message-ID']
-
-                    if message_id not in saved_message_ids:
-                        if email_message.is_multipart():
-                            logging.info(f"Email {message_id} has an attachment, skipping.")
+            date_sent = email_message['Date']
+            date_sent = parsedate_to_datetime(date_sent)
+            date_sent_str = date_sent.strftime('%Y-%m-%d-%H-%M-%S')
+
+            report = report_parser.parse(mail_text)
+            file_name = f'{date_sent_str}-{report.identifier}.txt'
+
+            if pipeline is not None:
+                pipeline.send(file_name, mail_text, report, date_sent.timestamp(), functools.partial(saved, date_sent_str))
+            else:
+                write_report_file(file_name, mail_text)
+                saved(date_sent_str)
+            return
+    # Nothing worth saving, don't fetch it again either.
+    saved(None)
+
+def process_new_messages(mail, uid_validity, ledger, pipeline=None):
+    saved_validity, last_uid = load_high_water()
+    if saved_validity != uid_validity:
+        # UIDs from another UIDVALIDITY mean nothing here, start over and let
+        # the Message-ID check skip what was already saved.
+        last_uid = 0
+
+    uids = search_new_uids(mail, last_uid)
+    if not uids:
+        return 0
+
+    bytes_downloaded = 0
+    fetched = 0
+    skipped = 0
+    saved = 0
+    try:
+        for start in range(0, len(uids), FETCH_BATCH):
+            batch = uids[start:start + FETCH_BATCH]
+            headers = fetch_items(mail, batch, '(UID RFC822.SIZE BODY.PEEK[HEADER.FIELDS (MESSAGE-ID DATE CONTENT-TYPE)])')
+
+            eligible = {}
+            for uid, (size, raw_headers) in headers.items():
+                bytes_downloaded += len(raw_headers)
+                header = BytesHeaderParser().parsebytes(raw_headers)
+                message_id = header['Message-ID']
+                if size > MAX_MESSAGE_SIZE:
+                    logging.info(f"Email {message_id} is {size} bytes, too large for a printer report, skipping.")
+                    skipped += 1
+                elif header.get_content_maintype() == 'multipart':
+                    logging.info(f"Email {message_id} has an attachment, skipping.")
+                    skipped += 1
+                elif message_id and message_id in ledger:
+                    skipped += 1
+                else:
+                    eligible[uid] = message_id
+
+            missing = []
+            if eligible:
+                bodies = fetch_items(mail, eligible, '(UID BODY.PEEK[])')
+                try:
+                    for uid, message_id in eligible.items():
+                        if uid not in bodies:
+                            missing.append(uid)
                             continue
+                        raw_mail = bodies[uid][1]
+                        bytes_downloaded += len(raw_mail)
+                        fetched += 1
+                        email_message = email.message_from_bytes(raw_mail)
+                        save_report(email_message, message_id, functools.partial(record_message, ledger, message_id), pipeline)
+                        saved += 1
+                finally:
+                    # Reports queued before a failure are still sent or spooled,
+                    # not left for the next batch.
+                    if pipeline is not None:
+                        pipeline.flush()
 
-                        for part in email_message.walk():
-                            if part.get_content_type() == "text/plain":
-                                mail_text = part.get_payload(decode=True)
-                                mail_text = mail_text.decode()
+            if missing:
+                # Keep the mark below the first body the server didn't return, so
+                # the next cycle fetches it again. Messages saved past it are
+                # skipped then by the Message-ID check.
+                done = [uid for uid in batch if uid < min(missing)]
+                if done:
+                    save_high_water(uid_validity, done[-1])
+                logging.warning(f"Server returned no body for UIDs {uid_set(missing)}, fetching them again next cycle.")
+                break
+            save_high_water(uid_validity, batch[-1])
+    finally:
+        MAILS_FETCHED.inc(fetched, MAILBOX)
+        MAILS_SKIPPED.inc(skipped, MAILBOX)
+        BYTES_DOWNLOADED.inc(bytes_downloaded, MAILBOX)
 
-                                if len(mail_text) > 1000: 
-                                    logging.info(f"Email {message_id} is too long, skipping.")
-                                    continue
+    logging.info(f"Processed {len(uids)} new messages, saved {saved} reports, {bytes_downloaded} bytes downloaded.")
+    return len(uids)
 
-                                date_sent = email_message['Date']
-                                date_sent = parsedate_to_datetime(date_sent)
-                                date_sent_str = date_sent.strftime('%Y-%m-%d-%H-%M-%S')
+def run_script():
+    ledger = open_ledger(MESSAGE_LEDGER, LEGACY_MESSAGE_IDS)
+    pipeline = PipelineClient(write_report_file) if INGEST_PIPELINE else None
+    metrics.serve_from_env('MAILPARSER_METRICS_PORT', 9102)
+    while True:
+        try:
+            load_dotenv()
+            MAIL_SERVER = os.getenv("MAIL_SERVER")
+            MAIL_USERNAME = os.getenv("MAIL_USERNAME")
+            MAIL_PASSWORD = os.getenv("MAIL_PASSWORD")
 
-                                serial_number_match = re.search(r'\[Serial Number\], (.*)', mail_text)
-                                installed_place_match = re.search(r'Installed Place :(.*)', mail_text)
-                                if serial_number_match:
-                                    identifier = serial_number_match.group(1).strip()
-                                elif installed_place_match:
-                                    identifier = installed_place_match.group(1).strip()
-                                else:
-                                    identifier = 'unknown'
+            mail = imaplib.IMAP4_SSL(MAIL_SERVER)
 
-                                with open(f'temp/{date_sent_str}-{identifier}.txt', 'w') as f:
-                                    f.write(mail_text)
+            mail.login(MAIL_USERNAME, MAIL_PASSWORD)
 
-                        id_file.write(message_id + ' __ ' + date_sent_str + '\n')
-                        saved_message_ids.add(message_id)
+            mail.select('inbox')
+            uid_validity = mail.response('UIDVALIDITY')[1][0].decode()
+            use_idle = 'IDLE' in mail.capabilities
+            if not use_idle:
+                logging.info(f"Server does not support IDLE, polling every {POLL_INTERVAL} seconds.")
 
-            mail.logout()
-            time.sleep(900)
+            while True:
+                started = time.monotonic()
+                process_new_messages(mail, uid_validity, ledger, pipeline)
+                POLL_SECONDS.observe(time.monotonic() - started, MAILBOX)
+                ledger.compact(LEDGER_RETENTION_DAYS)
+                if use_idle:
+                    idle(mail, IDLE_TIMEOUT)
+                else:
+                    time.sleep(POLL_INTERVAL)
+                    mail.noop()
         except Exception as e:
+            POLL_FAILURES.inc(labels=MAILBOX)
             logging.error(f"Error: {e}. Mail server might be down, it's not responding. Retrying in 5 minutes.")
             time.sleep(600)
 
 if __name__ == '__main__':
     thread = threading.Thread(target=run_script)
-    thread.start()
\ No newline at end of file
+    thread.start()
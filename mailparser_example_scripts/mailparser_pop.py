@@ -1,4 +1,5 @@
 from email.header import decode_header
+from email.parser import BytesHeaderParser
 from email.utils import parsedate_to_datetime
 from dotenv import load_dotenv
 import os
@@ -7,86 +8,259 @@ import email
 import datetime
 import json
 import time
-import re
+import functools
 import logging
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+import report_parser
+from message_ledger import open_ledger
+from ingest_pipeline import INGEST_PIPELINE, PipelineClient
+import metrics
+from mail_metrics import MAILS_FETCHED, MAILS_SKIPPED, BYTES_DOWNLOADED, POLL_FAILURES, POLL_SECONDS
 
-logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+load_dotenv()
 
-def run_script():
-    while True:
-        try:
-            load_dotenv()
-            MAIL_SERVER = os.getenv("MAIL_SERVER")
-            MAIL_USERNAME = os.getenv("MAIL_USERNAME")
-            MAIL_PASSWORD = os.getenv("MAIL_PASSWORD")
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(threadName)s - %(message)s')
+
+SEEN_UIDS_FILE = 'temp/seen_uids.txt'
+MAX_MESSAGE_SIZE = int(os.getenv('MAIL_MAX_MESSAGE_SIZE', 20000))
+MESSAGE_LEDGER = os.getenv('MAIL_LEDGER', 'temp/message_ids.db')
+LEGACY_MESSAGE_IDS = 'temp/saved_message_ids.txt'
+LEDGER_RETENTION_DAYS = int(os.getenv('MAIL_LEDGER_RETENTION_DAYS', 365))
+MAILBOXES_FILE = os.getenv('MAIL_MAILBOXES', 'mailboxes.json')
+MAIL_WORKERS = int(os.getenv('MAIL_WORKERS', 8))
+POLL_INTERVAL = int(os.getenv('MAIL_POLL_INTERVAL', 900))
+RETRY_DELAY = int(os.getenv('MAIL_RETRY_DELAY', 60))
+MAX_RETRY_DELAY = int(os.getenv('MAIL_MAX_RETRY_DELAY', 3600))
+
+class CycleStats:
+    def __init__(self):
+        self.bytes_downloaded = 0
+        self.new_messages = 0
+        self.screened_out = 0
+        self.fetched = 0
+
+    def add_lines(self, lines):
+        self.bytes_downloaded += sum(len(line) + 2 for line in lines)
+
+    def __str__(self):
+        return (f"{self.new_messages} new messages, {self.fetched} downloaded, {self.screened_out} skipped by headers, "
+                f"{self.bytes_downloaded} bytes downloaded")
+
+def load_seen_uids(path=SEEN_UIDS_FILE):
+    if not os.path.exists(path):
+        return set()
+    with open(path, 'r') as f:
+        return set(line.strip() for line in f if line.strip())
+
+def save_seen_uids(uids, path=SEEN_UIDS_FILE):
+    with open(path + '.tmp', 'w') as f:
+        f.writelines(uid + '\n' for uid in sorted(uids))
+    os.replace(path + '.tmp', path)
 
-            with open('printer_models.json') as f:
-                printer_models = json.load(f)
+class Mailbox:
+    def __init__(self, name, server, username, password, port=None, ssl=True):
+        self.name = name
+        self.server = server
+        self.username = username
+        self.password = password
+        self.port = port
+        self.ssl = ssl
+        # POP3 UIDs are only unique within one mailbox, so each keeps its own.
+        self.seen_uids_file = SEEN_UIDS_FILE if name == 'default' else f'temp/seen_uids-{name}.txt'
+        self.seen_uids = load_seen_uids(self.seen_uids_file)
+        self.failures = 0
+        self.next_run = 0.0
 
-            prefixes = [prefix for sublist in printer_models.values() for prefix in sublist]
+    def connect(self):
+        if self.ssl:
+            mail = poplib.POP3_SSL(self.server, self.port or poplib.POP3_SSL_PORT)
+        else:
+            mail = poplib.POP3(self.server, self.port or poplib.POP3_PORT)
+        mail.user(self.username)
+        mail.pass_(self.password)
+        return mail
 
-            mail = poplib.POP3_SSL(MAIL_SERVER)
+    def retry_delay(self):
+        return min(RETRY_DELAY * 2 ** (self.failures - 1), MAX_RETRY_DELAY)
 
-            mail.user(MAIL_USERNAME)
-            mail.pass_(MAIL_PASSWORD)
+def load_mailboxes():
+    if os.path.exists(MAILBOXES_FILE):
+        with open(MAILBOXES_FILE) as f:
+            return [Mailbox(**config) for config in json.load(f)]
+    return [Mailbox('default', os.getenv("MAIL_SERVER"), os.getenv("MAIL_USERNAME"), os.getenv("MAIL_PASSWORD"))]
 
-            num_messages = len(mail.list()[1])
-        
-            if num_messages == 0:
-                logging.info("Mailbox empty, skipping the process.")
-                mail.quit()
-                time.sleep(900)
+def list_mailbox(mail, stats):
+    # UIDL and LIST are one line per message, so the mailbox can be diffed
+    # against what we have already seen without downloading anything else.
+    response, uid_lines, _ = mail.uidl()
+    stats.add_lines(uid_lines)
+    response, size_lines, _ = mail.list()
+    stats.add_lines(size_lines)
+
+    sizes = {}
+    for line in size_lines:
+        number, size = line.decode().split()
+        sizes[int(number)] = int(size)
+    messages = []
+    for line in uid_lines:
+        number, uid = line.decode().split()
+        messages.append((int(number), uid, sizes.get(int(number), 0)))
+    return messages
+
+def screen_headers(mail, number, stats):
+    response, header_lines, octets = mail.top(number, 0)
+    stats.add_lines(header_lines)
+    return BytesHeaderParser().parsebytes(b'\n'.join(header_lines))
+
+def write_report_file(file_name, mail_text):
+    with open(f'temp/{file_name}', 'w') as f:
+        f.write(mail_text)
+
+def record_message(ledger, seen_uids, uid, message_id, date_sent_str):
+    if message_id:
+        ledger.add(message_id, date_sent_str)
+    seen_uids.add(uid)
+
+def save_report(email_message, message_id, saved, pipeline=None):
+    # saved(date_sent_str) runs once the report is safe: written to a file, or
+    # acked or spooled by the pipeline when it flushes. Only then may the
+    # Message-ID go into the ledger, or a lost report is never fetched again.
+    for part in email_message.walk():
+        if part.get_content_type() == "text/plain":
+            mail_text = part.get_payload(decode=True)
+            mail_text = mail_text.decode()
+
+            if len(mail_text) > 1000:
+                logging.info(f"Email {message_id} is too long, skipping.")
                 continue
 
-            saved_message_ids = set()
-            if os.path.exists('temp/saved_message_ids.txt'):
-                with open('temp/saved_message_ids.txt', 'r') as f:
-                    saved_message_ids = set(line.strip() for line in f)
-
-            with open('temp/saved_message_ids.txt', 'a') as id_file:
-                for i in range(num_messages):
-                    raw_mail = b'\n'.join(mail.retr(i+1)[1])
-                    email_message = email.message_from_bytes(raw_mail)
-                    message_id = email_message['Message-ID']
-
-                    if message_id not in saved_message_ids:
-                        if email_message.is_multipart():
-                            logging.info(f"Email {message_id} has an attachment, skipping.")
-                            continue
-
-                        for part in email_message.walk():
-                            if part.get_content_type() == "text/plain":
-                                mail_text = part.get_payload(decode=True)
-                                mail_text = mail_text.decode()
-
-                                if len(mail_text) > 1000:
-                                    logging.info(f"Email {message_id} is too long, skipping.")
-                                    continue
-
-                                date_sent = email_message['Date']
-                                date_sent = parsedate_to_datetime(date_sent)
-                                date_sent_str = date_sent.strftime('%Y-%m-%d-%H-%M-%S')
-
-                                serial_number_match = re.search(r'\[Serial Number\], (.*)', mail_text)
-                                installed_place_match = re.search(r'Installed Place :(.*)', mail_text)
-                                if serial_number_match:
-                                    identifier = serial_number_match.group(1).strip()
-                                elif installed_place_match:
-                                    identifier = installed_place_match.group(1).strip()
-                                else:
-                                    identifier = 'unknown'
-
-                                with open(f'temp/{date_sent_str}-{identifier}.txt', 'w') as f:
-                                    f.write(mail_text)
-
-                        id_file.write(message_id + ' __ ' + date_sent_str + '\n')
-                        saved_message_ids.add(message_id)
+            date_sent = email_message['Date']
+            date_sent = parsedate_to_datetime(date_sent)
+            date_sent_str = date_sent.strftime('%Y-%m-%d-%H-%M-%S')
+
+            report = report_parser.parse(mail_text)
+            file_name = f'{date_sent_str}-{report.identifier}.txt'
+
+            if pipeline is not None:
+                pipeline.send(file_name, mail_text, report, date_sent.timestamp(), functools.partial(saved, date_sent_str))
+            else:
+                write_report_file(file_name, mail_text)
+                saved(date_sent_str)
+            return
+    # Nothing worth saving, don't fetch it again either.
+    saved(None)
 
+def fetch_new_messages(mail, seen_uids, ledger, stats, pipeline=None):
+    mailbox_uids = set()
+    for number, uid, size in list_mailbox(mail, stats):
+        mailbox_uids.add(uid)
+        if uid in seen_uids:
+            continue
+        stats.new_messages += 1
+
+        if size > MAX_MESSAGE_SIZE:
+            logging.info(f"Message {uid} is {size} bytes, too large for a printer report, skipping.")
+            stats.screened_out += 1
+            seen_uids.add(uid)
+            continue
+
+        headers = screen_headers(mail, number, stats)
+        message_id = headers['Message-ID']
+        if headers.get_content_maintype() == 'multipart':
+            logging.info(f"Email {message_id} has an attachment, skipping.")
+            stats.screened_out += 1
+            seen_uids.add(uid)
+            continue
+        if message_id and message_id in ledger:
+            stats.screened_out += 1
+            seen_uids.add(uid)
+            continue
+
+        response, lines, octets = mail.retr(number)
+        stats.add_lines(lines)
+        stats.fetched += 1
+        email_message = email.message_from_bytes(b'\n'.join(lines))
+
+        # Marked seen with the ledger entry, once the report is safe.
+        save_report(email_message, message_id, functools.partial(record_message, ledger, seen_uids, uid, message_id), pipeline)
+
+    # Forget UIDs of messages that are no longer on the server.
+    seen_uids &= mailbox_uids
+
+def poll_mailbox(mailbox, ledger):
+    pipeline = PipelineClient(write_report_file) if INGEST_PIPELINE else None
+    mail = mailbox.connect()
+    try:
+        if mail.stat()[0] == 0:
+            logging.info(f"Mailbox {mailbox.name} empty, skipping the process.")
+            return None
+
+        stats = CycleStats()
+        try:
+            fetch_new_messages(mail, mailbox.seen_uids, ledger, stats, pipeline)
+        finally:
+            # Reports fetched before a failure are still sent or spooled.
+            if pipeline is not None:
+                pipeline.flush()
+            MAILS_FETCHED.inc(stats.fetched, (mailbox.name,))
+            MAILS_SKIPPED.inc(stats.screened_out, (mailbox.name,))
+            BYTES_DOWNLOADED.inc(stats.bytes_downloaded, (mailbox.name,))
+        save_seen_uids(mailbox.seen_uids, mailbox.seen_uids_file)
+        logging.info(f"Mail cycle for {mailbox.name} finished: {stats}.")
+        return stats
+    finally:
+        try:
             mail.quit()
-            time.sleep(900)
-        except Exception as e:
-            logging.error(f"Error: {e}. Mail server might be down, it's not responding. Retrying in 5 minutes.")
-            time.sleep(600)
+        except (poplib.error_proto, OSError):
+            pass
+
+def run_mailbox(mailbox, ledger):
+    # A failing mailbox backs off on its own, the others keep their cadence.
+    started = time.monotonic()
+    try:
+        stats = poll_mailbox(mailbox, ledger)
+        POLL_SECONDS.observe(time.monotonic() - started, (mailbox.name,))
+        mailbox.failures = 0
+        mailbox.next_run = time.monotonic() + POLL_INTERVAL
+        return stats
+    except Exception as e:
+        mailbox.failures += 1
+        POLL_FAILURES.inc(labels=(mailbox.name,))
+        delay = mailbox.retry_delay()
+        mailbox.next_run = time.monotonic() + delay
+        logging.error(f"Error: {e}. Mail server for {mailbox.name} might be down, it's not responding. Retrying in {delay} seconds.")
+        return None
+
+def run_script():
+    mailboxes = load_mailboxes()
+    ledger = open_ledger(MESSAGE_LEDGER, LEGACY_MESSAGE_IDS)
+    workers = min(MAIL_WORKERS, len(mailboxes))
+    logging.info(f"Fetching {len(mailboxes)} mailboxes with {workers} workers.")
+    metrics.serve_from_env('MAILPARSER_METRICS_PORT', 9102)
+
+    next_compaction = 0.0
+    running = {}
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix='mailbox') as executor:
+        while True:
+            now = time.monotonic()
+            if now >= next_compaction:
+                ledger.compact(LEDGER_RETENTION_DAYS)
+                next_compaction = now + POLL_INTERVAL
+
+            busy = set(running.values())
+            for mailbox in mailboxes:
+                if mailbox not in busy and mailbox.next_run <= now:
+                    running[executor.submit(run_mailbox, mailbox, ledger)] = mailbox
+
+            busy = set(running.values())
+            waiting = [mailbox.next_run for mailbox in mailboxes if mailbox not in busy]
+            timeout = max(0.0, min(waiting + [next_compaction]) - time.monotonic())
+            if running:
+                done, _ = wait(running, timeout=timeout, return_when=FIRST_COMPLETED)
+                for future in done:
+                    del running[future]
+            else:
+                time.sleep(timeout)
 
 if __name__ == '__main__':
-    run_script()
\ No newline at end of file
+    run_script()
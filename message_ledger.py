@@ -0,0 +1,86 @@
+import os
+import time
+import datetime
+import sqlite3
+import threading
+import logging
+
+
+def parse_sent_date(value):
+    # Dates are stored the way the mail parsers name report files.
+    try:
+        return datetime.datetime.strptime(value, '%Y-%m-%d-%H-%M-%S').timestamp()
+    except (TypeError, ValueError):
+        return None
+
+
+class MessageLedger:
+    def __init__(self, path):
+        self.lock = threading.Lock()
+        self.db = sqlite3.connect(path, check_same_thread=False)
+        self.db.execute("PRAGMA journal_mode=WAL")
+        # WITHOUT ROWID keeps the primary key b-tree as the only structure,
+        # so a lookup is a single index probe however large the ledger gets.
+        self.db.execute("""
+        CREATE TABLE IF NOT EXISTS message_ids (
+            message_id TEXT PRIMARY KEY,
+            sent_at TEXT,
+            recorded_at REAL NOT NULL
+        ) WITHOUT ROWID
+        """)
+        self.db.execute("CREATE INDEX IF NOT EXISTS idx_message_ids_recorded_at ON message_ids (recorded_at)")
+        self.db.commit()
+
+    def __contains__(self, message_id):
+        with self.lock:
+            return self.db.execute("SELECT 1 FROM message_ids WHERE message_id = ?", (message_id,)).fetchone() is not None
+
+    def add(self, message_id, sent_at=None):
+        with self.lock:
+            self.db.execute("INSERT OR IGNORE INTO message_ids (message_id, sent_at, recorded_at) VALUES (?, ?, ?)",
+                            (message_id, sent_at, time.time()))
+            self.db.commit()
+
+    def compact(self, retention_days):
+        # Messages older than the retention are long gone from the mailbox,
+        # there is nothing left to deduplicate them against.
+        cutoff = time.time() - retention_days * 86400
+        with self.lock:
+            removed = self.db.execute("DELETE FROM message_ids WHERE recorded_at < ?", (cutoff,)).rowcount
+            self.db.commit()
+        if removed:
+            logging.info(f"Removed {removed} message IDs older than {retention_days} days from the ledger.")
+        return removed
+
+    def import_text_file(self, file_path):
+        # saved_message_ids.txt holds "<Message-ID> __ <date sent>" lines.
+        now = time.time()
+        rows = []
+        with open(file_path, 'r') as f:
+            for line in f:
+                message_id, _, sent_at = line.strip().partition(' __ ')
+                if not message_id:
+                    continue
+                sent_at = sent_at if sent_at and sent_at != 'None' else None
+                rows.append((message_id, sent_at, parse_sent_date(sent_at) or now))
+        with self.lock:
+            self.db.executemany("INSERT OR IGNORE INTO message_ids (message_id, sent_at, recorded_at) VALUES (?, ?, ?)", rows)
+            self.db.commit()
+        os.replace(file_path, file_path + '.imported')
+        logging.info(f"Imported {len(rows)} message IDs from {file_path}.")
+        return len(rows)
+
+    def __len__(self):
+        with self.lock:
+            return self.db.execute("SELECT COUNT(*) FROM message_ids").fetchone()[0]
+
+    def close(self):
+        with self.lock:
+            self.db.close()
+
+
+def open_ledger(path, legacy_file):
+    ledger = MessageLedger(path)
+    if os.path.exists(legacy_file):
+        ledger.import_text_file(legacy_file)
+    return ledger
@@ -0,0 +1,326 @@
+import os
+import json
+import time
+import atexit
+import threading
+import logging
+from bisect import bisect_left
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+SHARD_INTERVAL = float(os.getenv('METRICS_SHARD_INTERVAL', 5))
+
+
+class _Shards:
+    # Every thread updates its own dict, so updates take no lock. A scrape
+    # copies each thread's dict and adds them up.
+    def __init__(self):
+        self._local = threading.local()
+        self._shards = []
+        self._lock = threading.Lock()
+
+    def mine(self):
+        try:
+            return self._local.values
+        except AttributeError:
+            values = self._local.values = {}
+            with self._lock:
+                self._shards.append(values)
+            return values
+
+    def snapshots(self):
+        with self._lock:
+            shards = list(self._shards)
+        return [shard.copy() for shard in shards]
+
+
+def ordered(values):
+    return sorted(values.items(), key=lambda item: tuple(str(value) for value in item[0]))
+
+
+def escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def label_text(names, values, extra=()):
+    pairs = list(zip(names, values)) + list(extra)
+    if not pairs:
+        return ''
+    return '{' + ','.join(f'{name}="{escape(value)}"' for name, value in pairs) + '}'
+
+
+def number(value):
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+def collect(callback):
+    # A callback returns a number, or {label values: number}.
+    values = callback()
+    return values if isinstance(values, dict) else {(): values}
+
+
+def add_values(totals, values):
+    # Adds {label values: number or histogram entry} into totals.
+    for labels, value in values.items():
+        if isinstance(value, list):
+            total = totals.setdefault(labels, [0] * len(value))
+            for i, item in enumerate(value):
+                total[i] += item
+        else:
+            totals[labels] = totals.get(labels, 0) + value
+    return totals
+
+
+def pid_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+def clear_shards(directory):
+    # Shards left by the processes of an earlier run, removed before the new
+    # ones start so that their totals don't carry over.
+    if not os.path.isdir(directory):
+        return 0
+    removed = 0
+    for entry in os.scandir(directory):
+        if entry.name.endswith(('.json', '.part')):
+            os.remove(entry.path)
+            removed += 1
+    return removed
+
+
+class Counter:
+    # With a callback, the values are read from it at scrape time instead,
+    # for totals something else already keeps.
+    type = 'counter'
+
+    def __init__(self, name, documentation, labels=(), callback=None):
+        self.name = name
+        self.documentation = documentation
+        self.labels = tuple(labels)
+        self.callback = callback
+        self._shards = _Shards()
+
+    def inc(self, amount=1, labels=()):
+        values = self._shards.mine()
+        values[labels] = values.get(labels, 0) + amount
+
+    def values(self):
+        if self.callback is not None:
+            return collect(self.callback)
+        totals = {}
+        for shard in self._shards.snapshots():
+            for labels, value in shard.items():
+                totals[labels] = totals.get(labels, 0) + value
+        return totals
+
+    def samples(self, values):
+        for labels, value in ordered(values):
+            yield f"{self.name}{label_text(self.labels, labels)} {number(value)}"
+
+
+class Gauge:
+    # set() is a single dict assignment, last writer wins.
+    type = 'gauge'
+
+    def __init__(self, name, documentation, labels=(), callback=None):
+        self.name = name
+        self.documentation = documentation
+        self.labels = tuple(labels)
+        self.callback = callback
+        self._values = {}
+
+    def set(self, value, labels=()):
+        self._values[labels] = value
+
+    def values(self):
+        if self.callback is None:
+            return dict(self._values)
+        return collect(self.callback)
+
+    def samples(self, values):
+        for labels, value in ordered(values):
+            yield f"{self.name}{label_text(self.labels, labels)} {number(value)}"
+
+
+class Histogram:
+    type = 'histogram'
+
+    def __init__(self, name, documentation, labels=(), buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labels = tuple(labels)
+        self.buckets = tuple(buckets)
+        self._shards = _Shards()
+
+    def observe(self, value, labels=()):
+        # Per label values: one count per bucket plus +Inf, then sum and count.
+        values = self._shards.mine()
+        entry = values.get(labels)
+        if entry is None:
+            entry = values[labels] = [0] * (len(self.buckets) + 3)
+        entry[bisect_left(self.buckets, value)] += 1
+        entry[-2] += value
+        entry[-1] += 1
+
+    def values(self):
+        totals = {}
+        for shard in self._shards.snapshots():
+            for labels, entry in shard.items():
+                total = totals.setdefault(labels, [0] * len(entry))
+                for i, value in enumerate(list(entry)):
+                    total[i] += value
+        return totals
+
+    def samples(self, values):
+        for labels, entry in ordered(values):
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float('inf'),), entry):
+                cumulative += count
+                yield f"{self.name}_bucket{label_text(self.labels, labels, [('le', number(bound))])} {cumulative}"
+            yield f"{self.name}_sum{label_text(self.labels, labels)} {number(entry[-2])}"
+            yield f"{self.name}_count{label_text(self.labels, labels)} {entry[-1]}"
+
+
+class Registry:
+    def __init__(self):
+        self._metrics = {}
+        self._lock = threading.Lock()
+        self.shard_dir = None
+        self._shard_path = None
+
+    def share(self, directory, interval=SHARD_INTERVAL):
+        # For several worker processes behind one /metrics, like gunicorn's:
+        # each one writes its values to its own file in directory every
+        # interval seconds, and a scrape adds the other files to its own live
+        # values. Counters and histograms of exited processes still count, so
+        # totals never go down; gauges only count for running processes.
+        # Call it in the worker, after the fork.
+        os.makedirs(directory, exist_ok=True)
+        self.shard_dir = directory
+        self._shard_path = os.path.join(directory, f"{os.getpid()}-{time.time_ns()}.json")
+        self.write_shard()
+        if interval:
+            threading.Thread(target=self._write_shards, args=(interval,), name='metrics-shard', daemon=True).start()
+        atexit.register(self.try_write_shard)
+
+    def _write_shards(self, interval):
+        while True:
+            time.sleep(interval)
+            self.try_write_shard()
+
+    def try_write_shard(self):
+        try:
+            self.write_shard()
+        except Exception as e:
+            logging.warning(f"Writing metrics shard {self._shard_path} failed: {e}")
+
+    def write_shard(self):
+        with self._lock:
+            metrics = list(self._metrics.values())
+        shard = {'pid': os.getpid(), 'metrics': {}}
+        for metric in metrics:
+            try:
+                values = metric.values()
+            except Exception:
+                continue
+            shard['metrics'][metric.name] = [[list(labels), value] for labels, value in values.items()]
+        partial = f"{self._shard_path}.part"
+        with open(partial, 'w') as f:
+            json.dump(shard, f)
+        os.replace(partial, self._shard_path)
+
+    def other_shards(self):
+        # {metric name: {label values: value}} per file of the other processes.
+        shards = []
+        for entry in os.scandir(self.shard_dir):
+            if not entry.name.endswith('.json') or entry.path == self._shard_path:
+                continue
+            try:
+                with open(entry.path) as f:
+                    shard = json.load(f)
+            except (OSError, ValueError):
+                continue
+            alive = pid_alive(shard['pid'])
+            values = {}
+            for name, samples in shard['metrics'].items():
+                metric = self._metrics.get(name)
+                if metric is None or (metric.type == 'gauge' and not alive):
+                    continue
+                values[name] = {tuple(labels): value for labels, value in samples}
+            shards.append(values)
+        return shards
+
+    def _register(self, metric):
+        with self._lock:
+            if metric.name in self._metrics:
+                raise ValueError(f"Metric {metric.name} is already registered")
+            self._metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name, documentation, labels=(), callback=None):
+        return self._register(Counter(name, documentation, labels, callback))
+
+    def gauge(self, name, documentation, labels=(), callback=None):
+        return self._register(Gauge(name, documentation, labels, callback))
+
+    def histogram(self, name, documentation, labels=(), buckets=DEFAULT_BUCKETS):
+        return self._register(Histogram(name, documentation, labels, buckets))
+
+    def render(self):
+        # Prometheus text exposition format.
+        with self._lock:
+            metrics = list(self._metrics.values())
+        shards = self.other_shards() if self.shard_dir else []
+        lines = []
+        for metric in metrics:
+            lines.append(f"# HELP {metric.name} {metric.documentation}")
+            lines.append(f"# TYPE {metric.name} {metric.type}")
+            try:
+                values = dict(metric.values())
+                for shard in shards:
+                    add_values(values, shard.get(metric.name, {}))
+                lines.extend(metric.samples(values))
+            except Exception as e:
+                logging.warning(f"Collecting metric {metric.name} failed: {e}")
+        return '\n'.join(lines) + '\n'
+
+
+REGISTRY = Registry()
+
+
+def serve(port, registry=REGISTRY, host=''):
+    # A small /metrics listener for the services that have no web server.
+    class MetricsHandler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path.split('?')[0] != '/metrics':
+                self.send_error(404)
+                return
+            body = registry.render().encode()
+            self.send_response(200)
+            self.send_header('Content-Type', CONTENT_TYPE)
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass
+
+    server = ThreadingHTTPServer((host, port), MetricsHandler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name='metrics', daemon=True).start()
+    logging.info(f"Serving metrics on port {server.server_address[1]}.")
+    return server
+
+
+def serve_from_env(variable, default):
+    port = int(os.getenv(variable, default))
+    return serve(port) if port else None
@@ -0,0 +1,144 @@
+import os
+import time
+import logging
+from dotenv import load_dotenv
+import pymysql
+import pymysql.cursors
+
+MIGRATIONS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'migrations')
+
+# Errors meaning a statement's effect is already in place, e.g. on databases
+# that were created from the old one-shot init.sql.
+ALREADY_APPLIED_ERRORS = {
+    1050,  # table already exists
+    1060,  # duplicate column name
+    1061,  # duplicate key name
+    1091,  # can't drop, index doesn't exist
+}
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+
+def duplicate_serial_numbers(cursor):
+    cursor.execute("""
+    SELECT serial_number, GROUP_CONCAT(id ORDER BY id SEPARATOR ', ') AS ids
+    FROM printers GROUP BY serial_number HAVING COUNT(*) > 1 ORDER BY serial_number
+    """)
+    duplicates = cursor.fetchall()
+    if not duplicates:
+        return None
+    listed = '; '.join(f"{row['serial_number']} (printer ids {row['ids']})" for row in duplicates)
+    return (f"printers has {len(duplicates)} duplicate serial numbers, so the unique index on serial_number can't be created. "
+            f"Merge or delete the duplicates, keeping one row per serial number, then start again: {listed}")
+
+
+# Checks run before a migration is applied, a returned message stops migrating.
+PRECHECKS = {
+    '0003': duplicate_serial_numbers,
+}
+
+
+def list_migrations(migrations_dir=MIGRATIONS_DIR):
+    migrations = []
+    for name in sorted(os.listdir(migrations_dir)):
+        if name.endswith('.sql'):
+            version = name.split('_', 1)[0]
+            migrations.append((version, os.path.join(migrations_dir, name)))
+    return migrations
+
+
+def split_statements(sql):
+    statements = []
+    current = []
+    for line in sql.splitlines():
+        stripped = line.strip()
+        if not stripped or stripped.startswith('--'):
+            continue
+        current.append(line)
+        if stripped.endswith(';'):
+            statements.append('\n'.join(current).rstrip().rstrip(';'))
+            current = []
+    if current:
+        statements.append('\n'.join(current))
+    return statements
+
+
+def applied_versions(cursor):
+    cursor.execute("""
+    CREATE TABLE IF NOT EXISTS schema_migrations (
+        version VARCHAR(32) NOT NULL PRIMARY KEY,
+        name VARCHAR(255) NOT NULL,
+        applied_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    )
+    """)
+    cursor.execute("SELECT version FROM schema_migrations")
+    return {row['version'] for row in cursor.fetchall()}
+
+
+def run_migrations(connection, migrations_dir=MIGRATIONS_DIR):
+    applied = []
+    with connection.cursor() as cursor:
+        # app and databroker both migrate on startup, only one may do the work.
+        cursor.execute("SELECT GET_LOCK('schema_migrations', 60) AS locked")
+        if not cursor.fetchone()['locked']:
+            raise RuntimeError("Timed out waiting for the schema migration lock.")
+        try:
+            done = applied_versions(cursor)
+            for version, path in list_migrations(migrations_dir):
+                if version in done:
+                    continue
+                check = PRECHECKS.get(version)
+                problem = check(cursor) if check else None
+                if problem:
+                    raise RuntimeError(f"Migration {os.path.basename(path)}: {problem}")
+                with open(path) as f:
+                    statements = split_statements(f.read())
+                for statement in statements:
+                    try:
+                        cursor.execute(statement)
+                    except pymysql.err.MySQLError as e:
+                        if e.args and e.args[0] in ALREADY_APPLIED_ERRORS:
+                            logging.info(f"Migration {version}: skipping already applied statement ({e.args[1]}).")
+                        else:
+                            raise
+                cursor.execute("INSERT INTO schema_migrations (version, name) VALUES (%s, %s)",
+                               (version, os.path.basename(path)))
+                connection.commit()
+                applied.append(version)
+                logging.info(f"Applied migration {os.path.basename(path)}.")
+        finally:
+            cursor.execute("SELECT RELEASE_LOCK('schema_migrations')")
+    return applied
+
+
+def connect(retries=30, delay=2):
+    for attempt in range(retries):
+        try:
+            return pymysql.connect(
+                host=os.getenv('MYSQL_DB_HOST'),
+                user=os.getenv('MYSQL_DB_USER'),
+                password=os.getenv('MYSQL_ROOT_PASSWORD'),
+                database=os.getenv('MYSQL_DATABASE'),
+                cursorclass=pymysql.cursors.DictCursor
+            )
+        except pymysql.err.OperationalError as e:
+            if attempt == retries - 1:
+                raise
+            logging.info(f"Database not ready ({e}), retrying in {delay}s.")
+            time.sleep(delay)
+
+
+def migrate():
+    load_dotenv()
+    connection = connect()
+    try:
+        applied = run_migrations(connection)
+    finally:
+        connection.close()
+    if not applied:
+        logging.info("Database schema is up to date.")
+    return applied
+
+
+if __name__ == "__main__":
+    migrate()
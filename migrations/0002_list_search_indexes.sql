@@ -0,0 +1,4 @@
+-- Prefix search on the /printers list.
+
+CREATE INDEX serial_number ON printers (serial_number);
+CREATE INDEX model ON printers (model);
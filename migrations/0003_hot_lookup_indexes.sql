@@ -0,0 +1,12 @@
+-- databroker looks printers up by serial number on every report.
+-- migrate.py refuses to run this while printers has duplicate serial numbers
+-- and lists them, see duplicate_serial_numbers.
+CREATE UNIQUE INDEX uq_printers_serial_number ON printers (serial_number);
+DROP INDEX serial_number ON printers;
+
+-- printer_info and generate_pdf read the latest readings of one printer.
+CREATE INDEX idx_print_history_printer_date ON print_history (printers_id, date);
+
+-- Sargable replacement for DATE(request_date) in the duplicate error check.
+ALTER TABLE service_requests ADD COLUMN request_day DATE AS (DATE(request_date)) STORED;
+CREATE INDEX idx_service_requests_duplicate ON service_requests (printer_id, service_request, request_day);
@@ -0,0 +1,17 @@
+-- Per printer and month: last readings, pages printed and their cost.
+-- Kept up to date by usage_rollup.py as readings arrive, rebuilt with
+-- python usage_rollup.py --rebuild
+CREATE TABLE IF NOT EXISTS printer_usage_monthly (
+    printer_id INT NOT NULL,
+    month DATE NOT NULL,
+    last_date DATE NOT NULL,
+    last_counter_black INT,
+    last_counter_color INT,
+    black_pages INT NOT NULL DEFAULT 0,
+    color_pages INT NOT NULL DEFAULT 0,
+    black_cost DECIMAL(12,2),
+    color_cost DECIMAL(12,2),
+    readings INT NOT NULL DEFAULT 0,
+    PRIMARY KEY (printer_id, month),
+    FOREIGN KEY (printer_id) REFERENCES printers(id) ON DELETE CASCADE
+);
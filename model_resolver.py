@@ -0,0 +1,85 @@
+import os
+import json
+import logging
+import threading
+
+MODELS_FILE = 'printer_models.json'
+
+
+def normalize(serial_number):
+    return serial_number.strip().upper()
+
+
+def build_trie(models):
+    # models is printer_models.json: model -> serial number prefixes. Each
+    # node maps the next character to a child node, None to the model whose
+    # prefix ends there. A prefix listed for two models keeps the later one.
+    trie = {}
+    for model, prefixes in models.items():
+        for prefix in prefixes:
+            node = trie
+            for char in normalize(prefix):
+                node = node.setdefault(char, {})
+            node[None] = model
+    return trie
+
+
+def longest_match(trie, serial_number):
+    model = None
+    node = trie
+    for char in normalize(serial_number):
+        node = node.get(char)
+        if node is None:
+            break
+        model = node.get(None, model)
+    return model
+
+
+class ModelResolver:
+    # Serial number -> model by the longest matching prefix in
+    # printer_models.json. The file is read again when its mtime changes, so
+    # new models are picked up without restarting anything.
+    def __init__(self, path=MODELS_FILE):
+        self.path = path
+        self._mtime = None
+        self._trie = {}
+        self._prefixes = {}
+        self._lock = threading.Lock()
+        self.reload_if_changed()
+
+    def reload_if_changed(self):
+        try:
+            mtime = os.stat(self.path).st_mtime_ns
+        except FileNotFoundError:
+            mtime = None
+        if mtime is None or mtime == self._mtime:
+            return False
+        with self._lock:
+            if mtime == self._mtime:
+                return False
+            self._mtime = mtime
+            try:
+                with open(self.path) as f:
+                    models = json.load(f)
+            except ValueError as e:
+                # Most likely caught mid-write, the next change reloads it.
+                logging.error(f"Could not read {self.path}, keeping the previous models: {e}")
+                return False
+            self._trie = build_trie(models)
+            self._prefixes = {normalize(prefix): model for model, prefixes in models.items() for prefix in prefixes}
+        logging.info(f"Loaded {len(self._prefixes)} serial number prefixes from {self.path}.")
+        return True
+
+    def resolve(self, serial_number):
+        self.reload_if_changed()
+        return longest_match(self._trie, serial_number)
+
+    def resolve_many(self, serial_numbers):
+        # One reload check and one trie for the whole call.
+        self.reload_if_changed()
+        trie = self._trie
+        return {serial_number: longest_match(trie, serial_number) for serial_number in serial_numbers}
+
+    def prefixes(self):
+        self.reload_if_changed()
+        return self._prefixes
@@ -0,0 +1,35 @@
+def fetch_keyset_page(cursor, sql, conditions, params, key_column, key_field, per_page, after=None, before=None):
+    # Keyset pagination: seek past the cursor value on an indexed key instead
+    # of walking OFFSET rows, so every page costs the same.
+    conditions = list(conditions)
+    params = list(params)
+    if before is not None:
+        conditions.append(f"{key_column} < %s")
+        params.append(before)
+        order = 'DESC'
+    else:
+        if after is not None:
+            conditions.append(f"{key_column} > %s")
+            params.append(after)
+        order = 'ASC'
+    if conditions:
+        sql += " WHERE " + " AND ".join(f"({condition})" for condition in conditions)
+    sql += f" ORDER BY {key_column} {order} LIMIT %s"
+    params.append(per_page + 1)
+
+    cursor.execute(sql, params)
+    rows = list(cursor.fetchall())
+    has_more = len(rows) > per_page
+    rows = rows[:per_page]
+    if before is not None:
+        rows.reverse()
+
+    if not rows:
+        return rows, None, None
+    if before is not None:
+        prev_cursor = rows[0][key_field] if has_more else None
+        next_cursor = rows[-1][key_field]
+    else:
+        prev_cursor = rows[0][key_field] if after is not None else None
+        next_cursor = rows[-1][key_field] if has_more else None
+    return rows, prev_cursor, next_cursor
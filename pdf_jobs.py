@@ -0,0 +1,146 @@
+import os
+import time
+import hashlib
+import logging
+import threading
+from concurrent import futures
+
+WORKERS = int(os.getenv('PDF_WORKERS', 2))
+CACHE_DIR = os.getenv('PDF_CACHE_DIR', 'temp/pdf_cache')
+CACHE_SIZE = int(os.getenv('PDF_CACHE_SIZE', 500))
+JOB_TIMEOUT = float(os.getenv('PDF_JOB_TIMEOUT', 300))
+
+WARM_UP_HTML = "<html><body><p>PDF worker warm-up</p></body></html>"
+
+
+def warm_up():
+    # Importing WeasyPrint and loading its fonts is a large part of the first
+    # render, each worker process pays it once when it starts.
+    from weasyprint import HTML
+    HTML(string=WARM_UP_HTML).write_pdf()
+
+
+def render_pdf(html, path):
+    from weasyprint import HTML
+    partial = f"{path}.{os.getpid()}.part"
+    HTML(string=html).write_pdf(partial)
+    os.replace(partial, path)
+    return path
+
+
+def content_key(html):
+    return hashlib.sha256(html.encode('utf-8')).hexdigest()
+
+
+def remove(path):
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
+
+
+class PdfJobs:
+    # PDFs are rendered in a pool of worker processes and kept on disk under
+    # the hash of their HTML, so the same report is only rendered once. The
+    # cache directory is shared by all app workers: a job submitted in one can
+    # be polled and downloaded through any other.
+    def __init__(self, cache_dir=CACHE_DIR, workers=WORKERS, max_files=CACHE_SIZE, render=render_pdf, executor=None):
+        self.cache_dir = os.path.abspath(cache_dir)
+        self.workers = workers
+        self.max_files = max_files
+        self.render = render
+        self.executor = executor
+        self._jobs = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.failures = 0
+        os.makedirs(self.cache_dir, exist_ok=True)
+
+    def path(self, key):
+        return os.path.join(self.cache_dir, f"{key}.pdf")
+
+    def _marker(self, key, kind):
+        return os.path.join(self.cache_dir, f"{key}.{kind}")
+
+    def start(self):
+        # Starts the worker processes now so that the first report doesn't
+        # wait for them. Called after gunicorn has forked the app workers,
+        # each one gets its own pool.
+        with self._lock:
+            self._start()
+
+    def _start(self):
+        if self.executor is None:
+            self.executor = futures.ProcessPoolExecutor(self.workers, initializer=warm_up)
+            for _ in range(self.workers):
+                self.executor.submit(int)
+
+    def _pending_elsewhere(self, key):
+        try:
+            return time.time() - os.path.getmtime(self._marker(key, 'pending')) < JOB_TIMEOUT
+        except FileNotFoundError:
+            return False
+
+    def submit(self, html):
+        key = content_key(html)
+        path = self.path(key)
+        with self._lock:
+            if os.path.exists(path):
+                # Touched so that pruning drops the least recently used PDFs.
+                os.utime(path)
+                self.hits += 1
+                return key
+            if key in self._jobs or self._pending_elsewhere(key):
+                return key
+            self.misses += 1
+            self._start()
+            remove(self._marker(key, 'error'))
+            open(self._marker(key, 'pending'), 'w').close()
+            future = self.executor.submit(self.render, html, path)
+            self._jobs[key] = future
+        future.add_done_callback(lambda future: self._finished(key, future))
+        return key
+
+    def _finished(self, key, future):
+        with self._lock:
+            self._jobs.pop(key, None)
+        error = future.exception()
+        if error is not None:
+            self.failures += 1
+            logging.error(f"Rendering PDF {key} failed: {error}")
+            with open(self._marker(key, 'error'), 'w') as f:
+                f.write(str(error))
+        remove(self._marker(key, 'pending'))
+        if error is None:
+            self.prune()
+
+    def status(self, key):
+        if os.path.exists(self.path(key)):
+            return 'done'
+        if os.path.exists(self._marker(key, 'error')):
+            return 'failed'
+        with self._lock:
+            if key in self._jobs:
+                return 'pending'
+        if os.path.exists(self._marker(key, 'pending')):
+            # The app worker rendering it went away without finishing.
+            return 'pending' if self._pending_elsewhere(key) else 'failed'
+        return None
+
+    def prune(self):
+        pdfs = []
+        for entry in os.scandir(self.cache_dir):
+            if entry.name.endswith('.pdf'):
+                pdfs.append((entry.stat().st_mtime, entry.path))
+        if len(pdfs) <= self.max_files:
+            return 0
+        pdfs.sort()
+        for _, path in pdfs[:len(pdfs) - self.max_files]:
+            remove(path)
+        return len(pdfs) - self.max_files
+
+    def stats(self):
+        with self._lock:
+            return {'hits': self.hits, 'misses': self.misses, 'failures': self.failures,
+                    'pending': len(self._jobs), 'workers': self.workers}
@@ -0,0 +1,101 @@
+import re
+import datetime
+from collections import namedtuple
+
+# Counter reports are "[Key],value" lines, error reports "Key :value" lines.
+# One alternation finds every field we use in a single scan of the report.
+TOKEN_PATTERN = re.compile(
+    r'\[(Total Black Counter|Total Color Counter|Total Counter)\],[ \t]*(\d{0,25})'
+    r'|\[(Serial Number|Send Date)\],([^\r\n]*)'
+    r'|(Installed Place|Error|Occurred Time) :([^\r\n]*)'
+)
+FILE_DATE_PATTERN = re.compile(r'\d{4}-\d{2}-\d{2}')
+
+FIELDS = {
+    'Serial Number': 'serial_number',
+    'Total Black Counter': 'counter_black',
+    'Total Color Counter': 'counter_color',
+    'Total Counter': 'counter_total',
+    'Send Date': 'send_date',
+    'Installed Place': 'installed_place',
+    'Error': 'error',
+    'Occurred Time': 'occurred_time',
+}
+
+
+class Report(namedtuple('Report', ['serial_number', 'installed_place', 'counter_black', 'counter_color',
+                                   'counter_total', 'error', 'timestamp'])):
+    __slots__ = ()
+
+    @property
+    def identifier(self):
+        return self.serial_number or self.installed_place or 'unknown'
+
+    @property
+    def has_counters(self):
+        return bool(self.serial_number) and any(
+            counter is not None for counter in (self.counter_black, self.counter_color, self.counter_total))
+
+    def billing_counters(self):
+        # Colour devices report black and colour separately, mono devices
+        # only report a total, which is billed as black.
+        if self.counter_color is not None:
+            return self.counter_black, self.counter_color
+        return self.counter_total, "0"
+
+
+def parse_timestamp(value):
+    # "02/12/2023 01:46:21" (Occurred Time) or "03/10/23" (Send Date), day first.
+    # Sliced by hand, strptime would cost more than the rest of the parse.
+    try:
+        day, month, year = value[:10].split(' ')[0].split('/')
+        year = int(year)
+        if year < 100:
+            year += 2000
+        hour = minute = second = 0
+        if len(value) >= 19:
+            hour, minute, second = (int(part) for part in value[11:19].split(':'))
+        return datetime.datetime(year, int(month), int(day), hour, minute, second)
+    except ValueError:
+        return None
+
+
+def parse(content):
+    values = {}
+    for counter_key, counter, bracket_key, bracket_value, label_key, label_value in TOKEN_PATTERN.findall(content):
+        if counter_key:
+            field, value = FIELDS[counter_key], counter
+        else:
+            field = FIELDS[bracket_key or label_key]
+            value = (bracket_value or label_value).strip()
+            if not value and field == 'error':
+                continue
+        if field not in values:
+            values[field] = value
+
+    timestamp = None
+    if 'occurred_time' in values:
+        timestamp = parse_timestamp(values['occurred_time'])
+    elif 'send_date' in values:
+        timestamp = parse_timestamp(values['send_date'])
+
+    return Report(
+        serial_number=values.get('serial_number'),
+        installed_place=values.get('installed_place'),
+        counter_black=values.get('counter_black'),
+        counter_color=values.get('counter_color'),
+        counter_total=values.get('counter_total'),
+        error=values.get('error'),
+        timestamp=timestamp,
+    )
+
+
+def file_date(file_path):
+    match = FILE_DATE_PATTERN.search(file_path)
+    if match:
+        value = match.group()
+        try:
+            return datetime.date(int(value[:4]), int(value[5:7]), int(value[8:10]))
+        except ValueError:
+            return None
+    return None
@@ -0,0 +1,138 @@
+import os
+import re
+import time
+import zipfile
+import argparse
+import logging
+from concurrent import futures
+from jinja2 import Environment, FileSystemLoader, select_autoescape
+from dotenv import load_dotenv
+from billing import bill_fleet, month_range
+from migrate import connect
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+TEMPLATES = 'templates'
+TEMPLATE = 'statement.html'
+STYLESHEET = 'static/styles/statement.css'
+WORKERS = int(os.getenv('STATEMENT_WORKERS', os.cpu_count() or 1))
+
+COMPANY_SQL = "SELECT company_name, tax_id, address, postal_code, city, email, phone FROM my_company WHERE id = 1"
+
+CLIENTS_SQL = "SELECT tax_id, company, address, postal_code, city, phone, email FROM clients"
+
+# Model and end-of-period counters of every contract printer, from its newest
+# rollup month up to the billed one.
+COUNTERS_SQL = """
+SELECT printers.id, printers.model, latest.last_counter_black, latest.last_counter_color
+FROM printers
+LEFT JOIN printer_usage_monthly latest ON latest.printer_id = printers.id
+AND latest.month = (SELECT MAX(month) FROM printer_usage_monthly WHERE printer_id = printers.id AND month <= %s)
+WHERE printers.service_contract = 1
+"""
+
+
+def build_statements(company, clients, counters, bills, totals, start, end):
+    # One statement per client, printers not assigned to one aren't billed.
+    printers = {}
+    for bill in bills:
+        if bill.tax_id is None:
+            continue
+        counter = counters.get(bill.printer_id, {})
+        printers.setdefault(bill.tax_id, []).append(dict(bill._asdict(), model=counter.get('model'),
+                                                         counter_black=counter.get('last_counter_black'),
+                                                         counter_color=counter.get('last_counter_color')))
+    return [{'company': company, 'client': clients[total.tax_id], 'printers': printers[total.tax_id],
+             'total': total._asdict(), 'start': start, 'end': end}
+            for total in totals if total.tax_id in clients]
+
+
+def load_statements(connection, start, end):
+    bills, totals = bill_fleet(connection, start, end)
+    with connection.cursor() as cursor:
+        cursor.execute(COMPANY_SQL)
+        company = cursor.fetchone()
+        cursor.execute(CLIENTS_SQL)
+        clients = {row['tax_id']: row for row in cursor.fetchall()}
+        cursor.execute(COUNTERS_SQL, (start,))
+        counters = {row['id']: row for row in cursor.fetchall()}
+    return build_statements(company, clients, counters, bills, totals, start, end)
+
+
+def file_name(statement):
+    tax_id = re.sub(r'[^0-9A-Za-z_-]', '_', statement['client']['tax_id'])
+    return f"statement-{statement['start']:%Y-%m}-{tax_id}.pdf"
+
+
+def template_environment(templates=TEMPLATES):
+    return Environment(loader=FileSystemLoader(templates), autoescape=select_autoescape())
+
+
+_worker = {}
+
+
+def init_worker(templates=TEMPLATES, stylesheet=STYLESHEET):
+    # The template, the stylesheet and the fonts it uses are loaded once per
+    # worker process and shared by every statement it renders.
+    from weasyprint import CSS
+    from weasyprint.text.fonts import FontConfiguration
+    fonts = FontConfiguration()
+    _worker['fonts'] = fonts
+    _worker['stylesheet'] = CSS(filename=stylesheet, font_config=fonts)
+    _worker['template'] = template_environment(templates).get_template(TEMPLATE)
+
+
+def render_statement(statement):
+    from weasyprint import HTML
+    html = _worker['template'].render(**statement)
+    pdf = HTML(string=html).write_pdf(stylesheets=[_worker['stylesheet']], font_config=_worker['fonts'])
+    return file_name(statement), pdf
+
+
+def generate(statements, output, workers=WORKERS, executor=None):
+    # output is a directory, or a zip file when it ends in .zip. Returns the
+    # number of statements written per second.
+    started = time.monotonic()
+    total = len(statements)
+    report_every = max(1, total // 20)
+    if executor is None:
+        executor = futures.ProcessPoolExecutor(workers, initializer=init_worker)
+    archive = zipfile.ZipFile(output, 'w') if output.endswith('.zip') else None
+    if archive is None:
+        os.makedirs(output, exist_ok=True)
+    try:
+        with executor:
+            pending = [executor.submit(render_statement, statement) for statement in statements]
+            for done, future in enumerate(futures.as_completed(pending), 1):
+                name, pdf = future.result()
+                # PDFs are compressed already, the archive only stores them.
+                if archive is not None:
+                    archive.writestr(name, pdf)
+                else:
+                    with open(os.path.join(output, name), 'wb') as f:
+                        f.write(pdf)
+                if done % report_every == 0 or done == total:
+                    logging.info(f"Statements: {done}/{total}, {done / (time.monotonic() - started):.1f}/s.")
+    finally:
+        if archive is not None:
+            archive.close()
+    elapsed = time.monotonic() - started
+    return total / elapsed if elapsed else 0.0
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Render the monthly PDF statement of every client.")
+    parser.add_argument('month', help="statement month, YYYY-MM")
+    parser.add_argument('--output', required=True, help="directory for the PDFs, or a .zip file")
+    parser.add_argument('--workers', type=int, default=WORKERS, help="rendering processes")
+    args = parser.parse_args()
+
+    load_dotenv()
+    connection = connect(retries=1)
+    try:
+        statements = load_statements(connection, *month_range(args.month))
+    finally:
+        connection.close()
+
+    rate = generate(statements, args.output, args.workers)
+    logging.info(f"Wrote {len(statements)} statements to {args.output}, {rate:.1f} statements/s.")
@@ -0,0 +1,79 @@
+import os
+import io
+import csv
+import json
+import decimal
+import datetime
+import pymysql.cursors
+
+CHUNK_ROWS = int(os.getenv('STREAM_CHUNK_ROWS', 1000))
+
+
+def stream_rows(pool, sql, params=(), chunk_rows=CHUNK_ROWS):
+    # Yields lists of up to chunk_rows rows read from a server-side cursor, so
+    # only one chunk is in memory however large the result is. The body of a
+    # streamed response is produced after the view returned and the request's
+    # own connection went back to the pool, so this takes a connection of its
+    # own when the first chunk is asked for.
+    connection = pool.acquire()
+    finished = False
+    try:
+        cursor = connection.cursor(pymysql.cursors.SSDictCursor)
+        cursor.execute(sql, params)
+        while True:
+            rows = cursor.fetchmany(chunk_rows)
+            if not rows:
+                break
+            yield rows
+        cursor.close()
+        finished = True
+    finally:
+        if not finished:
+            # The rest of an unbuffered result would have to be read before
+            # the connection could be used again, dropping it is cheaper.
+            try:
+                connection.close()
+            except Exception:
+                pass
+        pool.release(connection)
+
+
+def json_default(value):
+    if isinstance(value, (datetime.date, datetime.datetime)):
+        return value.isoformat()
+    if isinstance(value, decimal.Decimal):
+        return str(value)
+    raise TypeError(f"{type(value).__name__} is not JSON serializable")
+
+
+def dumps(row):
+    return json.dumps(row, default=json_default)
+
+
+def csv_chunks(chunks, columns):
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(columns)
+    for rows in chunks:
+        writer.writerows([row[column] for column in columns] for row in rows)
+        yield buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
+    if buffer.tell():
+        yield buffer.getvalue()
+
+
+def ndjson_chunks(chunks, dumps=dumps):
+    for rows in chunks:
+        yield ''.join(dumps(row) + '\n' for row in rows)
+
+
+def json_array_chunks(chunks, dumps=dumps):
+    # The same array a single json.dumps of all rows gives, written a chunk
+    # at a time.
+    yield '['
+    separator = ''
+    for rows in chunks:
+        yield separator + ','.join(dumps(row) for row in rows)
+        separator = ','
+    yield ']\n'
@@ -0,0 +1,142 @@
+import os
+import tempfile
+import unittest
+from unittest.mock import MagicMock, patch
+import pymysql
+import datetime
+from decimal import Decimal
+from databroker import IngestBatcher, IngestWorkerPool, REQUEST_LOOKUP_SQL
+from usage_rollup import LOCK_SQL
+
+
+def counter_record(serial_number, black, color="0"):
+    return {'type': 'counter', 'serial_number': serial_number, 'date': datetime.date(2023, 10, 3),
+            'counter_black': black, 'counter_color': color}
+
+
+class TestIngestBatcher(unittest.TestCase):
+    def setUp(self):
+        self.mock_cursor = MagicMock()
+        self.mock_db = MagicMock()
+        self.mock_db.cursor.return_value = self.mock_cursor
+        self.printers = [
+            {"id": 1, "serial_number": "A1UG021109838", "service_contract": True, "tax_id": "1234412444", "model": "C224"},
+            {"id": 2, "serial_number": "A4FM021007478", "service_contract": True, "tax_id": "1234412444", "model": "C224"},
+        ]
+        self.mock_cursor.fetchall.return_value = self.printers
+
+    def test_records_from_many_files_share_one_transaction(self):
+        rollup_state = [
+            {"id": 1, "price_black": Decimal("0.05"), "price_color": Decimal("0.20"), "last_date": datetime.date(2023, 9, 30),
+             "last_counter_black": 40, "last_counter_color": 0},
+            {"id": 2, "price_black": Decimal("0.05"), "price_color": Decimal("0.20"), "last_date": None,
+             "last_counter_black": None, "last_counter_color": None},
+        ]
+        self.mock_cursor.fetchall.side_effect = [self.printers, rollup_state]
+        batcher = IngestBatcher(self.mock_db, batch_size=3, flush_interval=60)
+        batcher.add([counter_record("A1UG021109838", "100")])
+        batcher.add([counter_record("A4FM021007478", "200", "50")])
+        self.mock_db.commit.assert_not_called()
+
+        batcher.add([counter_record("UNKNOWN", "300")])
+
+        self.assertEqual(self.mock_cursor.execute.call_args_list[0].args, (
+            "SELECT id, serial_number, service_contract, tax_id, model FROM printers WHERE serial_number IN (%s, %s, %s)",
+            ("A1UG021109838", "A4FM021007478", "UNKNOWN")))
+        history, rollup = self.mock_cursor.executemany.call_args_list
+        self.assertEqual(history.args, (
+            "INSERT INTO print_history (printers_id, date, counter_black_history, counter_color_history) VALUES (%s, %s, %s, %s)",
+            [(1, datetime.date(2023, 10, 3), "100", "0"), (2, datetime.date(2023, 10, 3), "200", "50")]))
+        self.assertTrue(rollup.args[0].startswith("INSERT INTO printer_usage_monthly"))
+        self.assertEqual(rollup.args[1], [
+            (1, datetime.date(2023, 10, 1), datetime.date(2023, 10, 3), 100, 0, 60, 0, Decimal("3.00"), Decimal("0.00"), 1),
+            (2, datetime.date(2023, 10, 1), datetime.date(2023, 10, 3), 200, 50, 0, 0, Decimal("0.00"), Decimal("0.00"), 1)])
+        self.mock_db.commit.assert_called_once()
+        self.assertEqual(batcher.stats()['records_written'], 3)
+
+        # The printer rows are locked before the history insert takes its
+        # shared foreign key locks on them.
+        calls = self.mock_cursor.mock_calls
+        lock = calls.index(unittest.mock.call.execute(LOCK_SQL.format(placeholders='%s, %s'), (1, 2)))
+        self.assertLess(lock, calls.index(unittest.mock.call.executemany(*history.args)))
+
+    @patch('databroker.time.sleep')
+    def test_deadlocked_batch_is_retried_without_reconnecting(self, sleep):
+        deadlock = pymysql.err.OperationalError(1213, "Deadlock found when trying to get lock")
+        self.mock_db.commit.side_effect = [deadlock, deadlock, None]
+        self.mock_cursor.fetchone.return_value = None
+        batcher = IngestBatcher(self.mock_db, batch_size=100, flush_interval=60)
+        committed = []
+        batcher.add([{'type': 'error', 'serial_number': "A1UG021109838", 'date': datetime.date(2023, 12, 2),
+                      'error': "Misfeed detected. 66-33"}], on_commit=committed.append)
+        batcher.flush()
+
+        self.assertEqual(self.mock_db.commit.call_count, 3)
+        self.assertEqual(self.mock_db.rollback.call_count, 2)
+        self.mock_db.ping.assert_not_called()
+        self.assertEqual(committed, [True])
+
+    def test_lost_connection_reconnects_once(self):
+        self.mock_db.commit.side_effect = pymysql.err.OperationalError(2013, "Lost connection to MySQL server during query")
+        self.mock_cursor.fetchone.return_value = None
+        batcher = IngestBatcher(self.mock_db, batch_size=100, flush_interval=60)
+        committed = []
+        batcher.add([{'type': 'error', 'serial_number': "A1UG021109838", 'date': datetime.date(2023, 12, 2),
+                      'error': "Misfeed detected. 66-33"}], on_commit=committed.append)
+        batcher.flush()
+
+        self.mock_db.ping.assert_called_once_with(reconnect=True)
+        self.assertEqual(self.mock_db.commit.call_count, 2)
+        self.assertEqual(committed, [False])
+
+    def test_repeated_error_is_folded(self):
+        self.mock_cursor.fetchone.return_value = None
+        error = {'type': 'error', 'serial_number': "A1UG021109838", 'date': datetime.date(2023, 12, 2),
+                 'error': "Misfeed detected. 66-33"}
+        batcher = IngestBatcher(self.mock_db, batch_size=100, flush_interval=60)
+        batcher.add([error, dict(error)])
+        batcher.flush()
+
+        self.mock_cursor.execute.assert_any_call(
+            "INSERT INTO service_requests (printer_id, tax_id, service_request, times_happend) VALUES (%s, %s, %s, %s)",
+            (1, "1234412444", "Misfeed detected. 66-33", 2))
+        self.mock_db.commit.assert_called_once()
+
+        # Another worker with the same error waits on the printer lock, then
+        # its locking lookup sees this row instead of inserting a second one.
+        calls = self.mock_cursor.mock_calls
+        lock = calls.index(unittest.mock.call.execute(LOCK_SQL.format(placeholders='%s, %s'), (1, 2)))
+        lookup = calls.index(unittest.mock.call.execute(REQUEST_LOOKUP_SQL, (1, "Misfeed detected. 66-33", datetime.date(2023, 12, 2))))
+        self.assertLess(lock, lookup)
+        self.assertTrue(REQUEST_LOOKUP_SQL.endswith("FOR UPDATE"))
+
+
+class TestIngestWorkerPool(unittest.TestCase):
+    def test_shutdown_drains_queue(self):
+        connections = []
+
+        def connect():
+            mock_db = MagicMock()
+            mock_db.cursor.return_value.fetchall.return_value = []
+            connections.append(mock_db)
+            return mock_db
+
+        with tempfile.TemporaryDirectory() as temp_dir:
+            pool = IngestWorkerPool(workers=2, queue_size=2, connect=connect)
+            pool.start()
+            for i in range(6):
+                file_path = os.path.join(temp_dir, f"2023-10-0{i + 1}-12-00-00-A1UG021109838.txt")
+                with open(file_path, 'w') as f:
+                    f.write("[Serial Number], A1UG021109838\n[Total Counter],00185186\n")
+                pool.submit(file_path)
+            pool.shutdown()
+
+        self.assertEqual(len(connections), 2)
+        self.assertEqual(sum(pool.histogram.counts['processing']), 6)
+        self.assertEqual(sum(pool.histogram.counts['queue_wait']), 6)
+        for mock_db in connections:
+            mock_db.close.assert_called_once()
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,63 @@
+import re
+import sqlite3
+import unittest
+from decimal import Decimal
+from billing import READINGS_SQL, compute_usage, bill_printers, client_totals
+
+
+class TestComputeUsage(unittest.TestCase):
+    def test_deltas_per_printer(self):
+        ids, black, color = compute_usage([1, 1, 1, 2, 2], [100, 150, 400, 10, 30], [0, 5, 25, 0, 0])
+        self.assertEqual(ids.tolist(), [1, 2])
+        self.assertEqual(black.tolist(), [300, 20])
+        self.assertEqual(color.tolist(), [25, 0])
+
+    def test_counter_reset_counts_the_new_reading(self):
+        ids, black, color = compute_usage([1, 1, 1], [5000, 5200, 40], [0, 0, 0])
+        self.assertEqual(black.tolist(), [240])
+
+    def test_missing_readings_are_forward_filled(self):
+        ids, black, color = compute_usage([1, 1, 1, 2, 2, 2], [100, None, 180, None, 50, 70], [None, None, None, 1, 2, 3])
+        self.assertEqual(black.tolist(), [80, 20])
+        self.assertEqual(color.tolist(), [0, 2])
+
+
+class TestBillPrinters(unittest.TestCase):
+    def test_bills_and_client_totals(self):
+        printers = [
+            (1, 'A1', '111', 'Acme', Decimal('0.05'), Decimal('0.20'), Decimal('100.00')),
+            (2, 'B2', '111', 'Acme', Decimal('0.04'), None, None),
+            (3, 'C3', '222', 'Globex', Decimal('0.05'), Decimal('0.20'), None),
+        ]
+        readings = [(1, 1000, 100), (1, 1400, 150), (2, 500, 0), (2, 600, 0)]
+
+        bills = bill_printers(printers, readings)
+
+        self.assertEqual([(bill.black_pages, bill.color_pages, bill.total) for bill in bills],
+                         [(400, 50, 130.0), (100, 0, 4.0), (0, 0, 0.0)])
+        self.assertEqual([(client.tax_id, client.printers, client.black_pages, client.total) for client in client_totals(bills)],
+                         [('111', 2, 500, 134.0), ('222', 1, 0, 0.0)])
+
+
+class TestReadingsQuery(unittest.TestCase):
+    def test_period_readings_and_anchors(self):
+        db = sqlite3.connect(':memory:')
+        db.execute("CREATE TABLE printers (id INTEGER PRIMARY KEY, service_contract INT)")
+        db.execute("CREATE TABLE print_history (id INTEGER PRIMARY KEY, printers_id INT, date TEXT, "
+                   "counter_black_history INT, counter_color_history INT)")
+        db.executemany("INSERT INTO printers VALUES (?, ?)", [(1, 1), (2, 1), (3, 0)])
+        db.executemany("INSERT INTO print_history (printers_id, date, counter_black_history, counter_color_history) VALUES (?, ?, ?, ?)", [
+            (1, '2023-08-20', 100, 10), (1, '2023-08-25', 150, 12), (1, '2023-09-10', 300, 20), (1, '2023-10-02', 900, 90),
+            (2, '2023-09-05', 40, 0), (2, '2023-09-28', 70, 0),
+            (3, '2023-08-25', 5, 0), (3, '2023-09-10', 9, 0),
+        ])
+        sql = re.sub(r'%\((\w+)\)s', r':\1', READINGS_SQL)
+        rows = db.execute(sql, {'start': '2023-09-01', 'end': '2023-09-30'}).fetchall()
+        # Printer 1 starts from its last August reading, printer 2 has none
+        # before the period and printer 3 is not under contract.
+        self.assertEqual(rows, [(1, 150, 12), (1, 300, 20), (2, 40, 0), (2, 70, 0)])
+        db.close()
+
+
+if __name__ == "__main__":
+    unittest.main()
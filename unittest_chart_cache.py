@@ -0,0 +1,60 @@
+import datetime
+import unittest
+from chart_cache import ChartCache, lttb, downsample
+
+
+def history(days):
+    start = datetime.date(2020, 1, 1)
+    return [{'date': start + datetime.timedelta(days=day), 'counter_black_history': day * 100 + (5000 if day == 400 else 0),
+             'counter_color_history': day * 10} for day in range(days)]
+
+
+class TestDownsampling(unittest.TestCase):
+    def test_lttb_keeps_ends_and_peaks(self):
+        xs = list(range(1000))
+        ys = [0] * 1000
+        ys[500] = 100
+        kept = lttb(xs, ys, 50)
+        self.assertEqual(len(kept), 50)
+        self.assertEqual((kept[0], kept[-1]), (0, 999))
+        self.assertIn(500, kept)
+
+    def test_long_history_is_bounded(self):
+        rows = downsample(history(2000), 200)
+        self.assertLessEqual(len(rows), 200)
+        self.assertEqual(rows[-1]['date'], datetime.date(2020, 1, 1) + datetime.timedelta(days=1999))
+        self.assertIn(400, [(row['date'] - datetime.date(2020, 1, 1)).days for row in rows])
+
+    def test_short_history_is_unchanged(self):
+        rows = history(20)
+        self.assertEqual(downsample(rows, 200), rows)
+
+
+class TestChartCache(unittest.TestCase):
+    def test_new_reading_invalidates_chart(self):
+        cache = ChartCache(max_entries=2)
+        loads = []
+
+        def load_rows():
+            loads.append(1)
+            return history(30)
+
+        svg = cache.chart(1, 30, load_rows)
+        self.assertTrue(svg.startswith(b'<?xml'))
+        self.assertIs(cache.chart(1, 30, load_rows), svg)
+        cache.chart(1, 31, load_rows)
+        self.assertEqual(len(loads), 2)
+        self.assertEqual(cache.stats()['hits'], 1)
+
+    def test_least_recently_used_chart_is_evicted(self):
+        cache = ChartCache(max_entries=2)
+        cache.put(1, 10, b'<svg id="1"/>')
+        cache.put(2, 10, b'<svg id="2"/>')
+        cache.get(1, 10)
+        cache.put(3, 10, b'<svg id="3"/>')
+        self.assertIsNone(cache.get(2, 10))
+        self.assertEqual(cache.get(1, 10), b'<svg id="1"/>')
+
+
+if __name__ == "__main__":
+    unittest.main()
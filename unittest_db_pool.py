@@ -0,0 +1,79 @@
+import threading
+import unittest
+from unittest.mock import patch, MagicMock
+from db_pool import ConnectionPool, PoolTimeout
+
+
+class TestConnectionPool(unittest.TestCase):
+    @patch('pymysql.connect')
+    def test_connection_is_reused(self, mock_connect):
+        mock_connect.side_effect = lambda **kwargs: MagicMock(open=True)
+        pool = ConnectionPool(max_size=2)
+
+        first = pool.acquire()
+        pool.release(first)
+        second = pool.acquire()
+
+        self.assertIs(first, second)
+        self.assertEqual(mock_connect.call_count, 1)
+        first.rollback.assert_called_once()
+        self.assertEqual(pool.stats()['in_use'], 1)
+
+    @patch('pymysql.connect')
+    def test_unhealthy_connection_is_replaced(self, mock_connect):
+        mock_connect.side_effect = lambda **kwargs: MagicMock(open=True)
+        pool = ConnectionPool(max_size=1)
+
+        first = pool.acquire()
+        pool.release(first)
+        first.ping.side_effect = Exception("gone away")
+        second = pool.acquire()
+
+        self.assertIsNot(first, second)
+        first.close.assert_called_once()
+        self.assertEqual(pool.stats()['failed_health_checks'], 1)
+
+    @patch('pymysql.connect')
+    def test_idle_connection_is_recycled(self, mock_connect):
+        mock_connect.side_effect = lambda **kwargs: MagicMock(open=True)
+        pool = ConnectionPool(max_size=1, recycle=0)
+
+        first = pool.acquire()
+        pool.release(first)
+        second = pool.acquire()
+
+        self.assertIsNot(first, second)
+        self.assertEqual(pool.stats()['recycled'], 1)
+
+    @patch('pymysql.connect')
+    def test_bounded_size_times_out(self, mock_connect):
+        mock_connect.side_effect = lambda **kwargs: MagicMock(open=True)
+        pool = ConnectionPool(max_size=1, timeout=0.05)
+
+        pool.acquire()
+        with self.assertRaises(PoolTimeout):
+            pool.acquire()
+
+        stats = pool.stats()
+        self.assertEqual(stats['timeouts'], 1)
+        self.assertEqual(stats['size'], 1)
+
+    @patch('pymysql.connect')
+    def test_waiter_gets_released_connection(self, mock_connect):
+        mock_connect.side_effect = lambda **kwargs: MagicMock(open=True)
+        pool = ConnectionPool(max_size=1, timeout=2)
+        first = pool.acquire()
+
+        timer = threading.Timer(0.05, pool.release, args=(first,))
+        timer.start()
+        second = pool.acquire()
+        timer.join()
+
+        self.assertIs(first, second)
+        stats = pool.stats()
+        self.assertEqual(stats['waits'], 1)
+        self.assertGreater(stats['wait_time'], 0)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,216 @@
+import os
+import time
+import datetime
+import tempfile
+import unittest
+from unittest.mock import MagicMock, patch
+from file_ledger import FileLedger, fingerprint
+from databroker import Debouncer, IngestBatcher, IngestWorkerPool, find_backlog
+
+
+class TestFileLedger(unittest.TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.ledger = FileLedger(os.path.join(self.temp_dir.name, 'ledger.db'))
+        self.file_path = os.path.join(self.temp_dir.name, '2023-10-03-19-58-16-A1UG021109838.txt')
+        with open(self.file_path, 'wb') as f:
+            f.write(b"[Serial Number], A1UG021109838\n[Total Counter],00185186\n")
+
+    def tearDown(self):
+        self.ledger.close()
+        self.temp_dir.cleanup()
+
+    def file_fingerprint(self):
+        with open(self.file_path, 'rb') as f:
+            return fingerprint(self.file_path, f.read())
+
+    def test_file_is_claimed_once(self):
+        self.assertTrue(self.ledger.claim(self.file_path, self.file_fingerprint()))
+        self.assertFalse(self.ledger.claim(self.file_path, self.file_fingerprint()))
+
+        self.ledger.mark_processed([(self.file_path, self.file_fingerprint())])
+        self.assertFalse(self.ledger.claim(self.file_path, self.file_fingerprint()))
+        self.assertEqual(self.ledger.processed_paths(), {self.file_path})
+
+    def test_released_file_can_be_claimed_again(self):
+        self.assertTrue(self.ledger.claim(self.file_path, self.file_fingerprint()))
+        self.ledger.release([self.file_path])
+        self.assertTrue(self.ledger.claim(self.file_path, self.file_fingerprint()))
+
+    def test_changed_content_is_processed_again(self):
+        self.ledger.mark_processed([(self.file_path, self.file_fingerprint())])
+        with open(self.file_path, 'ab') as f:
+            f.write(b"[Total Color Counter],00000001\n")
+        self.assertTrue(self.ledger.claim(self.file_path, self.file_fingerprint()))
+
+    def test_failed_batch_releases_its_files(self):
+        mock_db = MagicMock()
+        mock_db.commit.side_effect = Exception("deadlock")
+        batcher = IngestBatcher(mock_db, ledger=self.ledger)
+        self.ledger.claim(self.file_path, self.file_fingerprint())
+        batcher.add([], source=(self.file_path, self.file_fingerprint()))
+        batcher.flush()
+
+        self.assertEqual(self.ledger.processed_paths(), set())
+        self.assertTrue(self.ledger.claim(self.file_path, self.file_fingerprint()))
+
+    @patch('databroker.MAX_RETRY_DELAY', 8)
+    @patch('databroker.RETRY_DELAY', 2)
+    def test_failed_batch_is_retried_with_backoff(self):
+        mock_db = MagicMock()
+        mock_db.commit.side_effect = Exception("deadlock")
+        pool = IngestWorkerPool(workers=0, ledger=self.ledger)
+        delays = []
+        for _ in range(4):
+            batcher = IngestBatcher(mock_db, ledger=self.ledger)
+            pool.ingest(batcher, self.file_path, force=True)
+            batcher.flush()
+            self.assertEqual(pool._due_retries(), [])
+            due, file_path, force = pool.retries[0]
+            delays.append(round(due - time.monotonic()))
+            with patch('databroker.time.monotonic', return_value=due):
+                self.assertEqual(pool._due_retries(), [(self.file_path, True)])
+        self.assertEqual(delays, [2, 4, 8, 8])
+
+        mock_db.commit.side_effect = None
+        batcher = IngestBatcher(mock_db, ledger=self.ledger)
+        pool.ingest(batcher, self.file_path)
+        batcher.flush()
+        self.assertEqual(pool.retries, [])
+        self.assertEqual(pool.attempts, {})
+
+
+class TestFindBacklog(unittest.TestCase):
+    def test_unprocessed_files_oldest_first(self):
+        with tempfile.TemporaryDirectory() as temp_dir:
+            ledger = FileLedger(os.path.join(temp_dir, 'ledger.db'))
+            paths = []
+            for i, name in enumerate(['2023-10-03-10-00-00-A.txt', '2023-11-02-10-00-00-B.txt', '2023-11-05-10-00-00-C.txt']):
+                path = os.path.join(temp_dir, name)
+                with open(path, 'wb') as f:
+                    f.write(name.encode())
+                os.utime(path, (1000 + i, 1000 + i))
+                paths.append(path)
+            with open(paths[1], 'rb') as f:
+                ledger.mark_processed([(paths[1], fingerprint(paths[1], f.read()))])
+
+            self.assertEqual(find_backlog(temp_dir, ledger), [(paths[0], False), (paths[2], False)])
+            self.assertEqual(find_backlog(temp_dir, ledger, since=datetime.date(2023, 11, 1)),
+                             [(paths[0], False), (paths[1], True), (paths[2], True)])
+            ledger.close()
+
+
+class FakeDatabase:
+    # print_history and service_requests in memory, answering the queries write_records makes.
+    def __init__(self):
+        self.printer = {'id': 1, 'serial_number': 'A1UG021109838', 'service_contract': True, 'tax_id': '1234412444', 'model': 'C224'}
+        self.history = []
+        self.requests = []
+        self.result = []
+
+    def cursor(self):
+        return self
+
+    def execute(self, sql, params=()):
+        if sql.startswith("SELECT id, serial_number"):
+            self.result = [self.printer]
+        elif sql.startswith("SELECT printers_id, date"):
+            self.result = [{'printers_id': printer_id, 'date': date, 'counter_black_history': black, 'counter_color_history': color}
+                           for printer_id, date, black, color in self.history if date >= params[-1]]
+        elif sql.startswith("SELECT id, times_happend FROM service_requests"):
+            self.result = [request for request in self.requests if (request['printer_id'], request['error'], request['day']) == params]
+        elif sql.startswith("UPDATE service_requests"):
+            next(request for request in self.requests if request['id'] == params[1])['times'] += params[0]
+        elif sql.startswith("INSERT INTO service_requests"):
+            day = params[4] if len(params) > 4 else datetime.date(2023, 10, 3)
+            self.requests.append({'id': len(self.requests) + 1, 'printer_id': params[0], 'error': params[2], 'day': day,
+                                  'times': params[3] if len(params) > 3 else 1})
+
+    def executemany(self, sql, rows):
+        self.history.extend((printer_id, date, int(black), int(color)) for printer_id, date, black, color in rows)
+
+    def fetchone(self):
+        return self.result[0] if self.result else None
+
+    def fetchall(self):
+        return self.result
+
+    def commit(self):
+        pass
+
+    def close(self):
+        pass
+
+
+class TestReplay(unittest.TestCase):
+    @patch('databroker.usage_rollup.apply_readings')
+    def test_replaying_a_period_is_idempotent(self, apply_readings):
+        with tempfile.TemporaryDirectory() as temp_dir:
+            paths = []
+            for name, text in [('2023-10-03-08-00-00-A1UG021109838.txt',
+                                "[Serial Number], A1UG021109838\n[Total Color Counter],00000100\n[Total Black Counter],00001000\n"),
+                               ('2023-10-03-09-00-00-A1UG021109838.txt',
+                                "Occurred Time :03/10/2023 09:00:00\nInstalled Place :A1UG021109838\nError : Misfeed detected. 66-33\n")]:
+                paths.append(os.path.join(temp_dir, name))
+                with open(paths[-1], 'w') as f:
+                    f.write(text)
+            database = FakeDatabase()
+            ledger = FileLedger(os.path.join(temp_dir, 'ledger.db'))
+            pool = IngestWorkerPool(workers=0, ledger=ledger)
+
+            def ingest(force):
+                batcher = IngestBatcher(database, ledger=ledger)
+                for path in paths:
+                    pool.ingest(batcher, path, force)
+                batcher.flush()
+
+            ingest(False)
+            ingest(True)
+            ingest(True)
+            self.assertEqual(database.history, [(1, datetime.date(2023, 10, 3), 1000, 100)])
+            self.assertEqual([(request['error'], request['times']) for request in database.requests], [('Misfeed detected. 66-33', 1)])
+            self.assertEqual(apply_readings.call_count, 1)
+
+            # Rows lost in the outage are restored, once.
+            database.history, database.requests = [], []
+            ingest(True)
+            ingest(True)
+            self.assertEqual(database.history, [(1, datetime.date(2023, 10, 3), 1000, 100)])
+            self.assertEqual([(request['day'], request['times']) for request in database.requests], [(datetime.date(2023, 10, 3), 1)])
+            self.assertEqual(apply_readings.call_count, 2)
+            ledger.close()
+
+    @patch('databroker.usage_rollup.apply_readings')
+    def test_unanswered_pipeline_report_is_ingested_as_a_replay(self, apply_readings):
+        # The pipeline committed the reading, then its ack timed out and the
+        # mail parser spooled the report as well.
+        with tempfile.TemporaryDirectory() as temp_dir:
+            path = os.path.join(temp_dir, '2023-10-03-08-00-00-A1UG021109838.replay.txt')
+            with open(path, 'w') as f:
+                f.write("[Serial Number], A1UG021109838\n[Total Color Counter],00000100\n[Total Black Counter],00001000\n")
+            database = FakeDatabase()
+            database.history = [(1, datetime.date(2023, 10, 3), 1000, 100)]
+            batcher = IngestBatcher(database)
+            IngestWorkerPool(workers=0).ingest(batcher, path)
+            batcher.flush()
+            self.assertEqual(database.history, [(1, datetime.date(2023, 10, 3), 1000, 100)])
+            apply_readings.assert_not_called()
+
+
+class TestDebouncer(unittest.TestCase):
+    def test_burst_of_events_is_coalesced(self):
+        emitted = []
+        debouncer = Debouncer(emitted.append, window=0.1)
+        debouncer.start()
+        for _ in range(5):
+            debouncer.touch('temp/a.txt')
+            debouncer.touch('temp/b.txt')
+        time.sleep(0.3)
+        debouncer.touch('temp/c.txt')
+        debouncer.stop()
+
+        self.assertEqual(sorted(emitted), ['temp/a.txt', 'temp/b.txt', 'temp/c.txt'])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,120 @@
+import os
+import datetime
+import tempfile
+import unittest
+from unittest.mock import patch, MagicMock
+from databroker import parse_file
+from benchmarks.fleet_generator import populate, write_reports
+from benchmarks.e2e_benchmark import compare, query_count, summarize, undo_ingest
+
+
+class FakeCursor:
+    def __init__(self, tables):
+        self.tables = tables
+        self.result = []
+        self.lastrowid = 1
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        pass
+
+    def execute(self, sql, params=()):
+        if sql.startswith("SELECT COUNT(*)"):
+            self.result = [{'count': 0}]
+        elif sql.startswith("SELECT id, serial_number FROM printers"):
+            self.result = [{'id': number, 'serial_number': row[0]} for number, row in enumerate(self.tables['printers'], 1)]
+        else:
+            self.result = []
+
+    def executemany(self, sql, rows):
+        self.tables.setdefault(sql.split()[2], []).extend(rows)
+
+    def fetchone(self):
+        return self.result[0] if self.result else None
+
+    def fetchall(self):
+        return self.result
+
+
+class FakeConnection:
+    def __init__(self):
+        self.tables = {}
+
+    def cursor(self):
+        return FakeCursor(self.tables)
+
+    def commit(self):
+        pass
+
+
+class TestFleetGenerator(unittest.TestCase):
+    @patch('benchmarks.fleet_generator.usage_rollup.rebuild', return_value=0)
+    def test_populate(self, rebuild):
+        connection = FakeConnection()
+        counts = populate(connection, clients=5, printers=20, years=1, interval=30, service_requests=15,
+                          today=datetime.date(2023, 10, 1))
+        tables = connection.tables
+        self.assertEqual((counts['clients'], counts['printers'], counts['service_requests']), (5, 20, 15))
+        self.assertEqual(counts['print_history'], len(tables['print_history']))
+        self.assertEqual(len({row[0] for row in tables['printers']}), 20)
+        tax_ids = {row[0] for row in tables['clients']}
+        self.assertTrue({row[4] for row in tables['printers']} <= tax_ids)
+
+        # Each printer's readings start a year back and only drop on a counter reset.
+        history = [row for row in tables['print_history'] if row[0] == 1]
+        self.assertTrue(datetime.date(2022, 10, 1) <= history[0][1] < history[-1][1] <= datetime.date(2023, 10, 1))
+        self.assertEqual([row[2] for row in history], sorted(row[2] for row in history))
+        last = history[-1]
+        self.assertIn((1, last[2], last[3]), tables['printer_counters'])
+        rebuild.assert_called_once()
+
+    def test_report_files_ingest_like_real_ones(self):
+        fleet = [{'serial_number': 'A4FM000000001', 'model': 'C224', 'color': True, 'black_counter': 1000, 'color_counter': 200},
+                 {'serial_number': 'A1UG000000002', 'model': '4050i', 'color': False, 'black_counter': 5000, 'color_counter': 0}]
+        with tempfile.TemporaryDirectory() as directory:
+            paths = write_reports(directory, fleet, 50, sent_at=datetime.datetime(2023, 10, 3, 19, 58, 16))
+            self.assertEqual(len(set(paths)), 50)
+            records = [record for path in paths for record in parse_file(path)]
+        self.assertEqual(len(records), 50)
+        self.assertEqual({record['serial_number'] for record in records}, {'A4FM000000001', 'A1UG000000002'})
+        self.assertEqual({record['date'] for record in records}, {datetime.date(2023, 10, 3)})
+        counters = [record for record in records if record['type'] == 'counter']
+        self.assertTrue(counters and all(record['counter_color'] == '0' for record in counters
+                                         if record['serial_number'] == 'A1UG000000002'))
+        self.assertTrue(any(record['type'] == 'error' for record in records))
+
+    def test_results_and_compare(self):
+        self.assertEqual(query_count('db;dur=4.1;desc="3 queries", render;dur=2.0, total;dur=7.0'), 3)
+        self.assertEqual(query_count(None), 0)
+        summary = summarize([0.01] * 99 + [0.5], [3] * 100, 2.0)
+        self.assertEqual((summary['p50_ms'], summary['p99_ms'], summary['requests_per_second']), (10.0, 500.0, 50.0))
+
+        baseline = {'routes': {'/printers': {'p50_ms': 10.0, 'p95_ms': 20.0, 'queries_per_request': 3}},
+                    'ingest': {'records_per_second': 1000}}
+        results = {'routes': {'/printers': {'p50_ms': 11.0, 'p95_ms': 30.0, 'queries_per_request': 5}},
+                   'ingest': {'records_per_second': 700}}
+        self.assertEqual(compare(baseline, results), ['/printers p95_ms: 20.0 -> 30.0', '/printers queries_per_request: 3 -> 5',
+                                                      'ingest records_per_second: 1000 -> 700'])
+        self.assertEqual(compare(baseline, baseline), [])
+
+    @patch('benchmarks.e2e_benchmark.usage_rollup.rebuild')
+    def test_undo_ingest(self, rebuild):
+        connection = MagicMock()
+        cursor = connection.cursor.return_value.__enter__.return_value
+        cursor.fetchall.side_effect = [[{'printers_id': 2}, {'printers_id': 1}],
+                                       [{'id': 7, 'times_happend': 3}, {'id': 8, 'times_happend': 1}]]
+
+        self.assertEqual(undo_ingest(connection, (100, 50, {7: 1, 8: 1})), 2)
+
+        executed = [call.args for call in cursor.execute.call_args_list]
+        self.assertIn(("DELETE FROM print_history WHERE id > %s", (100,)), executed)
+        self.assertIn(("DELETE FROM service_requests WHERE id > %s", (50,)), executed)
+        cursor.executemany.assert_called_once_with("UPDATE service_requests SET times_happend = %s WHERE id = %s", [(1, 7)])
+        rebuild.assert_called_once_with(cursor, [2, 1])
+        connection.commit.assert_called_once()
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,125 @@
+import io
+import os
+import json
+import datetime
+import tempfile
+import unittest
+from decimal import Decimal
+from unittest.mock import MagicMock
+from fleet_import import import_fleet, read_rows
+from model_resolver import ModelResolver
+
+CSV = b"""\xef\xbb\xbfSerial Number,Model,Counter Black,Counter Color,Price Black,Price Color,Company,Tax ID,Service Contract
+A4FM021007478,,1000,200,"0,05",0.25,Client & Co,,yes
+AA2K021000001,bizhub,,,,,,123,
+A4FM021007478,,1,1,,,,,
+SHORT,,,,,,,,
+AA2K021000002,,-5,,,,,,
+AA2K021000003,,,,,,Nobody Inc,,
+AA2K021000004,,,,,,,999,
+A1UG021109838,,,,,,,,
+
+AA2K021000005,,,,,,,,x
+"""
+
+
+class FakeCursor:
+    # Answers the importer's IN lookups from in-memory tables.
+    def __init__(self, printers, clients):
+        self.printers = printers
+        self.clients = clients
+        self.rows = []
+        self.executemany = MagicMock(side_effect=self._insert)
+        self.connection = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        pass
+
+    def execute(self, sql, params=()):
+        params = set(params)
+        if sql.startswith("SELECT serial_number FROM printers") or sql.startswith("SELECT id, serial_number FROM printers"):
+            self.rows = [printer for printer in self.printers if printer['serial_number'] in params]
+        elif sql.startswith("SELECT tax_id, company FROM clients"):
+            self.rows = [client for client in self.clients if client['company'] in params]
+        elif sql.startswith("SELECT tax_id FROM clients"):
+            self.rows = [client for client in self.clients if client['tax_id'] in params]
+        else:
+            # The usage rollup's state query: no rollup rows yet.
+            self.rows = [{'id': printer_id, 'price_black': None, 'price_color': None, 'last_date': None,
+                          'last_counter_black': None, 'last_counter_color': None} for printer_id in params]
+
+    def _insert(self, sql, rows):
+        if sql.startswith("INSERT INTO printers"):
+            for row in rows:
+                self.printers.append({'id': len(self.printers) + 1, 'serial_number': row[0]})
+
+    def fetchall(self):
+        return self.rows
+
+
+class TestFleetImport(unittest.TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        path = os.path.join(self.temp_dir.name, 'printer_models.json')
+        with open(path, 'w') as f:
+            json.dump({"C224": ["A4FM"], "C300i": ["AA2K"]}, f)
+        self.resolver = ModelResolver(path)
+        self.cursor = FakeCursor([{'id': 1, 'serial_number': 'A1UG021109838'}],
+                                 [{'tax_id': '123', 'company': 'Client & Co'}])
+        self.connection = MagicMock()
+        self.connection.cursor.return_value = self.cursor
+
+    def tearDown(self):
+        self.temp_dir.cleanup()
+
+    def test_valid_rows_are_inserted_in_one_transaction(self):
+        report = import_fleet(self.connection, read_rows(io.BytesIO(CSV), 'fleet.csv'), self.resolver)
+
+        self.assertEqual(report['rows'], 9)
+        self.assertEqual(report['imported'], 3)
+        self.assertEqual([(line, error) for line, serial_number, error in report['errors']], [
+            (4, "serial_number repeats line 2"),
+            (5, "serial_number is missing or shorter than 9 characters"),
+            (6, "counter_black is negative"),
+            (7, "no client with company name Nobody Inc"),
+            (8, "no client with tax_id 999"),
+            (9, "a printer with this serial number is already in the database"),
+        ])
+        printers = self.cursor.executemany.call_args_list[0].args[1]
+        self.assertEqual(printers[0], ('A4FM021007478', 1000, 200, 'C224', Decimal('0.05'), Decimal('0.25'), None, None, '123', 1, 1))
+        self.assertEqual(printers[1][3:], ('C300i', None, None, None, None, '123', 1, 0))
+        self.assertEqual(printers[2][-3:], (None, 0, 1))
+        history = self.cursor.executemany.call_args_list[1].args[1]
+        self.assertEqual([(printer_id, black, color) for printer_id, date, black, color in history], [(2, 1000, 200), (3, 0, 0), (4, 0, 0)])
+        self.assertEqual(history[0][1], datetime.date.today())
+        self.connection.commit.assert_called_once()
+
+    def test_dry_run_inserts_nothing(self):
+        report = import_fleet(self.connection, read_rows(io.BytesIO(CSV), 'fleet.csv'), self.resolver, dry_run=True)
+        self.assertEqual((report['valid'], report['imported'], len(report['errors'])), (3, 0, 6))
+        self.cursor.executemany.assert_not_called()
+        self.connection.commit.assert_not_called()
+
+    def test_xlsx(self):
+        from openpyxl import Workbook
+        workbook = Workbook()
+        sheet = workbook.active
+        sheet.append(['serial_number', 'counter_black', 'contract_start_date', 'tax_id'])
+        sheet.append(['A4FM021007478', 1500, datetime.datetime(2023, 10, 1), 123])
+        sheet.append([None, None, None, None])
+        sheet.append(['AA2K021000001', 'many', None, None])
+        stream = io.BytesIO()
+        workbook.save(stream)
+        stream.seek(0)
+
+        report = import_fleet(self.connection, read_rows(stream, 'fleet.XLSX'), self.resolver)
+        self.assertEqual(report['errors'], [(4, 'AA2K021000001', 'counter_black is not a number')])
+        printer = self.cursor.executemany.call_args_list[0].args[1][0]
+        self.assertEqual((printer[1], printer[7], printer[8]), (1500, datetime.date(2023, 10, 1), '123'))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,89 @@
+import os
+import datetime
+import unittest
+from unittest.mock import MagicMock
+from dotenv import load_dotenv
+from migrate import connect, run_migrations, split_statements, list_migrations
+
+load_dotenv()
+
+
+class TestMigrationScripts(unittest.TestCase):
+    def test_split_statements_skips_comments(self):
+        sql = "-- comment\nCREATE INDEX a ON t (x);\n\nALTER TABLE t\n    ADD COLUMN y INT;\n"
+        self.assertEqual(split_statements(sql), ["CREATE INDEX a ON t (x)", "ALTER TABLE t\n    ADD COLUMN y INT"])
+
+    def test_migrations_are_ordered_and_unique(self):
+        versions = [version for version, _ in list_migrations()]
+        self.assertEqual(versions, sorted(set(versions)))
+        self.assertEqual(versions[0], '0001')
+
+    def test_duplicate_serial_numbers_stop_the_unique_index(self):
+        cursor = MagicMock()
+        connection = MagicMock()
+        connection.cursor.return_value.__enter__.return_value = cursor
+        cursor.fetchone.return_value = {'locked': 1}
+        cursor.fetchall.side_effect = [
+            [{'version': '0001'}, {'version': '0002'}],
+            [{'serial_number': 'A1UG021109838', 'ids': '4, 17'}, {'serial_number': 'A4FM021007478', 'ids': '5, 6, 9'}],
+        ]
+
+        with self.assertRaises(RuntimeError) as raised:
+            run_migrations(connection)
+        message = str(raised.exception)
+        self.assertIn("0003_hot_lookup_indexes.sql: printers has 2 duplicate serial numbers", message)
+        self.assertIn("A1UG021109838 (printer ids 4, 17); A4FM021007478 (printer ids 5, 6, 9)", message)
+        statements = [call.args[0] for call in cursor.execute.call_args_list]
+        self.assertFalse(any('CREATE UNIQUE INDEX' in statement for statement in statements))
+        self.assertEqual(statements[-1], "SELECT RELEASE_LOCK('schema_migrations')")
+        connection.commit.assert_not_called()
+
+
+@unittest.skipUnless(os.getenv('MYSQL_DB_HOST'), "needs a MySQL server (MYSQL_DB_HOST)")
+class TestHotLookupIndexes(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.connection = connect(retries=1)
+        run_migrations(cls.connection)
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.connection.close()
+
+    def setUp(self):
+        self.cursor = self.connection.cursor()
+        self.cursor.execute("INSERT INTO clients (tax_id, company, city, postal_code, address, phone, email) VALUES ('IDX-TEST', 'Index test', 'c', 'p', 'a', '1', 'e')")
+        for i in range(50):
+            self.cursor.execute("INSERT INTO printers (serial_number, black_counter, color_counter, tax_id) VALUES (%s, 0, 0, 'IDX-TEST')", (f'IDXTEST{i:04d}',))
+            printer_id = self.cursor.lastrowid
+            for day in range(1, 11):
+                self.cursor.execute("INSERT INTO print_history (printers_id, date, counter_black_history, counter_color_history) VALUES (%s, %s, %s, 0)",
+                                    (printer_id, datetime.date(2023, 1, day), day * 100))
+            self.cursor.execute("INSERT INTO service_requests (printer_id, tax_id, service_request) VALUES (%s, 'IDX-TEST', 'Misfeed detected. 66-33')", (printer_id,))
+        self.printer_id = printer_id
+
+    def tearDown(self):
+        self.connection.rollback()
+        self.cursor.close()
+
+    def explain(self, sql, params):
+        self.cursor.execute("EXPLAIN " + sql, params)
+        return self.cursor.fetchall()[0]
+
+    def test_printer_lookup_by_serial_uses_unique_index(self):
+        plan = self.explain("SELECT id, service_contract, tax_id FROM printers WHERE serial_number = %s", ('IDXTEST0007',))
+        self.assertEqual(plan['key'], 'uq_printers_serial_number')
+
+    def test_latest_reading_uses_printer_date_index(self):
+        plan = self.explain("SELECT counter_black_history FROM print_history WHERE printers_id = %s ORDER BY date DESC LIMIT 1", (self.printer_id,))
+        self.assertEqual(plan['key'], 'idx_print_history_printer_date')
+        self.assertNotIn('filesort', plan['Extra'] or '')
+
+    def test_duplicate_error_check_uses_request_day_index(self):
+        plan = self.explain("SELECT id, times_happend FROM service_requests WHERE printer_id = %s AND service_request = %s AND request_day = %s",
+                            (self.printer_id, 'Misfeed detected. 66-33', datetime.date.today()))
+        self.assertEqual(plan['key'], 'idx_service_requests_duplicate')
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,64 @@
+import unittest
+from unittest.mock import patch
+from flask import Flask, render_template_string
+import instrumentation
+from instrumentation import TimedCursorMixin, normalize_sql, timed
+
+
+class FakeCursor:
+    def execute(self, query, args=None):
+        return 1
+
+
+class TimedFakeCursor(TimedCursorMixin, FakeCursor):
+    pass
+
+
+class TestInstrumentation(unittest.TestCase):
+    def setUp(self):
+        self.app = Flask(__name__)
+        instrumentation.init_app(self.app)
+
+        @self.app.route('/report/<int:report_id>')
+        def report(report_id):
+            cursor = TimedFakeCursor()
+            cursor.execute("SELECT * FROM service_requests WHERE id = %s", (report_id,))
+            cursor.execute("SELECT * FROM users")
+            with timed('pdf'):
+                pass
+            return render_template_string("{% for i in range(3) %}{{ i }}{% endfor %}")
+
+    def test_server_timing_and_log_line(self):
+        with self.assertLogs(level='INFO') as logs:
+            response = self.app.test_client().get('/report/7')
+        self.assertEqual(response.data, b'012')
+
+        phases = dict(part.split(';', 1) for part in response.headers['Server-Timing'].split(', '))
+        self.assertEqual(set(phases), {'db', 'pdf', 'render', 'total'})
+        self.assertIn('desc="2 queries"', phases['db'])
+        line = [message for message in logs.output if 'request method=GET' in message][0]
+        self.assertIn('path=/report/7 endpoint=report status=200', line)
+        self.assertIn('db_queries=2', line)
+        self.assertIn('render_ms=', line)
+        self.assertIsNone(instrumentation.current())
+
+    def test_queries_outside_requests_are_not_counted(self):
+        self.assertEqual(TimedFakeCursor().execute("SELECT 1"), 1)
+        self.assertIsNone(instrumentation.current())
+
+    @patch('instrumentation.SLOW_QUERY_MS', 0.000001)
+    def test_slow_query_log(self):
+        with self.assertLogs(level='WARNING') as logs:
+            self.app.test_client().get('/report/7')
+        self.assertIn("endpoint=report: SELECT * FROM service_requests WHERE id = ?", logs.output[0])
+
+    def test_normalize_sql(self):
+        self.assertEqual(normalize_sql("""SELECT id FROM printers
+            WHERE serial_number IN (%s, %s, %s) AND model = 'C224' AND id > 10 LIMIT %s"""),
+                         "SELECT id FROM printers WHERE serial_number IN (...) AND model = ? AND id > ? LIMIT ?")
+        self.assertEqual(normalize_sql("SELECT h2.id FROM print_history h2 WHERE h2.printers_id IN (%s)"),
+                         "SELECT h2.id FROM print_history h2 WHERE h2.printers_id IN (...)")
+
+
+if __name__ == "__main__":
+    unittest.main()
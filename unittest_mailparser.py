@@ -0,0 +1,179 @@
+import os
+import socket
+import datetime
+import tempfile
+import unittest
+from unittest.mock import MagicMock, patch
+from concurrent.futures import ThreadPoolExecutor
+from mailparser import fetch_new_messages, poll_mailbox, CycleStats, Mailbox, run_mailbox, RETRY_DELAY
+from fake_mail_server import FakePOP3Server, make_report_message
+from message_ledger import MessageLedger
+from ingest_pipeline import PipelineClient
+
+PLAIN_HEADERS = [b"Message-ID: <3@printer>", b"Date: Tue, 03 Oct 2023 19:58:16 +0000", b"Content-Type: text/plain"]
+PLAIN_MAIL = PLAIN_HEADERS + [b"", b"[Serial Number], A1UG021109838", b"[Total Counter],00185186"]
+MULTIPART_HEADERS = [b"Message-ID: <2@printer>", b"Content-Type: multipart/mixed; boundary=x"]
+
+
+class TestFetchNewMessages(unittest.TestCase):
+    def setUp(self):
+        self.cwd = os.getcwd()
+        self.temp_dir = tempfile.TemporaryDirectory()
+        os.chdir(self.temp_dir.name)
+        os.mkdir('temp')
+
+    def tearDown(self):
+        os.chdir(self.cwd)
+        self.temp_dir.cleanup()
+
+    def test_only_new_plain_messages_are_downloaded(self):
+        mail = MagicMock()
+        mail.uidl.return_value = (b"+OK", [b"1 uid-1", b"2 uid-2", b"3 uid-3", b"4 uid-4"], 0)
+        mail.list.return_value = (b"+OK", [b"1 300", b"2 400", b"3 300", b"4 900000"], 0)
+        mail.top.side_effect = lambda number, lines: (b"+OK", {2: MULTIPART_HEADERS, 3: PLAIN_HEADERS}[number], 0)
+        mail.retr.return_value = (b"+OK", PLAIN_MAIL, 0)
+        seen_uids = {"uid-1", "uid-gone"}
+        stats = CycleStats()
+        ledger = MessageLedger(':memory:')
+
+        fetch_new_messages(mail, seen_uids, ledger, stats)
+
+        mail.retr.assert_called_once_with(3)
+        self.assertEqual([call.args[0] for call in mail.top.call_args_list], [2, 3])
+        self.assertEqual(seen_uids, {"uid-1", "uid-2", "uid-3", "uid-4"})
+        self.assertEqual(os.listdir('temp'), ['2023-10-03-19-58-16-A1UG021109838.txt'])
+        self.assertEqual((stats.new_messages, stats.fetched, stats.screened_out), (3, 1, 2))
+        self.assertGreater(stats.bytes_downloaded, 0)
+        self.assertIn("<3@printer>", ledger)
+
+    def test_message_in_ledger_is_not_downloaded(self):
+        mail = MagicMock()
+        mail.uidl.return_value = (b"+OK", [b"1 uid-1"], 0)
+        mail.list.return_value = (b"+OK", [b"1 300"], 0)
+        mail.top.return_value = (b"+OK", PLAIN_HEADERS, 0)
+        ledger = MessageLedger(':memory:')
+        ledger.add("<3@printer>")
+
+        fetch_new_messages(mail, set(), ledger, CycleStats())
+
+        mail.retr.assert_not_called()
+
+    def test_ledger_waits_for_the_pipeline(self):
+        mail = MagicMock()
+        mail.uidl.return_value = (b"+OK", [b"1 uid-1"], 0)
+        mail.list.return_value = (b"+OK", [b"1 300"], 0)
+        mail.top.return_value = (b"+OK", PLAIN_HEADERS, 0)
+        mail.retr.return_value = (b"+OK", PLAIN_MAIL, 0)
+        ledger = MessageLedger(':memory:')
+        spooled = []
+        pipeline = PipelineClient(lambda file_name, content: spooled.append(file_name),
+                                  path=os.path.join(self.temp_dir.name, 'missing.sock'))
+
+        fetch_new_messages(mail, set(), ledger, CycleStats(), pipeline)
+        # Sent but neither acked nor spooled yet: a crash now must not lose it.
+        self.assertNotIn("<3@printer>", ledger)
+
+        pipeline.flush()
+        self.assertEqual(spooled, ['2023-10-03-19-58-16-A1UG021109838.txt'])
+        self.assertIn("<3@printer>", ledger)
+
+    @patch('mailparser.INGEST_PIPELINE', True)
+    def test_cycle_failing_partway_keeps_what_was_fetched(self):
+        second = [header.replace(b"<3@", b"<4@") for header in PLAIN_HEADERS]
+        mail = MagicMock()
+        mail.stat.return_value = (2, 600)
+        mail.uidl.return_value = (b"+OK", [b"1 uid-1", b"2 uid-2"], 0)
+        mail.list.return_value = (b"+OK", [b"1 300", b"2 300"], 0)
+        mail.top.side_effect = lambda number, lines: (b"+OK", {1: PLAIN_HEADERS, 2: second}[number], 0)
+        mail.retr.side_effect = [(b"+OK", PLAIN_MAIL, 0), OSError("connection reset")]
+        mailbox = Mailbox('north', None, None, None)
+        mailbox.connect = lambda: mail
+        ledger = MessageLedger(':memory:')
+
+        # No databroker socket, so the pipeline spools to files.
+        with self.assertRaises(OSError):
+            poll_mailbox(mailbox, ledger)
+
+        self.assertEqual(os.listdir('temp'), ['2023-10-03-19-58-16-A1UG021109838.txt'])
+        self.assertIn("<3@printer>", ledger)
+        self.assertEqual(mailbox.seen_uids, {"uid-1"})
+
+        # The next cycle fetches only the message that failed.
+        mail.retr.side_effect = None
+        mail.retr.return_value = (b"+OK", PLAIN_MAIL, 0)
+        mail.retr.reset_mock()
+        poll_mailbox(mailbox, ledger)
+        mail.retr.assert_called_once_with(2)
+        self.assertEqual(mailbox.seen_uids, {"uid-1", "uid-2"})
+
+
+class TestMailboxes(unittest.TestCase):
+    def setUp(self):
+        self.cwd = os.getcwd()
+        self.temp_dir = tempfile.TemporaryDirectory()
+        os.chdir(self.temp_dir.name)
+        os.mkdir('temp')
+
+    def tearDown(self):
+        os.chdir(self.cwd)
+        self.temp_dir.cleanup()
+
+    def test_mailboxes_are_fetched_concurrently(self):
+        sent_at = datetime.datetime(2023, 10, 3, 19, 58, 16, tzinfo=datetime.timezone.utc)
+        north = [make_report_message(number, f"NORTH{number:04d}", sent_at) for number in range(1, 4)]
+        south = [make_report_message(number, f"SOUTH{number:04d}", sent_at) for number in range(1, 3)]
+        ledger = MessageLedger(':memory:')
+        with FakePOP3Server(north, password='secret') as north_server, FakePOP3Server(south) as south_server:
+            mailboxes = [Mailbox('north', '127.0.0.1', 'user', 'secret', port=north_server.port, ssl=False),
+                         Mailbox('south', '127.0.0.1', 'user', 'secret', port=south_server.port, ssl=False)]
+            with ThreadPoolExecutor(max_workers=2) as executor:
+                results = list(executor.map(lambda mailbox: run_mailbox(mailbox, ledger), mailboxes))
+
+        self.assertEqual([stats.fetched for stats in results], [3, 2])
+        self.assertEqual([mailbox.failures for mailbox in mailboxes], [0, 0])
+        self.assertEqual(len([name for name in os.listdir('temp') if name.endswith('.txt') and 'seen_uids' not in name]), 5)
+        self.assertEqual(len(Mailbox('north', None, None, None).seen_uids), 3)
+        self.assertEqual(len(Mailbox('south', None, None, None).seen_uids), 2)
+
+    def test_failing_mailbox_backs_off(self):
+        with socket.socket() as unused:
+            unused.bind(('127.0.0.1', 0))
+            port = unused.getsockname()[1]
+        mailbox = Mailbox('down', '127.0.0.1', 'user', 'secret', port=port, ssl=False)
+
+        run_mailbox(mailbox, MessageLedger(':memory:'))
+        first_delay = mailbox.retry_delay()
+        run_mailbox(mailbox, MessageLedger(':memory:'))
+
+        self.assertEqual(mailbox.failures, 2)
+        self.assertEqual((first_delay, mailbox.retry_delay()), (RETRY_DELAY, RETRY_DELAY * 2))
+
+
+class TestMessageLedger(unittest.TestCase):
+    def test_import_legacy_file(self):
+        with tempfile.TemporaryDirectory() as temp_dir:
+            legacy_file = os.path.join(temp_dir, 'saved_message_ids.txt')
+            with open(legacy_file, 'w') as f:
+                f.write("<1@printer> __ 2023-10-03-19-58-16\n<2@printer> __ None\n")
+            ledger = MessageLedger(os.path.join(temp_dir, 'message_ids.db'))
+
+            self.assertEqual(ledger.import_text_file(legacy_file), 2)
+            self.assertIn("<1@printer>", ledger)
+            self.assertIn("<2@printer>", ledger)
+            self.assertNotIn("<1@printer> __ 2023-10-03-19-58-16", ledger)
+            self.assertFalse(os.path.exists(legacy_file))
+            ledger.close()
+
+    def test_compact_drops_old_ids(self):
+        ledger = MessageLedger(':memory:')
+        ledger.db.execute("INSERT INTO message_ids (message_id, sent_at, recorded_at) VALUES ('<old@printer>', NULL, 0)")
+        ledger.add("<new@printer>")
+
+        self.assertEqual(ledger.compact(365), 1)
+        self.assertNotIn("<old@printer>", ledger)
+        self.assertIn("<new@printer>", ledger)
+        self.assertEqual(len(ledger), 1)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,182 @@
+import os
+import sys
+import time
+import socket
+import imaplib
+import tempfile
+import threading
+import unittest
+from unittest.mock import MagicMock
+from message_ledger import MessageLedger
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), 'mailparser_example_scripts'))
+from mailparser_imap import idle, uid_set, search_new_uids, process_new_messages, load_high_water
+
+PLAIN_HEADERS = b"Message-ID: <3@printer>\r\nDate: Tue, 03 Oct 2023 19:58:16 +0000\r\nContent-Type: text/plain\r\n\r\n"
+PLAIN_MAIL = PLAIN_HEADERS + b"[Serial Number], A1UG021109838\r\n[Total Counter],00185186\r\n"
+
+
+def connected_imap():
+    # A real imaplib client on one end of a socket pair, without the greeting and login.
+    client, server = socket.socketpair()
+    mail = imaplib.IMAP4.__new__(imaplib.IMAP4)
+    mail.sock = client
+    mail.file = client.makefile('rb')
+    mail.debug = 0
+    mail.tagpre = b'A'
+    mail.tagnum = 0
+    mail.tagged_commands = {}
+    mail._encoding = 'ascii'
+    return mail, server
+
+
+def serve(server, after_idle):
+    # Answers one IDLE: the continuation, whatever after_idle sends, then the
+    # tagged OK once DONE arrives.
+    reader = server.makefile('rb')
+    tag = reader.readline().split()[0]
+    server.sendall(b'+ idling\r\n')
+    after_idle(server)
+    if reader.readline() == b'DONE\r\n':
+        server.sendall(tag + b' OK IDLE terminated\r\n* OK still talking\r\n')
+
+
+class TestIdle(unittest.TestCase):
+    def run_idle(self, after_idle, timeout):
+        mail, server = connected_imap()
+        thread = threading.Thread(target=serve, args=(server, after_idle))
+        thread.start()
+        started = time.monotonic()
+        try:
+            idle(mail, timeout)
+            return mail, time.monotonic() - started
+        finally:
+            thread.join()
+            server.close()
+
+    def test_quiet_period_ends_with_done_and_the_connection_stays_usable(self):
+        mail, elapsed = self.run_idle(lambda server: None, 0.2)
+        self.assertGreaterEqual(elapsed, 0.2)
+        self.assertEqual(mail.readline(), b'* OK still talking\r\n')
+        self.assertIsNone(mail.sock.gettimeout())
+
+    def test_new_mail_ends_idle_early(self):
+        mail, elapsed = self.run_idle(lambda server: server.sendall(b'* 4 EXISTS\r\n'), 5)
+        self.assertLess(elapsed, 2)
+        self.assertEqual(mail.readline(), b'* OK still talking\r\n')
+
+    def test_closed_connection_aborts(self):
+        mail, server = connected_imap()
+
+        def hang_up():
+            server.makefile('rb').readline()
+            server.sendall(b'+ idling\r\n')
+            server.shutdown(socket.SHUT_RDWR)
+
+        thread = threading.Thread(target=hang_up)
+        thread.start()
+        with self.assertRaises(imaplib.IMAP4.abort):
+            idle(mail, 5)
+        thread.join()
+        server.close()
+
+
+class TestUids(unittest.TestCase):
+    def test_uid_set(self):
+        self.assertEqual(uid_set([10, 1, 2, 3, 7, 9]), "1:3,7,9:10")
+        self.assertEqual(uid_set([5]), "5")
+
+    def test_search_new_uids(self):
+        mail = MagicMock()
+        mail.uid.return_value = ('OK', [b'7 5 6'])
+        self.assertEqual(search_new_uids(mail, 5), [6, 7])
+        mail.uid.assert_called_once_with('search', None, "UID 6:*")
+        # "n:*" still matches the newest message when nothing is newer than n - 1.
+        mail.uid.return_value = ('OK', [b'5'])
+        self.assertEqual(search_new_uids(mail, 5), [])
+
+
+class TestProcessNewMessages(unittest.TestCase):
+    def setUp(self):
+        self.cwd = os.getcwd()
+        self.temp_dir = tempfile.TemporaryDirectory()
+        os.chdir(self.temp_dir.name)
+        os.mkdir('temp')
+
+    def tearDown(self):
+        os.chdir(self.cwd)
+        self.temp_dir.cleanup()
+
+    def test_new_plain_messages_are_saved_once(self):
+        headers = {
+            11: (300, PLAIN_HEADERS),
+            12: (300, b"Message-ID: <2@printer>\r\nContent-Type: multipart/mixed; boundary=x\r\n\r\n"),
+            13: (900000, b"Message-ID: <4@printer>\r\nContent-Type: text/plain\r\n\r\n"),
+            14: (300, b"Message-ID: <1@printer>\r\nContent-Type: text/plain\r\n\r\n"),
+        }
+
+        def uid(command, *args):
+            if command == 'search':
+                return 'OK', [b'11 12 13 14']
+            if 'HEADER.FIELDS' in args[1]:
+                return 'OK', [(f"{n} (UID {n} RFC822.SIZE {headers[n][0]} BODY[HEADER.FIELDS] {{1}}".encode(), headers[n][1]) for n in headers] + [b')']
+            return 'OK', [(b"1 (UID 11 BODY[] {1}", PLAIN_MAIL), b')']
+
+        mail = MagicMock()
+        mail.uid.side_effect = uid
+        ledger = MessageLedger(':memory:')
+        ledger.add("<1@printer>")
+
+        self.assertEqual(process_new_messages(mail, '42', ledger), 4)
+
+        body_fetch = mail.uid.call_args_list[-1]
+        self.assertEqual(body_fetch.args[:2], ('fetch', '11'))
+        self.assertEqual(sorted(os.listdir('temp')), ['2023-10-03-19-58-16-A1UG021109838.txt', 'imap_last_uid.txt'])
+        self.assertIn("<3@printer>", ledger)
+        self.assertEqual(load_high_water(), ('42', 14))
+
+        # The next round starts after the high water mark.
+        mail.uid.side_effect = None
+        mail.uid.return_value = ('OK', [b'14'])
+        self.assertEqual(process_new_messages(mail, '42', ledger), 0)
+        mail.uid.assert_called_with('search', None, "UID 15:*")
+
+    def test_missing_body_keeps_the_high_water_below_it(self):
+        def plain(n):
+            return PLAIN_HEADERS.replace(b"<3@printer>", f"<{n}@printer>".encode())
+
+        def uid(command, *args):
+            if command == 'search':
+                return 'OK', [b'11 12 13']
+            if 'HEADER.FIELDS' in args[1]:
+                return 'OK', [(f"{n} (UID {n} RFC822.SIZE 300 BODY[HEADER.FIELDS] {{1}}".encode(), plain(n)) for n in (11, 12, 13)] + [b')']
+            # UID 12 was not returned, e.g. the server dropped it from the response.
+            return 'OK', [(f"{n} (UID {n} BODY[] {{1}}".encode(), plain(n) + PLAIN_MAIL[len(PLAIN_HEADERS):]) for n in (11, 13)] + [b')']
+
+        mail = MagicMock()
+        mail.uid.side_effect = uid
+        ledger = MessageLedger(':memory:')
+
+        process_new_messages(mail, '42', ledger)
+
+        self.assertIn("<11@printer>", ledger)
+        self.assertNotIn("<12@printer>", ledger)
+        self.assertIn("<13@printer>", ledger)
+        self.assertEqual(load_high_water(), ('42', 11))
+
+        mail.uid.side_effect = None
+        mail.uid.return_value = ('OK', [b''])
+        process_new_messages(mail, '42', ledger)
+        mail.uid.assert_called_with('search', None, "UID 12:*")
+
+    def test_new_uid_validity_starts_over(self):
+        with open('temp/imap_last_uid.txt', 'w') as f:
+            f.write("41 14\n")
+        mail = MagicMock()
+        mail.uid.return_value = ('OK', [b''])
+        process_new_messages(mail, '42', MessageLedger(':memory:'))
+        mail.uid.assert_called_once_with('search', None, "UID 1:*")
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,129 @@
+import os
+import json
+import sys
+import atexit
+import tempfile
+import threading
+import subprocess
+import unittest
+import urllib.request
+import urllib.error
+from metrics import Registry, serve, clear_shards
+
+
+class TestMetrics(unittest.TestCase):
+    def setUp(self):
+        self.registry = Registry()
+
+    def test_counter_shards_add_up(self):
+        counter = self.registry.counter('files_total', 'Files.', ('source',))
+
+        def work():
+            for _ in range(1000):
+                counter.inc(labels=('file',))
+            counter.inc(5, labels=('pipeline',))
+
+        threads = [threading.Thread(target=work) for _ in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(counter.values(), {('file',): 8000, ('pipeline',): 40})
+        self.assertIn('files_total{source="file"} 8000', self.registry.render())
+
+    def test_histogram_exposition(self):
+        histogram = self.registry.histogram('latency_seconds', 'Latency.', ('endpoint',), buckets=(0.1, 1))
+        for value in (0.05, 0.1, 0.5, 3):
+            histogram.observe(value, ('printers',))
+        lines = self.registry.render().splitlines()
+        self.assertEqual(lines[:2], ['# HELP latency_seconds Latency.', '# TYPE latency_seconds histogram'])
+        self.assertEqual(lines[2:], [
+            'latency_seconds_bucket{endpoint="printers",le="0.1"} 2',
+            'latency_seconds_bucket{endpoint="printers",le="1"} 3',
+            'latency_seconds_bucket{endpoint="printers",le="+Inf"} 4',
+            'latency_seconds_sum{endpoint="printers"} 3.65',
+            'latency_seconds_count{endpoint="printers"} 4',
+        ])
+
+    def test_gauges_and_callbacks(self):
+        self.registry.gauge('queue_files', 'Queue.', callback=lambda: 3)
+        self.registry.gauge('pool_connections', 'Pool.', ('state',), callback=lambda: {('in_use',): 2, ('idle',): 1})
+        self.registry.counter('waits_total', 'Waits.', callback=lambda: 7)
+        temperature = self.registry.gauge('label_escaping', 'Escaping.', ('name',))
+        temperature.set(1.5, ('say "hi"\n',))
+        text = self.registry.render()
+        self.assertIn('queue_files 3\n', text)
+        self.assertIn('pool_connections{state="idle"} 1\npool_connections{state="in_use"} 2\n', text)
+        self.assertIn('# TYPE waits_total counter\nwaits_total 7\n', text)
+        self.assertIn('label_escaping{name="say \\"hi\\"\\n"} 1.5\n', text)
+        with self.assertRaises(ValueError):
+            self.registry.counter('waits_total', 'Again.')
+
+    def test_listener(self):
+        self.registry.counter('mails_total', 'Mails.').inc(2)
+        server = serve(0, self.registry, host='127.0.0.1')
+        try:
+            url = f"http://127.0.0.1:{server.server_address[1]}"
+            with urllib.request.urlopen(url + '/metrics') as response:
+                self.assertTrue(response.headers['Content-Type'].startswith('text/plain; version=0.0.4'))
+                self.assertIn(b'mails_total 2', response.read())
+            with self.assertRaises(urllib.error.HTTPError):
+                urllib.request.urlopen(url + '/other')
+        finally:
+            server.shutdown()
+            server.server_close()
+
+
+class TestSharedMetrics(unittest.TestCase):
+    # Registries sharing one directory stand in for gunicorn workers.
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.temp_dir.cleanup)
+
+    def worker(self):
+        registry = Registry()
+        registry.counter('requests_total', 'Requests.', ('endpoint',))
+        registry.histogram('latency_seconds', 'Latency.', buckets=(0.1, 1))
+        registry.gauge('pool_in_use', 'In use.')
+        registry.share(self.temp_dir.name, interval=0)
+        self.addCleanup(atexit.unregister, registry.try_write_shard)
+        return registry
+
+    def metric(self, registry, name):
+        return registry._metrics[name]
+
+    def test_scrape_adds_up_all_workers(self):
+        first, second = self.worker(), self.worker()
+        self.metric(first, 'requests_total').inc(2, ('printers',))
+        self.metric(second, 'requests_total').inc(3, ('printers',))
+        self.metric(second, 'requests_total').inc(1, ('login',))
+        self.metric(first, 'latency_seconds').observe(0.05)
+        self.metric(second, 'latency_seconds').observe(0.5)
+        self.metric(first, 'pool_in_use').set(1)
+        self.metric(second, 'pool_in_use').set(2)
+        second.write_shard()
+
+        text = first.render()
+        self.assertIn('requests_total{endpoint="login"} 1\nrequests_total{endpoint="printers"} 5\n', text)
+        self.assertIn('latency_seconds_bucket{le="0.1"} 1\nlatency_seconds_bucket{le="1"} 2\n', text)
+        self.assertIn('latency_seconds_count 2\n', text)
+        self.assertIn('pool_in_use 3\n', text)
+
+    def test_exited_workers_keep_counting_but_not_as_gauges(self):
+        registry = self.worker()
+        process = subprocess.Popen([sys.executable, '-c', ''])
+        process.wait()
+        with open(os.path.join(self.temp_dir.name, f'{process.pid}-1.json'), 'w') as f:
+            json.dump({'pid': process.pid, 'metrics': {'requests_total': [[['printers'], 4]], 'pool_in_use': [[[], 5]]}}, f)
+        text = registry.render()
+        self.assertIn('requests_total{endpoint="printers"} 4\n', text)
+        self.assertNotIn('pool_in_use 5', text)
+
+    def test_clear_shards(self):
+        self.worker()
+        self.assertEqual(clear_shards(self.temp_dir.name), 1)
+        self.assertEqual(os.listdir(self.temp_dir.name), [])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,66 @@
+import os
+import json
+import tempfile
+import unittest
+import datetime
+from unittest.mock import MagicMock, patch
+from model_resolver import ModelResolver
+import databroker
+
+
+class TestModelResolver(unittest.TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.temp_dir.name, 'printer_models.json')
+        self.write({"C452": ["A0P2021"], "C452 (early)": ["A0P2"], "C224": ["A4FM"]}, mtime=1)
+
+    def tearDown(self):
+        self.temp_dir.cleanup()
+
+    def write(self, models, mtime):
+        with open(self.path, 'w') as f:
+            json.dump(models, f)
+        os.utime(self.path, (mtime, mtime))
+
+    def test_longest_prefix_wins(self):
+        resolver = ModelResolver(self.path)
+        self.assertEqual(resolver.resolve('A0P2021012345'), 'C452')
+        self.assertEqual(resolver.resolve('A0P2099012345'), 'C452 (early)')
+        self.assertEqual(resolver.resolve(' a4fm021007478 '), 'C224')
+        self.assertIsNone(resolver.resolve('A0P'))
+        self.assertIsNone(resolver.resolve(''))
+
+    def test_bulk_resolve(self):
+        resolver = ModelResolver(self.path)
+        self.assertEqual(resolver.resolve_many(['A4FM021007478', 'A0P2021012345', 'ZZZZ']),
+                         {'A4FM021007478': 'C224', 'A0P2021012345': 'C452', 'ZZZZ': None})
+
+    def test_reloaded_when_file_changes(self):
+        resolver = ModelResolver(self.path)
+        self.assertFalse(resolver.reload_if_changed())
+        self.write({"C224": ["A4FM"], "C300i": ["AA2K"]}, mtime=2)
+        self.assertEqual(resolver.resolve('AA2K021000001'), 'C300i')
+        self.assertIsNone(resolver.resolve('A0P2021012345'))
+
+        with open(self.path, 'w') as f:
+            f.write('{"C224": ["A4')
+        os.utime(self.path, (3, 3))
+        with self.assertLogs(level='ERROR'):
+            self.assertEqual(resolver.resolve('AA2K021000001'), 'C300i')
+
+    def test_databroker_fills_missing_models(self):
+        cursor = MagicMock()
+        cursor.fetchall.return_value = [
+            {'id': 1, 'serial_number': 'A4FM021007478', 'service_contract': 0, 'tax_id': None, 'model': None},
+            {'id': 2, 'serial_number': 'A0P2021012345', 'service_contract': 0, 'tax_id': None, 'model': 'C452'},
+            {'id': 3, 'serial_number': 'ZZZZ021000001', 'service_contract': 0, 'tax_id': None, 'model': ''},
+        ]
+        records = [{'type': 'counter', 'serial_number': serial, 'date': datetime.date(2023, 10, 3), 'counter_black': 1, 'counter_color': 0}
+                   for serial in ('A4FM021007478', 'A0P2021012345', 'ZZZZ021000001')]
+        with patch.object(databroker, 'model_resolver', ModelResolver(self.path)):
+            databroker.write_records(cursor, records)
+        cursor.executemany.assert_called_once_with("UPDATE printers SET model = %s WHERE id = %s", [('C224', 1)])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,64 @@
+import sqlite3
+import unittest
+from pagination import fetch_keyset_page
+
+PER_PAGE = 10
+
+
+class SqliteCursor:
+    # The pymysql DictCursor interface over sqlite, so the generated SQL runs for real.
+    def __init__(self, connection):
+        self.cursor = connection.cursor()
+        self.statements = []
+
+    def execute(self, sql, params=()):
+        self.statements.append(sql)
+        self.cursor.execute(sql.replace('%s', '?'), params)
+
+    def fetchall(self):
+        names = [column[0] for column in self.cursor.description]
+        return [dict(zip(names, row)) for row in self.cursor.fetchall()]
+
+
+class TestKeysetPagination(unittest.TestCase):
+    def setUp(self):
+        self.connection = sqlite3.connect(':memory:')
+        self.connection.execute("CREATE TABLE printers (id INTEGER PRIMARY KEY, serial_number TEXT)")
+        self.connection.executemany("INSERT INTO printers VALUES (?, ?)",
+                                    [(i, f"{'A4FM' if i % 2 else 'AA2K'}{i:09d}") for i in range(1, 26)])
+        self.cursor = SqliteCursor(self.connection)
+
+    def tearDown(self):
+        self.connection.close()
+
+    def page(self, conditions=(), params=(), after=None, before=None):
+        rows, prev_cursor, next_cursor = fetch_keyset_page(self.cursor, "SELECT id, serial_number FROM printers", conditions, params,
+                                                           'id', 'id', PER_PAGE, after, before)
+        return [row['id'] for row in rows], prev_cursor, next_cursor
+
+    def test_first_page(self):
+        self.assertEqual(self.page(), (list(range(1, 11)), None, 10))
+        self.assertEqual(self.cursor.statements[-1], "SELECT id, serial_number FROM printers ORDER BY id ASC LIMIT %s")
+
+    def test_after_cursor(self):
+        self.assertEqual(self.page(after=10), (list(range(11, 21)), 11, 20))
+
+    def test_last_page_has_no_next_cursor(self):
+        self.assertEqual(self.page(after=20), (list(range(21, 26)), 21, None))
+        self.assertEqual(self.page(after=25), ([], None, None))
+
+    def test_before_pages_are_ascending(self):
+        self.assertEqual(self.page(before=21), (list(range(11, 21)), 11, 20))
+        # Back on the first page there is nothing before it.
+        self.assertEqual(self.page(before=11), (list(range(1, 11)), None, 10))
+        self.assertIn("ORDER BY id DESC", self.cursor.statements[-1])
+
+    def test_conditions_are_combined_with_the_cursor(self):
+        ids, prev_cursor, next_cursor = self.page(["serial_number LIKE %s"], ['A4FM%'], after=9)
+        self.assertEqual((ids, prev_cursor, next_cursor), ([11, 13, 15, 17, 19, 21, 23, 25], 11, None))
+        self.assertEqual(self.cursor.statements[-1],
+                         "SELECT id, serial_number FROM printers WHERE (serial_number LIKE %s) AND (id > %s) ORDER BY id ASC LIMIT %s")
+
+
+if __name__ == "__main__":
+    unittest.main()
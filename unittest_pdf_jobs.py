@@ -0,0 +1,99 @@
+import os
+import time
+import tempfile
+import threading
+import unittest
+from concurrent.futures import ThreadPoolExecutor
+from pdf_jobs import PdfJobs, content_key
+
+HTML = "<html><body>Service report 1</body></html>"
+
+
+class TestPdfJobs(unittest.TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.executor = ThreadPoolExecutor(2)
+        self.rendered = []
+        self.release = threading.Event()
+        self.release.set()
+
+    def tearDown(self):
+        self.release.set()
+        self.executor.shutdown()
+        self.temp_dir.cleanup()
+
+    def render(self, html, path):
+        self.release.wait(5)
+        if 'broken' in html:
+            raise ValueError("broken template")
+        self.rendered.append(html)
+        with open(path, 'wb') as f:
+            f.write(b'%PDF-1.7 ' + html.encode())
+        return path
+
+    def jobs(self, **kwargs):
+        return PdfJobs(self.temp_dir.name, render=self.render, executor=self.executor, **kwargs)
+
+    def finished(self, jobs, job_id):
+        # Polls like the /pdf_jobs/<job id> page does.
+        deadline = time.monotonic() + 5
+        while jobs.status(job_id) == 'pending' and time.monotonic() < deadline:
+            time.sleep(0.01)
+        return jobs.status(job_id)
+
+    def test_same_report_is_rendered_once(self):
+        jobs = self.jobs()
+        self.release.clear()
+        job_id = jobs.submit(HTML)
+        self.assertEqual(job_id, content_key(HTML))
+        self.assertEqual(jobs.status(job_id), 'pending')
+        self.assertEqual(jobs.submit(HTML), job_id)
+        self.release.set()
+
+        self.assertEqual(self.finished(jobs, job_id), 'done')
+        self.assertEqual(jobs.submit(HTML), job_id)
+        self.assertEqual(self.rendered, [HTML])
+        with open(jobs.path(job_id), 'rb') as f:
+            self.assertTrue(f.read().startswith(b'%PDF'))
+        self.assertEqual(jobs.stats()['hits'], 1)
+        self.assertEqual(jobs.stats()['misses'], 1)
+
+    def test_cache_is_shared_between_app_workers(self):
+        job_id = self.jobs().submit(HTML)
+        self.finished(self.jobs(), job_id)
+        other = self.jobs()
+        self.assertEqual(other.status(job_id), 'done')
+        other.submit(HTML)
+        self.assertEqual(self.rendered, [HTML])
+        self.assertIsNone(other.status(content_key("unknown")))
+
+    def test_failed_render_is_reported_and_retried(self):
+        jobs = self.jobs()
+        job_id = jobs.submit("<p>broken</p>")
+        self.assertEqual(self.finished(jobs, job_id), 'failed')
+        self.assertFalse(os.path.exists(jobs.path(job_id)))
+        self.assertEqual(jobs.stats()['failures'], 1)
+
+        jobs.submit("<p>broken</p>")
+        self.assertEqual(self.finished(jobs, job_id), 'failed')
+        self.assertEqual(jobs.stats()['failures'], 2)
+
+    def test_least_recently_used_pdfs_are_pruned(self):
+        jobs = self.jobs(max_files=2)
+        first, second = jobs.submit("<p>1</p>"), jobs.submit("<p>2</p>")
+        self.finished(jobs, first)
+        self.finished(jobs, second)
+        os.utime(jobs.path(first), (1, 1))
+        os.utime(jobs.path(second), (2, 2))
+        jobs.submit("<p>1</p>")
+        third = jobs.submit("<p>3</p>")
+        # Pruning runs in the job's done callback, which may still be running once the PDF exists.
+        self.executor.shutdown()
+
+        self.assertEqual(jobs.status(first), 'done')
+        self.assertIsNone(jobs.status(second))
+        self.assertEqual(jobs.status(third), 'done')
+
+
+if __name__ == "__main__":
+    unittest.main()
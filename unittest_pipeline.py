@@ -0,0 +1,99 @@
+import os
+import tempfile
+import unittest
+from unittest.mock import MagicMock
+import report_parser
+from databroker import IngestBatcher, LatencyHistogram, PipelineServer
+import socket
+import threading
+from ingest_pipeline import PipelineClient, replay_name, is_replay
+
+REPORT = "[Serial Number], A1UG021109838\n[Total Counter],00185186\n"
+FILE_NAME = '2023-10-03-19-58-16-A1UG021109838.txt'
+
+
+class TestPipeline(unittest.TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.temp_dir.name, 'ingest.sock')
+        self.spooled = []
+
+    def tearDown(self):
+        self.temp_dir.cleanup()
+
+    def client(self):
+        return PipelineClient(lambda file_name, content: self.spooled.append(file_name), path=self.path, timeout=5)
+
+    def test_committed_reports_are_acknowledged(self):
+        mock_db = MagicMock()
+        mock_db.cursor.return_value.fetchall.side_effect = [
+            [{'id': 1, 'serial_number': 'A1UG021109838', 'service_contract': 1, 'tax_id': '123', 'model': 'C224'}],
+            [{'id': 1, 'price_black': None, 'price_color': None, 'last_date': None,
+              'last_counter_black': None, 'last_counter_color': None}]]
+        histogram = LatencyHistogram(phases=('pipeline', 'mail_sent'))
+        server = PipelineServer(IngestBatcher(mock_db, flush_interval=60), histogram, path=self.path)
+        server.start()
+        try:
+            client = self.client()
+            done = MagicMock()
+            client.send(FILE_NAME, REPORT, report_parser.parse(REPORT), 1696363096.0, done)
+            self.assertEqual(client.flush(), (1, 0))
+        finally:
+            server.stop()
+
+        done.assert_called_once_with()
+        mock_db.commit.assert_called_once()
+        history = mock_db.cursor.return_value.executemany.call_args_list[0]
+        self.assertEqual(history.args[1][0][1].isoformat(), '2023-10-03')
+        self.assertEqual(self.spooled, [])
+        self.assertIn('pipeline: n=1', histogram.summary())
+
+    def test_failed_batch_is_spooled(self):
+        mock_db = MagicMock()
+        mock_db.commit.side_effect = Exception("deadlock")
+        server = PipelineServer(IngestBatcher(mock_db), LatencyHistogram(phases=('pipeline', 'mail_sent')), path=self.path)
+        server.start()
+        try:
+            client = self.client()
+            client.send(FILE_NAME, REPORT, report_parser.parse(REPORT), None)
+            self.assertEqual(client.flush(), (0, 1))
+        finally:
+            server.stop()
+        self.assertEqual(self.spooled, [FILE_NAME])
+
+    def test_unanswered_reports_are_spooled_as_replays(self):
+        # The databroker takes the report but never answers, it may still commit it.
+        listener = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        listener.bind(self.path)
+        listener.listen()
+
+        def swallow():
+            conn, _ = listener.accept()
+            with conn:
+                conn.makefile('rb').readline()
+                conn.recv(1)
+
+        thread = threading.Thread(target=swallow)
+        thread.start()
+        client = PipelineClient(lambda file_name, content: self.spooled.append(file_name), path=self.path, timeout=0.2)
+        client.send(FILE_NAME, REPORT, report_parser.parse(REPORT), None)
+        self.assertEqual(client.flush(), (0, 1))
+        thread.join()
+        listener.close()
+        self.assertEqual(self.spooled, ['2023-10-03-19-58-16-A1UG021109838.replay.txt'])
+        self.assertTrue(is_replay(self.spooled[0]))
+        self.assertFalse(is_replay(FILE_NAME))
+        self.assertEqual(replay_name(FILE_NAME), self.spooled[0])
+
+    def test_reports_are_spooled_without_databroker(self):
+        client = self.client()
+        done = MagicMock()
+        client.send(FILE_NAME, REPORT, report_parser.parse(REPORT), None, done)
+        done.assert_not_called()
+        self.assertEqual(client.flush(), (0, 1))
+        self.assertEqual(self.spooled, [FILE_NAME])
+        done.assert_called_once_with()
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,53 @@
+import unittest
+import datetime
+import report_parser
+
+
+class TestReportParser(unittest.TestCase):
+    def test_color_counter_report(self):
+        report = report_parser.parse("""
+        [Model Name],Envilab
+        [Serial Number], A4FM021007478
+        [Send Date],01/06/23
+        [Total Counter],00400999
+        [Total Color Counter],00175268
+        [Total Black Counter],00225731
+        [Total Scan/Fax Counter],00058674
+        """)
+        self.assertEqual(report.serial_number, "A4FM021007478")
+        self.assertEqual(report.counter_total, "00400999")
+        self.assertEqual(report.billing_counters(), ("00225731", "00175268"))
+        self.assertEqual(report.timestamp, datetime.datetime(2023, 6, 1))
+        self.assertTrue(report.has_counters)
+        self.assertIsNone(report.error)
+
+    def test_mono_counter_report_bills_total_as_black(self):
+        report = report_parser.parse("[Serial Number], A1UG021109838\n[Total Counter],00185186\n[Total Scan/Fax Counter],00041513\n")
+        self.assertEqual(report.billing_counters(), ("00185186", "0"))
+        self.assertEqual(report.identifier, "A1UG021109838")
+
+    def test_error_report(self):
+        report = report_parser.parse("""
+        Occurred Time :02/12/2023 01:46:21
+        Installed Place :A1UG021109838
+        IP Address :192.168.1.245
+        Error : Misfeed detected. 66-33
+        """)
+        self.assertEqual(report.installed_place, "A1UG021109838")
+        self.assertEqual(report.error, "Misfeed detected. 66-33")
+        self.assertEqual(report.timestamp, datetime.datetime(2023, 12, 2, 1, 46, 21))
+        self.assertEqual(report.identifier, "A1UG021109838")
+        self.assertFalse(report.has_counters)
+
+    def test_unknown_report(self):
+        report = report_parser.parse("Hello,\r\nthis is not a printer report.\r\n")
+        self.assertEqual(report.identifier, "unknown")
+        self.assertIsNone(report.timestamp)
+
+    def test_file_date(self):
+        self.assertEqual(report_parser.file_date("temp/2023-10-03-19-58-16-A1UG021109838.txt"), datetime.date(2023, 10, 3))
+        self.assertIsNone(report_parser.file_date("temp/unknown.txt"))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -20,22 +20,24 @@ class TestProcessFile(unittest.TestCase):
         file_path = "temp/2023-12-02-01-46-31-A1UG021109838.txt"
 
 
-        printer_data = {"id": 1, "tax_id": "1234412444"}
+        printer_data = {"id": 1, "serial_number": "A1UG021109838", "service_contract": False, "tax_id": "1234412444", "model": "C224"}
 
 
-        mock_cursor.fetchone.side_effect = [printer_data, None]
+        mock_cursor.fetchall.return_value = [printer_data]
+        mock_cursor.fetchone.return_value = None
 
 
         process_file(file_path)
 
 
-        mock_cursor.execute.assert_any_call("SELECT id, tax_id FROM printers WHERE serial_number = %s", ("A1UG021109838",))
-        mock_cursor.execute.assert_any_call("SELECT id, times_happend FROM service_requests WHERE printer_id = %s AND service_request = %s AND DATE(request_date) = %s",
+        mock_cursor.execute.assert_any_call("SELECT id, serial_number, service_contract, tax_id, model FROM printers WHERE serial_number IN (%s)", ("A1UG021109838",))
+        mock_cursor.execute.assert_any_call("SELECT id, times_happend FROM service_requests WHERE printer_id = %s AND service_request = %s AND request_day = %s FOR UPDATE",
                                                     (1, "Misfeed detected. 66-33", datetime.date(2023, 12, 2)))
         mock_cursor.execute.assert_any_call("INSERT INTO service_requests (printer_id, tax_id, service_request) VALUES (%s, %s, %s)",
                                                     (1, "1234412444", "Misfeed detected. 66-33"))
 
 
+        mock_db.commit.assert_called_once()
         mock_db.close.assert_called_once()
 
 if __name__ == "__main__":
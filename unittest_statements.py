@@ -0,0 +1,64 @@
+import os
+import datetime
+import tempfile
+import unittest
+import zipfile
+from concurrent.futures import ThreadPoolExecutor
+from unittest.mock import patch
+from billing import PrinterBill, ClientBill
+from statements import build_statements, file_name, generate, template_environment, TEMPLATE
+
+START, END = datetime.date(2023, 10, 1), datetime.date(2023, 10, 31)
+COMPANY = {'company_name': 'EngiLab', 'tax_id': '111', 'address': 'Street 1', 'postal_code': '00-001',
+           'city': 'Warsaw', 'email': 'a@b.c', 'phone': '123'}
+CLIENTS = {'123': {'tax_id': '123', 'company': 'Client & Co', 'address': 'Road 2', 'postal_code': '00-002',
+                   'city': 'Cracow', 'phone': '456', 'email': 'c@d.e'}}
+BILLS = [
+    PrinterBill(1, 'A1UG021109838', '123', 'Client & Co', 1000, 100, 50.0, 25.0, 120.0, 195.0),
+    PrinterBill(2, 'A0P2021000001', '123', 'Client & Co', 10, 0, 0.5, 0.0, 0.0, 0.5),
+    PrinterBill(3, 'AA2J021000002', None, None, 5, 0, 0.0, 0.0, 0.0, 0.0),
+]
+TOTALS = [ClientBill('123', 'Client & Co', 2, 1010, 100, 195.5), ClientBill(None, None, 1, 5, 0, 0.0)]
+COUNTERS = {1: {'id': 1, 'model': 'bizhub C300i', 'last_counter_black': 186186, 'last_counter_color': 4100}}
+
+
+def fake_render(statement):
+    return file_name(statement), b'%PDF-1.7 ' + statement['client']['tax_id'].encode()
+
+
+class TestStatements(unittest.TestCase):
+    def statements(self):
+        return build_statements(COMPANY, CLIENTS, COUNTERS, BILLS, TOTALS, START, END)
+
+    def test_one_statement_per_client(self):
+        statements = self.statements()
+        self.assertEqual(len(statements), 1)
+        statement = statements[0]
+        self.assertEqual([printer['serial_number'] for printer in statement['printers']], ['A1UG021109838', 'A0P2021000001'])
+        self.assertEqual(statement['printers'][0]['counter_black'], 186186)
+        self.assertIsNone(statement['printers'][1]['model'])
+        self.assertEqual(statement['total']['total'], 195.5)
+        self.assertEqual(file_name(statement), 'statement-2023-10-123.pdf')
+
+    def test_template(self):
+        html = template_environment().get_template(TEMPLATE).render(**self.statements()[0])
+        self.assertIn('Monthly Statement 2023-10', html)
+        self.assertIn('Client &amp; Co', html)
+        self.assertIn('bizhub C300i', html)
+        self.assertIn('195.50', html)
+
+    @patch('statements.render_statement', fake_render)
+    def test_output_to_zip_and_directory(self):
+        with tempfile.TemporaryDirectory() as temp_dir:
+            archive = os.path.join(temp_dir, 'statements.zip')
+            generate(self.statements(), archive, executor=ThreadPoolExecutor(2))
+            with zipfile.ZipFile(archive) as f:
+                self.assertEqual(f.read('statement-2023-10-123.pdf'), b'%PDF-1.7 123')
+
+            directory = os.path.join(temp_dir, 'statements')
+            generate(self.statements(), directory, executor=ThreadPoolExecutor(2))
+            self.assertEqual(os.listdir(directory), ['statement-2023-10-123.pdf'])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,67 @@
+import csv
+import io
+import json
+import datetime
+import unittest
+from decimal import Decimal
+from unittest.mock import MagicMock
+from streaming import stream_rows, csv_chunks, ndjson_chunks, json_array_chunks
+
+ROWS = [
+    {'id': 1, 'counter_black_history': 100, 'counter_color_history': None, 'date': datetime.date(2023, 10, 3), 'printers_id': 7},
+    {'id': 2, 'counter_black_history': 150, 'counter_color_history': 20, 'date': datetime.date(2023, 10, 4), 'printers_id': 7},
+    {'id': 3, 'counter_black_history': 180, 'counter_color_history': 25, 'date': datetime.date(2023, 10, 5), 'printers_id': 7},
+]
+COLUMNS = ['id', 'counter_black_history', 'counter_color_history', 'date', 'printers_id']
+
+
+class TestStreaming(unittest.TestCase):
+    def pool(self, rows):
+        pool = MagicMock()
+        cursor = pool.acquire.return_value.cursor.return_value
+        chunks = [rows[i:i + 2] for i in range(0, len(rows), 2)] + [[]]
+        cursor.fetchmany.side_effect = chunks
+        return pool
+
+    def test_rows_are_read_in_chunks_on_a_dedicated_connection(self):
+        pool = self.pool(ROWS)
+        chunks = stream_rows(pool, "SELECT * FROM print_history WHERE date >= %s", [datetime.date(2023, 10, 1)], chunk_rows=2)
+        pool.acquire.assert_not_called()
+
+        self.assertEqual(list(chunks), [ROWS[:2], ROWS[2:]])
+        connection = pool.acquire.return_value
+        connection.cursor.return_value.fetchmany.assert_called_with(2)
+        connection.close.assert_not_called()
+        pool.release.assert_called_once_with(connection)
+
+    def test_abandoned_stream_drops_the_connection(self):
+        pool = self.pool(ROWS)
+        chunks = stream_rows(pool, "SELECT * FROM print_history", chunk_rows=2)
+        next(chunks)
+        chunks.close()
+
+        connection = pool.acquire.return_value
+        connection.close.assert_called_once()
+        pool.release.assert_called_once_with(connection)
+
+    def test_csv(self):
+        body = ''.join(csv_chunks(iter([ROWS[:2], ROWS[2:]]), COLUMNS))
+        rows = list(csv.reader(io.StringIO(body)))
+        self.assertEqual(rows[0], COLUMNS)
+        self.assertEqual(rows[1], ['1', '100', '', '2023-10-03', '7'])
+        self.assertEqual(len(rows), 4)
+        self.assertEqual(''.join(csv_chunks(iter([]), COLUMNS)).strip(), ','.join(COLUMNS))
+
+    def test_json_output(self):
+        lines = ''.join(ndjson_chunks(iter([ROWS[:2], ROWS[2:]]))).splitlines()
+        self.assertEqual([json.loads(line)['id'] for line in lines], [1, 2, 3])
+        self.assertEqual(json.loads(lines[0])['date'], '2023-10-03')
+
+        printers = [{'id': 1, 'price_black': Decimal('0.05')}, {'id': 2, 'price_black': None}]
+        body = ''.join(json_array_chunks(iter([printers[:1], printers[1:]])))
+        self.assertEqual(json.loads(body), [{'id': 1, 'price_black': '0.05'}, {'id': 2, 'price_black': None}])
+        self.assertEqual(json.loads(''.join(json_array_chunks(iter([])))), [])
+
+
+if __name__ == "__main__":
+    unittest.main()
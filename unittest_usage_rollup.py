@@ -0,0 +1,63 @@
+import datetime
+import unittest
+from decimal import Decimal
+from unittest.mock import MagicMock
+from usage_rollup import fold_readings, apply_readings, LOCK_SQL
+
+
+class TestFoldReadings(unittest.TestCase):
+    def test_pages_per_month(self):
+        state = {1: (1000, 100)}
+        months = fold_readings([
+            (1, datetime.date(2023, 9, 28), "1200", "150"),
+            (1, datetime.date(2023, 10, 2), "1300", None),
+            (1, datetime.date(2023, 10, 20), "40", "170"),
+        ], state)
+
+        self.assertEqual(months, {
+            (1, datetime.date(2023, 9, 1)): [datetime.date(2023, 9, 28), 1200, 150, 200, 50, 1],
+            (1, datetime.date(2023, 10, 1)): [datetime.date(2023, 10, 20), 40, 170, 140, 20, 2],
+        })
+        self.assertEqual(state, {1: (40, 170)})
+
+    def test_first_reading_is_the_baseline(self):
+        months = fold_readings([(2, datetime.datetime(2023, 10, 3, 12, 0), 500, 0)], {})
+        self.assertEqual(months, {(2, datetime.date(2023, 10, 1)): [datetime.date(2023, 10, 3), 500, 0, 0, 0, 1]})
+
+
+class TestApplyReadings(unittest.TestCase):
+    def test_printer_rows_are_locked_before_the_state_is_read(self):
+        cursor = MagicMock()
+        cursor.fetchall.return_value = [{'id': 2, 'price_black': None, 'price_color': None, 'last_date': datetime.date(2023, 10, 2),
+                                         'last_counter_black': 1000, 'last_counter_color': 0},
+                                        {'id': 7, 'price_black': None, 'price_color': None, 'last_date': None,
+                                         'last_counter_black': None, 'last_counter_color': None}]
+
+        apply_readings(cursor, [(7, datetime.date(2023, 10, 3), 50, 0), (2, datetime.date(2023, 10, 3), 1200, 0)])
+
+        statements = [call.args for call in cursor.execute.call_args_list]
+        self.assertEqual(statements[0], (LOCK_SQL.format(placeholders='%s, %s'), (2, 7)))
+        self.assertTrue(statements[1][0].rstrip().endswith('FOR SHARE'))
+        self.assertEqual([row[:7] for row in cursor.executemany.call_args.args[1]], [
+            (2, datetime.date(2023, 10, 1), datetime.date(2023, 10, 3), 1200, 0, 200, 0),
+            (7, datetime.date(2023, 10, 1), datetime.date(2023, 10, 3), 50, 0, 0, 0)])
+
+    def test_out_of_order_reading_rebuilds_the_printer(self):
+        cursor = MagicMock()
+        cursor.fetchall.side_effect = [
+            [{'id': 1, 'price_black': Decimal('0.05'), 'price_color': Decimal('0.20'), 'last_date': datetime.date(2023, 10, 20),
+              'last_counter_black': 1300, 'last_counter_color': 170}],
+            [{'id': 1, 'price_black': Decimal('0.05'), 'price_color': Decimal('0.20')}],
+        ]
+        stream = cursor.connection.cursor.return_value
+        stream.__iter__.return_value = iter([(1, datetime.date(2023, 10, 2), 1200, 150), (1, datetime.date(2023, 10, 20), 1300, 170)])
+
+        apply_readings(cursor, [(1, datetime.date(2023, 10, 2), 1200, 150)])
+
+        cursor.execute.assert_any_call("DELETE FROM printer_usage_monthly WHERE printer_id IN (%s)", (1,))
+        self.assertEqual(cursor.executemany.call_args.args[1], [
+            (1, datetime.date(2023, 10, 1), datetime.date(2023, 10, 20), 1300, 170, 100, 20, Decimal('5.00'), Decimal('4.00'), 2)])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,34 @@
+import unittest
+from unittest.mock import patch
+from user_cache import UserCache
+
+
+class TestUserCache(unittest.TestCase):
+    def test_hit_and_miss_counters(self):
+        cache = UserCache(ttl=30)
+        self.assertIsNone(cache.get(1))
+        cache.put(1, {"id": 1, "login": "admin"})
+        self.assertEqual(cache.get(1)["login"], "admin")
+        self.assertEqual(cache.stats()["hits"], 1)
+        self.assertEqual(cache.stats()["misses"], 1)
+
+    def test_returned_row_is_a_copy(self):
+        cache = UserCache(ttl=30)
+        cache.put(1, {"id": 1, "first_login_change_pass": True})
+        cache.get(1)["first_login_change_pass"] = False
+        self.assertTrue(cache.get(1)["first_login_change_pass"])
+
+    def test_invalidate_and_expiry(self):
+        cache = UserCache(ttl=30)
+        cache.put(1, {"id": 1})
+        cache.invalidate(1)
+        self.assertIsNone(cache.get(1))
+
+        with patch('time.monotonic', return_value=0):
+            cache.put(2, {"id": 2})
+        with patch('time.monotonic', return_value=31):
+            self.assertIsNone(cache.get(2))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -20,15 +20,18 @@ class TestProcessFile(unittest.TestCase):
         """
 
         file_path = "temp/2023-10-03-19-58-16-A1UG021109838.txt"
-        printer_data = {"id": 1, "service_contract": True, "tax_id": "1234412444"}
-        mock_cursor.fetchone.return_value = printer_data
+        printer_data = {"id": 1, "serial_number": "A1UG021109838", "service_contract": True, "tax_id": "1234412444", "model": "C224"}
+        # The printer has no printer_usage_monthly row yet.
+        mock_cursor.fetchall.side_effect = [[printer_data], []]
 
-        process_file(file_path)
+        with patch('builtins.open', unittest.mock.mock_open(read_data=file_content)):
+            process_file(file_path)
 
-        mock_cursor.execute.assert_any_call("SELECT id, service_contract, tax_id FROM printers WHERE serial_number = %s", ("A1UG021109838",))
-        mock_cursor.execute.assert_any_call("INSERT INTO print_history (printers_id, date, counter_black_history, counter_color_history) VALUES (%s, %s, %s, %s)",
-                                                    (1, datetime.date(2023, 10, 3), "00185186", "0"))
+        mock_cursor.execute.assert_any_call("SELECT id, serial_number, service_contract, tax_id, model FROM printers WHERE serial_number IN (%s)", ("A1UG021109838",))
+        mock_cursor.executemany.assert_any_call("INSERT INTO print_history (printers_id, date, counter_black_history, counter_color_history) VALUES (%s, %s, %s, %s)",
+                                                         [(1, datetime.date(2023, 10, 3), "00185186", "0")])
 
+        mock_db.commit.assert_called_once()
         mock_db.close.assert_called_once()
 
 if __name__ == "__main__":
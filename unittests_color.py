@@ -33,20 +33,22 @@ class TestProcessFile(unittest.TestCase):
         file_path = "temp/2023-06-22-19-54-27-A4FM021007478.txt"
 
         # Mock the printer data
-        printer_data = {"id": 1, "service_contract": True, "tax_id": "1234412444"}
+        printer_data = {"id": 1, "serial_number": "A4FM021007478", "service_contract": True, "tax_id": "1234412444", "model": "C224"}
 
-        # Mock the fetchone() method to return the printer data
-        mock_cursor.fetchone.return_value = printer_data
+        # Mock the fetchall() method to return the printer data
+        # and no printer_usage_monthly row for it yet
+        mock_cursor.fetchall.side_effect = [[printer_data], []]
 
         # Call the function
         process_file(file_path)
 
         # Check if the correct SQL queries were executed
-        mock_cursor.execute.assert_any_call("SELECT id, service_contract, tax_id FROM printers WHERE serial_number = %s", ("A4FM021007478",))
-        mock_cursor.execute.assert_any_call("INSERT INTO print_history (printers_id, date, counter_black_history, counter_color_history) VALUES (%s, %s, %s, %s)",
-                                                    (1, datetime.date(2023, 6, 22), "00225731", "00175268"))
+        mock_cursor.execute.assert_any_call("SELECT id, serial_number, service_contract, tax_id, model FROM printers WHERE serial_number IN (%s)", ("A4FM021007478",))
+        mock_cursor.executemany.assert_any_call("INSERT INTO print_history (printers_id, date, counter_black_history, counter_color_history) VALUES (%s, %s, %s, %s)",
+                                                         [(1, datetime.date(2023, 6, 22), "00225731", "00175268")])
 
         # Check if the database connection was closed
+        mock_db.commit.assert_called_once()
         mock_db.close.assert_called_once()
 
 if __name__ == "__main__":
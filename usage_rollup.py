@@ -0,0 +1,180 @@
+import datetime
+import argparse
+import logging
+import pymysql.cursors
+from dotenv import load_dotenv
+from migrate import connect
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+# Ingest workers writing readings of the same printer take turns on its row,
+# otherwise both would add pages onto the same last counters. Held until the
+# batch commits. Taken before inserting into print_history: the insert's
+# foreign key check holds a shared lock on the printer rows, and two workers
+# holding it would deadlock upgrading to FOR UPDATE.
+LOCK_SQL = "SELECT id FROM printers WHERE id IN ({placeholders}) ORDER BY id FOR UPDATE"
+
+# Prices and the latest rollup row of each printer, the state new readings
+# are added onto. A locking read, so it sees what the previous holder of the
+# printer locks committed rather than the transaction's older snapshot.
+STATE_SQL = """
+SELECT printers.id, printers.price_black, printers.price_color,
+latest.last_date, latest.last_counter_black, latest.last_counter_color
+FROM printers
+LEFT JOIN printer_usage_monthly latest ON latest.printer_id = printers.id
+AND latest.month = (SELECT MAX(month) FROM printer_usage_monthly WHERE printer_id = printers.id FOR SHARE)
+WHERE printers.id IN ({placeholders})
+FOR SHARE
+"""
+
+UPSERT_SQL = """INSERT INTO printer_usage_monthly (printer_id, month, last_date, last_counter_black, last_counter_color, black_pages, color_pages, black_cost, color_cost, readings) VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
+ON DUPLICATE KEY UPDATE last_date = VALUES(last_date), last_counter_black = VALUES(last_counter_black), last_counter_color = VALUES(last_counter_color),
+black_pages = black_pages + VALUES(black_pages), color_pages = color_pages + VALUES(color_pages),
+black_cost = black_cost + VALUES(black_cost), color_cost = color_cost + VALUES(color_cost), readings = readings + VALUES(readings)"""
+
+
+def as_date(value):
+    return value.date() if isinstance(value, datetime.datetime) else value
+
+
+def counter(value):
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def pages(current, previous):
+    # Same rule as billing.py: a counter that went down was reset, so its
+    # whole reading was printed since the previous one.
+    if current is None or previous is None:
+        return 0
+    return current if current < previous else current - previous
+
+
+def fold_readings(readings, state):
+    # readings are (printer_id, date, black, color), grouped by printer and in
+    # date order. state maps printer_id to its last (black, color) and is
+    # updated in place. Returns {(printer_id, month): [last_date, black, color,
+    # black_pages, color_pages, readings]}.
+    months = {}
+    for printer_id, day, black, color in readings:
+        day = as_date(day)
+        previous_black, previous_color = state.get(printer_id, (None, None))
+        black, color = counter(black), counter(color)
+        row = months.setdefault((printer_id, day.replace(day=1)), [day, None, None, 0, 0, 0])
+        row[3] += pages(black, previous_black)
+        row[4] += pages(color, previous_color)
+        row[5] += 1
+        # A missing counter keeps the last known one.
+        black = previous_black if black is None else black
+        color = previous_color if color is None else color
+        row[0], row[1], row[2] = day, black, color
+        state[printer_id] = (black, color)
+    return months
+
+
+def cost(page_count, price):
+    return None if price is None else page_count * price
+
+
+def write_months(cursor, months, prices):
+    rows = []
+    for (printer_id, month), (last_date, black, color, black_pages, color_pages, readings) in sorted(months.items()):
+        price_black, price_color = prices.get(printer_id, (None, None))
+        rows.append((printer_id, month, last_date, black, color, black_pages, color_pages,
+                     cost(black_pages, price_black), cost(color_pages, price_color), readings))
+    if rows:
+        cursor.executemany(UPSERT_SQL, rows)
+
+
+def lock_printers(cursor, printer_ids):
+    printer_ids = sorted(set(printer_ids))
+    if printer_ids:
+        cursor.execute(LOCK_SQL.format(placeholders=', '.join(['%s'] * len(printer_ids))), tuple(printer_ids))
+    return printer_ids
+
+
+def apply_readings(cursor, readings):
+    # Adds (printer_id, date, black, color) readings that were just inserted
+    # into print_history, inside the same transaction. Callers that may race
+    # on existing printers call lock_printers before the insert; locking again
+    # here costs nothing then.
+    printer_ids = lock_printers(cursor, [reading[0] for reading in readings])
+    if not printer_ids:
+        return
+    placeholders = ', '.join(['%s'] * len(printer_ids))
+    cursor.execute(STATE_SQL.format(placeholders=placeholders), tuple(printer_ids))
+    prices, state, last_dates = {}, {}, {}
+    for row in cursor.fetchall():
+        prices[row['id']] = (row['price_black'], row['price_color'])
+        if row['last_date'] is not None:
+            state[row['id']] = (row['last_counter_black'], row['last_counter_color'])
+            last_dates[row['id']] = row['last_date']
+
+    readings = sorted(readings, key=lambda reading: (reading[0], as_date(reading[1])))
+    # A reading older than what the rollup already holds can't be appended,
+    # those printers are recomputed from their history instead.
+    stale = {reading[0] for reading in readings if reading[0] in last_dates and as_date(reading[1]) < last_dates[reading[0]]}
+    if stale:
+        rebuild(cursor, stale)
+    write_months(cursor, fold_readings([reading for reading in readings if reading[0] not in stale], state), prices)
+
+
+def rebuild(cursor, printer_ids=None):
+    conditions = ["printers_id IS NOT NULL", "date IS NOT NULL"]
+    params = ()
+    if printer_ids is None:
+        cursor.execute("DELETE FROM printer_usage_monthly")
+        cursor.execute("SELECT id, price_black, price_color FROM printers")
+    else:
+        params = tuple(sorted(printer_ids))
+        placeholders = ', '.join(['%s'] * len(params))
+        conditions.append(f"printers_id IN ({placeholders})")
+        cursor.execute(f"DELETE FROM printer_usage_monthly WHERE printer_id IN ({placeholders})", params)
+        cursor.execute(f"SELECT id, price_black, price_color FROM printers WHERE id IN ({placeholders})", params)
+    prices = {row['id']: (row['price_black'], row['price_color']) for row in cursor.fetchall()}
+
+    # Stream the history instead of loading it, only the monthly totals are kept.
+    # Locking, like STATE_SQL, so readings other workers just committed count.
+    stream = cursor.connection.cursor(pymysql.cursors.SSCursor)
+    try:
+        stream.execute(f"SELECT printers_id, date, counter_black_history, counter_color_history FROM print_history "
+                       f"WHERE {' AND '.join(conditions)} ORDER BY printers_id, date, id FOR SHARE", params)
+        months = fold_readings(stream, {})
+    finally:
+        stream.close()
+    write_months(cursor, months, prices)
+    return len(months)
+
+
+def rebuild_if_empty(connection):
+    # Fills the rollup once for databases that had history before it existed.
+    with connection.cursor() as cursor:
+        cursor.execute("SELECT EXISTS (SELECT 1 FROM printer_usage_monthly) AS built, EXISTS (SELECT 1 FROM print_history) AS history")
+        row = cursor.fetchone()
+        if row['built'] or not row['history']:
+            return 0
+        rows = rebuild(cursor)
+    connection.commit()
+    logging.info(f"Built printer_usage_monthly from print_history, {rows} printer months.")
+    return rows
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Maintain the printer_usage_monthly rollup.")
+    parser.add_argument('--rebuild', action='store_true', help="recompute the rollup from print_history")
+    parser.add_argument('--printer', type=int, action='append', metavar='ID', help="only rebuild this printer, can be repeated")
+    args = parser.parse_args()
+    if not args.rebuild:
+        parser.error("nothing to do, pass --rebuild")
+
+    load_dotenv()
+    connection = connect(retries=1)
+    try:
+        with connection.cursor() as cursor:
+            rows = rebuild(cursor, args.printer)
+        connection.commit()
+    finally:
+        connection.close()
+    logging.info(f"Rebuilt printer_usage_monthly, {rows} printer months.")